@@ -0,0 +1,117 @@
+"""
+Benchmark: ノートブックのセクションごとの候補エピソードの絞り込み
+
+合成したエピソード（5テーマ、一部は複数テーマで収集、タグは頻度に偏りのある語彙から2〜4語）で
+sequential_topic_generation と同じ順にセクションを作る流れを再現し、
+- all: 未使用の全エピソードをプロンプトに含める（従来）
+- top-K: select_section_candidates で絞り込んだエピソードのみを含める
+のエピソード一覧部分の文字数（セクションごと・合計）と絞り込みの時間、
+各セクションで選ばれるエピソード（候補のうちセクションのテーマのスコアが高い順に3件と仮定）の
+スコアの平均と候補のタグの種類数を比較する
+
+Usage:
+    python bench_candidate_selection.py --episodes 50 150 300 --top-k 24
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+from agent import _format_episodes_for_llm  # noqa: E402
+from candidate_selector import episode_media_url, select_section_candidates  # noqa: E402
+
+THEME_IDS = ["interest", "place", "first_time", "best_shot", "achievement"]
+LAYOUTS = ["large_photo", "text_only", "small_photo", "medium_photo"]
+EPISODES_PER_TOPIC = 3
+
+
+def make_collected_episodes(count, rng, vocabulary=80):
+    words = [f"タグ{index}" for index in range(vocabulary)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+    by_theme = {theme_id: [] for theme_id in THEME_IDS}
+    for index in range(count):
+        analysis_id = f"media{index // 3}"
+        episode = {
+            "id": f"ep{index}",
+            "analysis_id": analysis_id,
+            "content": "公園で" + "".join(rng.choices(words, weights=weights, k=8)) + "をして楽しそうに遊んでいました。" * 3,
+            "tags": rng.choices(words, weights=weights, k=rng.randint(2, 4)),
+            "media_uri": f"gs://bucket/{analysis_id}.jpg" if rng.random() < 0.8 else None,
+        }
+        for theme_id in rng.sample(THEME_IDS, k=rng.choice([1, 1, 1, 2, 3])):
+            by_theme[theme_id].append(dict(episode, theme_score=round(rng.random(), 3)))
+    return [
+        {"status": "success", "report": {"theme": {"id": theme_id}, "episodes": episodes}}
+        for theme_id, episodes in by_theme.items()
+        if episodes
+    ]
+
+
+def simulate(collected, top_k):
+    all_episodes = []
+    episode_theme_ids = []
+    for theme_data in collected:
+        all_episodes.extend(theme_data["report"]["episodes"])
+        episode_theme_ids.extend([theme_data["report"]["theme"]["id"]] * len(theme_data["report"]["episodes"]))
+
+    used_indices = set()
+    used_media_urls = set()
+    section_chars = []
+    selection_time = 0.0
+    picked_scores = []
+    tag_kinds = []
+    for section, theme_id in enumerate(THEME_IDS):
+        layout = LAYOUTS[section] if section < len(LAYOUTS) else None
+        start = time.perf_counter()
+        if top_k is None:
+            candidates = [index for index in range(len(all_episodes)) if index not in used_indices]
+        elif layout is None:
+            candidates = select_section_candidates(all_episodes, episode_theme_ids, used_indices, top_k=top_k)
+        else:
+            candidates = select_section_candidates(
+                all_episodes, episode_theme_ids, used_indices, theme_id=theme_id,
+                needs_media=layout != "text_only", used_media_urls=used_media_urls, top_k=top_k,
+            )
+        selection_time += time.perf_counter() - start
+        section_chars.append(len(_format_episodes_for_llm(all_episodes, used_indices, candidates)))
+        tag_kinds.append(len({tag for index in candidates for tag in all_episodes[index]["tags"]}))
+        if layout is None:
+            break
+
+        # Geminiの代わりに、候補のうちセクションのテーマのスコアが高いものを選ぶ
+        in_theme = sorted(
+            (index for index in candidates if episode_theme_ids[index] == theme_id),
+            key=lambda index: -all_episodes[index]["theme_score"],
+        )[:EPISODES_PER_TOPIC]
+        picked_scores.extend(all_episodes[index]["theme_score"] for index in in_theme)
+        used_indices.update(in_theme)
+        for index in in_theme:
+            url = episode_media_url(all_episodes[index])
+            if url and layout != "text_only":
+                used_media_urls.add(url)
+                break
+    return section_chars, selection_time, picked_scores, tag_kinds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--episodes", type=int, nargs="+", default=[50, 150, 300])
+    parser.add_argument("--top-k", type=int, default=24)
+    args = parser.parse_args()
+
+    print(f"{'episodes':>8} {'mode':>6} {'chars per section':>40} {'total':>8} {'select ms':>10} {'picked score':>13} {'tag kinds':>10}")
+    for count in args.episodes:
+        collected = make_collected_episodes(count, random.Random(count))
+        for label, top_k in (("all", None), (f"top{args.top_k}", args.top_k)):
+            chars, elapsed, scores, tag_kinds = simulate(collected, top_k)
+            print(
+                f"{count:>8} {label:>6} {' '.join(f'{c:>7}' for c in chars):>40} {sum(chars):>8} "
+                f"{elapsed * 1000:>10.2f} {sum(scores) / max(len(scores), 1):>13.3f} {sum(tag_kinds) / len(tag_kinds):>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Benchmark: モデルティアごとのレイテンシ・コスト・出力妥当性の比較
+
+軽量タスク（動的タイトル、キャプション、写真選定）をティアごとに実行し、
+model_router.CALL_SITE_TIERSの割り当てをデータに基づいて判断するための指標を出力する
+
+Usage:
+    python bench_model_tiers.py --runs 5
+    python bench_model_tiers.py --tiers standard lite --episodes-json episodes.json
+
+Vertex AIへの実呼び出しを行うため、GOOGLE_CLOUD_PROJECT等の認証情報が必要
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+from vertexai.generative_models import GenerativeModel  # noqa: E402
+
+from agent import (  # noqa: E402
+    _generate_caption_for_media,
+    generate_dynamic_title,
+    initialize_vertex_ai,
+    select_best_media_for_best_shot,
+    select_best_photo_with_llm,
+)
+from model_router import get_model_tiers  # noqa: E402
+
+# USD / 1Mトークン (入力, 出力)。料金改定時はここを更新する
+MODEL_PRICING = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+}
+
+SAMPLE_EPISODES = [
+    {
+        "content": "公園の砂場でスコップを使って山を作り、できあがると手をたたいて笑っていた。",
+        "tags": ["砂場遊び", "公園でのひととき", "笑顔"],
+        "media_uri": "https://example.com/photos/sandbox.jpg",
+        "image_urls": ["https://example.com/photos/sandbox.jpg"],
+        "emotion": "楽しい",
+    },
+    {
+        "content": "お風呂でアヒルのおもちゃを浮かべ、水をすくっては何度もかけて遊んでいた。",
+        "tags": ["水遊びに夢中", "お風呂タイム"],
+        "media_uri": "https://example.com/photos/bath.jpg",
+        "image_urls": ["https://example.com/photos/bath.jpg"],
+        "emotion": "夢中",
+    },
+    {
+        "content": "初めてのいちご狩りで、大きないちごを両手で持って真剣な顔でかじっていた。",
+        "tags": ["いちご狩り", "はじめての体験", "おやつタイム"],
+        "media_uri": "https://example.com/videos/strawberry.mp4",
+        "image_urls": ["https://example.com/videos/strawberry.mp4"],
+        "emotion": "真剣",
+    },
+]
+
+SYMBOL_PATTERN = re.compile(r"[*＊\-－_＿【】「」『』]")
+
+
+class MeteredModel:
+    """generate_contentのレイテンシ・トークン数・生の出力を記録するラッパー"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._model = GenerativeModel(model_name)
+        self.calls = []
+
+    def generate_content(self, *args, **kwargs):
+        started = time.monotonic()
+        response = self._model.generate_content(*args, **kwargs)
+        usage = getattr(response, "usage_metadata", None)
+        self.calls.append({
+            "latency": time.monotonic() - started,
+            "input_tokens": getattr(usage, "prompt_token_count", 0) if usage else 0,
+            "output_tokens": getattr(usage, "candidates_token_count", 0) if usage else 0,
+            "text": response.text.strip(),
+        })
+        return response
+
+
+def _is_index_list(text, count, expected):
+    try:
+        numbers = [int(n.strip()) for n in text.split(",")]
+    except ValueError:
+        return False
+    return len(numbers) == expected and all(1 <= n <= count for n in numbers)
+
+
+def build_cases(episodes):
+    """(呼び出し箇所, 実行関数, 生出力の妥当性チェック) のリスト"""
+    theme = {"id": "interest", "title": "今週の興味"}
+    return [
+        (
+            "generate_dynamic_title",
+            lambda model: generate_dynamic_title(episodes, theme, "はなちゃん", model),
+            lambda text: (
+                0 < len(text.replace("タイトル：", "").strip()) <= 8
+                and not SYMBOL_PATTERN.search(text)
+            ),
+        ),
+        (
+            "caption",
+            lambda model: _generate_caption_for_media(
+                episodes[0]["media_uri"], episodes[0]["content"], "はなちゃん", model
+            ),
+            lambda text: 0 < len(text) <= 10,
+        ),
+        (
+            "photo_selection",
+            lambda model: select_best_photo_with_llm(episodes, theme, "はなちゃん", model),
+            lambda text: _is_index_list(text, min(len(episodes), 10), 1),
+        ),
+        (
+            "best_shot_selection",
+            lambda model: select_best_media_for_best_shot(episodes, "はなちゃん", model),
+            lambda text: _is_index_list(text, min(len(episodes) * 2, 15), 2),
+        ),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tiers", nargs="+", default=None, help="比較するティア（省略時は全ティア）")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--episodes-json", help="サンプルエピソードのJSONファイル（リスト）")
+    args = parser.parse_args()
+
+    initialize_vertex_ai()
+
+    episodes = SAMPLE_EPISODES
+    if args.episodes_json:
+        with open(args.episodes_json, encoding="utf-8") as f:
+            episodes = json.load(f)
+
+    tiers = get_model_tiers()
+    selected_tiers = args.tiers or list(tiers)
+
+    print(f"{'call_site':<24} {'tier':<10} {'model':<24} {'p50 ms':>8} {'p95 ms':>8} {'USD/1k calls':>13} {'valid':>7}")
+    for call_site, run, is_valid in build_cases(episodes):
+        for tier in selected_tiers:
+            model_name = tiers.get(tier, tier)
+            model = MeteredModel(model_name)
+            valid = 0
+            for _ in range(args.runs):
+                calls_before = len(model.calls)
+                run(model)
+                # 関数内で例外が握りつぶされた場合は呼び出し記録が増えない
+                if len(model.calls) > calls_before and is_valid(model.calls[-1]["text"]):
+                    valid += 1
+
+            if not model.calls:
+                print(f"{call_site:<24} {tier:<10} {model_name:<24} {'(all calls failed)':>40}")
+                continue
+
+            latencies = sorted(c["latency"] * 1000 for c in model.calls)
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            input_price, output_price = MODEL_PRICING.get(model_name, (0.0, 0.0))
+            cost_per_call = statistics.mean(
+                (c["input_tokens"] * input_price + c["output_tokens"] * output_price) / 1_000_000
+                for c in model.calls
+            )
+            print(
+                f"{call_site:<24} {tier:<10} {model_name:<24} "
+                f"{statistics.median(latencies):>8.0f} {p95:>8.0f} "
+                f"{cost_per_call * 1000:>13.4f} {valid:>3}/{args.runs:<3}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark: 保存済み埋め込みによるテーマの順位付け（エピソードごとの内積 vs 1回の行列積）
+
+合成した埋め込み（768次元、テーマの周辺に分布）を保存形式（int8 / float16）に変換し、
+- 1エピソードあたりの保存サイズ（Firestoreの数値配列との比較）
+- エピソード×テーマの類似度をループで計算した場合と rank_episodes_by_theme（行列積）の処理時間
+- float32で計算した順位との上位10件の一致率と類似度の最大誤差
+を計測する（テーマのクエリ埋め込みはキャッシュ済みの状態で比較）
+
+Usage:
+    python bench_semantic_ranker.py --episodes 200 1000 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "functions"))
+sys.path.insert(1, os.path.join(BENCH_DIR, "..", "..", "media_processing_agent", "functions"))
+
+import numpy as np  # noqa: E402
+
+from episode_embeddings import encode_embedding  # noqa: E402
+from semantic_ranker import decode_embedding, get_theme_embeddings, rank_episodes_by_theme  # noqa: E402
+
+DIM = 768
+THEMES = [{"id": f"theme_{i}", "search_queries": [f"query_{i}"]} for i in range(5)]
+# Firestoreの数値配列は1要素あたり8バイト（倍精度）＋型情報
+FIRESTORE_DOUBLE_BYTES = 9
+
+
+def make_vectors(count, theme_vectors, rng):
+    owners = rng.integers(0, len(theme_vectors), size=count)
+    vectors = theme_vectors[owners] * 0.6 + rng.normal(size=(count, DIM)).astype(np.float32) / np.sqrt(DIM)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_analysis_results(vectors, dtype, episodes_per_doc=3):
+    results = []
+    for start in range(0, len(vectors), episodes_per_doc):
+        embeddings = {
+            f"ep_{start + offset}": encode_embedding(vector, dtype)
+            for offset, vector in enumerate(vectors[start:start + episodes_per_doc])
+        }
+        results.append((f"doc_{start}", {"episode_embeddings": embeddings}))
+    return results
+
+
+def loop_similarities(analysis_results, theme_matrix):
+    similarities = {}
+    for analysis_id, data in analysis_results:
+        for episode_id, stored in data["episode_embeddings"].items():
+            vector = decode_embedding(stored)
+            for column in range(theme_matrix.shape[0]):
+                similarities[(analysis_id, episode_id, column)] = float(np.dot(vector, theme_matrix[column]))
+    return similarities
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--episodes", type=int, nargs="+", default=[200, 1000, 5000])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    theme_vectors = rng.normal(size=(len(THEMES), DIM)).astype(np.float32)
+    theme_vectors /= np.linalg.norm(theme_vectors, axis=1, keepdims=True)
+
+    def embed_fn(texts):
+        return [theme_vectors[int(text.split("_")[1])] for text in texts]
+
+    theme_matrix = get_theme_embeddings(THEMES, embed_fn)
+
+    print(f"bytes/embedding: firestore array {DIM * FIRESTORE_DOUBLE_BYTES}, "
+          f"float16 {len(encode_embedding(theme_vectors[0], 'float16')['data'])}, "
+          f"int8 {len(encode_embedding(theme_vectors[0], 'int8')['data'])}")
+    print(f"{'episodes':>8} {'dtype':>8} {'loop ms':>9} {'matmul ms':>10} {'speedup':>8} {'top10':>6} {'max err':>8}")
+    for count in args.episodes:
+        vectors = make_vectors(count, theme_vectors, rng)
+        exact = vectors @ theme_matrix.T
+        for dtype in ("float16", "int8"):
+            analysis_results = make_analysis_results(vectors, dtype)
+
+            start = time.perf_counter()
+            looped = loop_similarities(analysis_results, theme_matrix)
+            loop_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            ranked = rank_episodes_by_theme(THEMES, analysis_results, embed_fn, threshold=-1.0)
+            matmul_time = time.perf_counter() - start
+
+            overlaps = []
+            for column, theme in enumerate(THEMES):
+                expected = {f"ep_{row}" for row in np.argsort(-exact[:, column])[:10]}
+                got = {episode_id for _, episode_id in list(ranked[theme["id"]])[:10]}
+                overlaps.append(len(expected & got) / 10)
+            max_error = max(
+                abs(similarity - exact[int(episode_id[3:]), column])
+                for (_, episode_id, column), similarity in looped.items()
+            )
+            print(
+                f"{count:>8} {dtype:>8} {loop_time * 1000:>9.1f} {matmul_time * 1000:>10.1f} "
+                f"{loop_time / matmul_time:>7.1f}x {np.mean(overlaps):>6.2f} {max_error:>8.4f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
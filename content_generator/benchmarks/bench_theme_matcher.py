@@ -0,0 +1,98 @@
+"""
+Benchmark: テーママッチング（テーマごとの部分文字列検索 vs ThemeMatcher）
+
+従来方式: テーマごとに本文とタグを小文字化し、クエリごとに `in` で検索
+scored: ThemeMatcher.match_queries（本文とタグを1回ずつ小文字化し、スコアが飽和する3件の一致で打ち切る。
+        collect_episodes_for_themesが使う）
+first: ThemeMatcher.match_queries(limit=1)（従来方式と同じく最初の一致で打ち切る）
+
+合成したエピソード（単語がクエリである確率 --hit-rate）で処理時間を比較し、
+一致したテーマの集合が同じかを確認する
+従来方式は最初の一致で打ち切りスコアも求めないため、一致が多いほど従来方式が有利になる
+
+Usage:
+    python bench_theme_matcher.py --episodes 2000
+    python bench_theme_matcher.py --hit-rate 0.05 0.5
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+from agent import analyze_period_and_themes  # noqa: E402
+from theme_matcher import ThemeMatcher  # noqa: E402
+
+FILLER = ["リビングで", "ママと", "ボールを", "転がして", "にこにこ", "お昼寝のあと", "積み木", "絵本を"]
+
+
+def make_episodes(themes, count, hit_rate, seed=0):
+    rng = random.Random(seed)
+    queries = [query for theme in themes for query in theme["search_queries"]]
+
+    def word():
+        return rng.choice(queries) if rng.random() < hit_rate else rng.choice(FILLER)
+
+    episodes = []
+    for _ in range(count):
+        words = [word() for _ in range(rng.randint(20, 60))]
+        tags = [word() for _ in range(rng.randint(3, 8))]
+        episodes.append({"content": "".join(words), "tags": tags})
+    return episodes
+
+
+def legacy(themes, episodes):
+    matched = []
+    for episode in episodes:
+        themes_for_episode = set()
+        for theme in themes:
+            content = episode.get("content", "").lower()
+            tags = [tag.lower() for tag in episode.get("tags", [])]
+            for search_query in theme.get("search_queries", []):
+                query_lower = search_query.lower()
+                if query_lower in content or any(query_lower in tag for tag in tags):
+                    themes_for_episode.add(theme["id"])
+                    break
+        matched.append(themes_for_episode)
+    return matched
+
+
+def scored(themes, episodes):
+    matcher = ThemeMatcher(themes)
+    return [set(matcher.match_queries(episode)) for episode in episodes]
+
+
+def first(themes, episodes):
+    matcher = ThemeMatcher(themes)
+    return [set(matcher.match_queries(episode, limit=1)) for episode in episodes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--episodes", type=int, default=2000)
+    parser.add_argument("--hit-rate", type=float, nargs="+", default=[0.02, 0.1, 0.5])
+    args = parser.parse_args()
+
+    themes = analyze_period_and_themes("bench", "2025-01-06", "2025-01-12")["report"]["themes"]
+    print(f"{args.episodes} episodes x {len(themes)} themes")
+    labels = ("legacy", "scored", "first")
+    print(f"{'hit rate':>8} " + " ".join(f"{label + ' ms':>12}" for label in labels) + f" {'speedup':>8} {'same':>5}")
+    for hit_rate in args.hit_rate:
+        episodes = make_episodes(themes, args.episodes, hit_rate)
+        timings = {}
+        results = {}
+        for label, fn in zip(labels, (legacy, scored, first)):
+            start = time.perf_counter()
+            results[label] = fn(themes, episodes)
+            timings[label] = time.perf_counter() - start
+        same = results["legacy"] == results["scored"] == results["first"]
+        print(
+            f"{hit_rate:>8.2f} " + " ".join(f"{timings[label] * 1000:>12.1f}" for label in labels) + " "
+            f"{timings['legacy'] / timings['scored']:>7.2f}x {'yes' if same else 'NO':>5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark: ローカルのベクトルストア（総当たり vs IVF）
+
+合成した埋め込み（768次元、クラスタ状に分布）を LocalVectorStore に登録し、
+- 5クエリをまとめた検索の処理時間（絞り込みなし / child_id と撮影日時で絞り込み）
+- 総当たりに対するIVFの recall@10
+- ディスクへの保存・読み込み時間
+を計測する（Vertex AI Vector Searchを使わずに検索の挙動を確認するため）
+
+Usage:
+    python bench_vector_store.py --points 10000 50000 --probes 4 8 16
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+import numpy as np  # noqa: E402
+
+from vector_store import LocalVectorStore  # noqa: E402
+
+DIM = 768
+CHILDREN = 20
+QUERIES = 5
+TOP_K = 10
+
+
+def make_datapoints(count, rng, clusters=200):
+    centers = rng.normal(size=(clusters, DIM)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, size=count)] + rng.normal(size=(count, DIM)).astype(np.float32) * 0.8
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    datapoints = [
+        {
+            "datapoint_id": f"media{index // 3}_ep{index}",
+            "feature_vector": vectors[index],
+            "restricts": [{"namespace": "child_id", "allow_list": [f"child{index % CHILDREN}"]}],
+            "numeric_restricts": [{"namespace": "captured_at", "value_int": 1_700_000_000 + index * 60}],
+        }
+        for index in range(count)
+    ]
+    return vectors, datapoints
+
+
+def timed(fn, runs=5):
+    samples = []
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return result, float(np.median(samples))
+
+
+def recall(expected, got):
+    hits = [len({i for i, _ in e} & {i for i, _ in g}) / max(len(e), 1) for e, g in zip(expected, got)]
+    return float(np.mean(hits))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--probes", type=int, nargs="+", default=[4, 8, 16])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'points':>7} {'index':>10} {'build s':>8} {'search ms':>10} {'filtered ms':>12} {'recall@10':>10}")
+    for count in args.points:
+        vectors, datapoints = make_datapoints(count, rng)
+        queries = (vectors[rng.choice(count, QUERIES)] + rng.normal(size=(QUERIES, DIM)) * 0.02).tolist()
+        start_ts = 1_700_000_000 + count * 60 // 4
+        filters = (
+            [{"namespace": "child_id", "allow_list": ["child3"]}],
+            [
+                {"namespace": "captured_at", "value_int": start_ts, "op": "GREATER_EQUAL"},
+                {"namespace": "captured_at", "value_int": start_ts + count * 60 // 2, "op": "LESS"},
+            ],
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            brute = LocalVectorStore(os.path.join(tmp_dir, "brute"), ivf_lists=-1)
+            start = time.perf_counter()
+            brute.upsert(datapoints)
+            build = time.perf_counter() - start
+            expected, search_time = timed(lambda: brute.search(queries, TOP_K))
+            expected_filtered, filtered_time = timed(lambda: brute.search(queries, TOP_K, *filters))
+            print(f"{count:>7} {'brute':>10} {build:>8.2f} {search_time * 1000:>10.1f} {filtered_time * 1000:>12.1f} {1.0:>10.2f}")
+
+            for probes in args.probes:
+                ivf = LocalVectorStore(os.path.join(tmp_dir, f"ivf{probes}"), ivf_lists=int(np.sqrt(count)), ivf_probes=probes)
+                start = time.perf_counter()
+                ivf.upsert(datapoints)
+                ivf.search(queries[:1], TOP_K)  # IVFの学習
+                build = time.perf_counter() - start
+                got, search_time = timed(lambda: ivf.search(queries, TOP_K))
+                got_filtered, filtered_time = timed(lambda: ivf.search(queries, TOP_K, *filters))
+                print(
+                    f"{count:>7} {'ivf/' + str(probes):>10} {build:>8.2f} {search_time * 1000:>10.1f} "
+                    f"{filtered_time * 1000:>12.1f} {recall(expected, got):>10.2f}"
+                )
+
+            start = time.perf_counter()
+            reloaded = LocalVectorStore(os.path.join(tmp_dir, f"ivf{args.probes[-1]}"))
+            load = time.perf_counter() - start
+            size = sum(
+                os.path.getsize(os.path.join(tmp_dir, f"ivf{args.probes[-1]}", name))
+                for name in os.listdir(os.path.join(tmp_dir, f"ivf{args.probes[-1]}"))
+            )
+            print(f"{'':>7} reload {len(reloaded)} points in {load:.2f}s ({size / 2**20:.0f} MB on disk)")
+
+
+if __name__ == "__main__":
+    main()
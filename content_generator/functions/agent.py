@@ -7,8 +7,8 @@ Geminiでコンテンツを生成してノートブックを作成する
 import os
 import json
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Any
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Optional, Any, Tuple
 # from google.adk.agents import Agent  # Cloud Functions用にコメントアウト
 from google.cloud import firestore
 from google.cloud import aiplatform
@@ -19,6 +19,20 @@ from vertexai.language_models import TextEmbeddingModel
 from dotenv import load_dotenv
 import re
 
+from model_router import get_model
+from llm_cache import get_llm_cache
+from embedding_cache import get_embedding_cache
+from vector_store import get_vector_store
+from candidate_selector import episode_media_url, select_section_candidates
+from theme_matcher import get_theme_matcher, get_theme_set_version, score_matched_queries
+from semantic_ranker import (
+    EMBEDDING_MODEL_NAME,
+    get_similarity_threshold,
+    get_theme_embeddings,
+    is_semantic_matching_enabled,
+    rank_episodes_by_theme,
+)
+
 # 環境変数の読み込み
 load_dotenv()
 
@@ -31,6 +45,8 @@ PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT", "hackason-464007")
 LOCATION = os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1")
 INDEX_ID = os.getenv("VERTEX_AI_INDEX_ID", "")
 INDEX_ENDPOINT_ID = os.getenv("VERTEX_AI_INDEX_ENDPOINT_ID", "")
+# テーマごとにベクトル検索で取得する近傍の数
+VECTOR_SEARCH_TOP_K = int(os.getenv("VECTOR_SEARCH_TOP_K", "20"))
 MODEL_NAME = "gemini-2.5-flash"
 
 # グローバル変数（遅延初期化）
@@ -61,10 +77,19 @@ def get_embedding_model():
     if _embedding_model is None:
         initialize_vertex_ai()
         _embedding_model = TextEmbeddingModel.from_pretrained(
-            "text-embedding-004")
+            EMBEDDING_MODEL_NAME)
     return _embedding_model
 
 
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """文のリストの埋め込みを取得する（埋め込みキャッシュにない文だけを1回の呼び出しで計算する）"""
+    return get_embedding_cache().get_embeddings(
+        EMBEDDING_MODEL_NAME,
+        texts,
+        lambda batch: [embedding.values for embedding in get_embedding_model().get_embeddings(batch)],
+    )
+
+
 def is_video_file(url: str) -> bool:
     """
     URLが動画ファイルかどうかを判定する
@@ -83,6 +108,47 @@ def is_video_file(url: str) -> bool:
     return any(ext in url_lower for ext in video_extensions)
 
 
+# ノートブックの写真に使うレンディションの長辺（px）
+NOTEBOOK_IMAGE_SIZE = 800
+
+
+def get_display_image_url(analysis_data: Dict[str, Any]) -> Optional[str]:
+    """
+    analysis_resultsからノートブックに表示する軽量な画像のURLを選ぶ
+
+    動画はサムネイル、写真は縮小版のJPEGレンディション（未生成の場合は元画像）を使う
+
+    Args:
+        analysis_data: analysis_resultsのドキュメント
+
+    Returns:
+        画像のURL（gs://形式など）、メディアがない場合はNone
+    """
+    media_uri = analysis_data.get('media_uri', '')
+    thumbnail_url = analysis_data.get('thumbnail_url')
+
+    if thumbnail_url and is_video_file(media_uri):
+        # 動画の場合はサムネイルURLを使用
+        return thumbnail_url
+
+    # 写真の場合はNOTEBOOK_IMAGE_SIZE以上で最小のJPEGレンディションを使用
+    renditions = [
+        r for r in analysis_data.get('image_renditions', [])
+        if r.get('format') == 'jpeg' and r.get('url')
+    ]
+    if renditions:
+        large_enough = [
+            r for r in renditions
+            if max(r.get('width', 0), r.get('height', 0)) >= NOTEBOOK_IMAGE_SIZE
+        ]
+        if large_enough:
+            return min(large_enough, key=lambda r: r.get('width', 0) * r.get('height', 0))['url']
+        # 元画像が小さい場合は最大のレンディション
+        return max(renditions, key=lambda r: r.get('width', 0) * r.get('height', 0))['url']
+
+    return media_uri or None
+
+
 def convert_gs_to_https_url(gs_url: str) -> str:
     """
     gs://形式のURLをHTTPS形式のURLに変換する
@@ -119,106 +185,152 @@ def convert_gs_to_https_url(gs_url: str) -> str:
         return gs_url
 
 
+def _split_datapoint_id(datapoint_id: str) -> Tuple[str, str]:
+    """インデクサーのデータポイントID（{media_id}_{episode_id}）を分解する（episode_idは"_"を含まないUUID）"""
+    media_id, _, episode_id = datapoint_id.rpartition("_")
+    return media_id, episode_id
+
+
 def search_similar_episodes(
-    query_embedding: List[float],
+    query_embeddings: List[List[float]],
     child_id: str,
-    start_date: datetime,
-    end_date: datetime,
-    top_k: int = 10
-) -> List[Dict[str, Any]]:
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    top_k: int = 10,
+    media_ids: Optional[List[str]] = None,
+    analysis_results: Optional[List[Tuple[str, Dict[str, Any]]]] = None,
+) -> List[List[Dict[str, Any]]]:
     """
-    ベクトル検索でエピソードを取得
-    
+    ベクトル検索でエピソードを取得（全クエリをベクトルストアの1回の検索で処理）
+
+    データポイントは media_processing_agent の index_episodes が登録したもの
+    （ID: {media_id}_{episode_id}、制約: child_id / media_id、数値制約: captured_at）
+    類似度は内積（正規化済みの埋め込みではコサイン類似度）
+
     Args:
-        query_embedding: 検索クエリの埋め込みベクトル
+        query_embeddings: 検索クエリの埋め込みベクトルのリスト
         child_id: 子供のID
-        start_date: 開始日時
-        end_date: 終了日時
-        top_k: 取得する上位件数
-        
+        start_date: 撮影日時の下限（含む）
+        end_date: 撮影日時の上限（含まない）
+        top_k: クエリごとに取得する上位件数
+        media_ids: 指定時はこれらのanalysis_resultsのエピソードだけを検索
+        analysis_results: 取得済みのanalysis_results（含まれないものだけをFirestoreから取得）
+
     Returns:
-        類似エピソードのリスト
+        クエリごとの類似エピソードのリスト（エピソードにanalysis_id、media_uri、created_at、similarityを付与）
     """
+    if not query_embeddings:
+        return []
     try:
-        from google.cloud import aiplatform_v1
-        
-        # Matching Engine Index Endpoint クライアントを作成
-        index_endpoint_client = aiplatform_v1.MatchingEngineIndexEndpointServiceClient()
-        
-        # Index Endpoint のリソース名を構築
-        index_endpoint_name = (
-            f"projects/{PROJECT_ID}/locations/{LOCATION}/"
-            f"indexEndpoints/{INDEX_ENDPOINT_ID}"
-        )
-        
-        # 日付をUnixタイムスタンプに変換
-        start_timestamp = int(start_date.timestamp())
-        end_timestamp = int(end_date.timestamp())
-        
-        # 検索リクエストを構築
-        deployed_index_id = "deployed_index"  # デプロイされたインデックスのID
-        
-        # 検索を実行
-        response = index_endpoint_client.find_neighbors(
-            request={
-                "index_endpoint": index_endpoint_name,
-                "deployed_index_id": deployed_index_id,
-                "queries": [{
-                    "datapoint": {
-                        "feature_vector": query_embedding,
-                        "restricts": [{
-                            "namespace": "child_id",
-                            "allow_list": [child_id]
-                        }],
-                        "numeric_restricts": [
-                            {
-                                "namespace": "created_at",
-                                "value_int": start_timestamp,
-                                "op": "GREATER_EQUAL"
-                            },
-                            {
-                                "namespace": "created_at", 
-                                "value_int": end_timestamp,
-                                "op": "LESS_EQUAL"
-                            }
-                        ]
-                    },
-                    "neighbor_count": top_k
-                }]
-            }
-        )
-        
-        # 結果からエピソードIDを抽出
-        episode_ids = []
-        if response.nearest_neighbors:
-            for neighbor in response.nearest_neighbors[0].neighbors:
-                episode_ids.append(neighbor.datapoint.datapoint_id)
-        
-        # Firestoreからエピソード情報を取得
-        if episode_ids:
+        restricts = [{"namespace": "child_id", "allow_list": [child_id]}]
+        if media_ids:
+            restricts.append({"namespace": "media_id", "allow_list": list(media_ids)})
+        numeric_restricts = []
+        if start_date:
+            numeric_restricts.append(
+                {"namespace": "captured_at", "value_int": int(start_date.timestamp()), "op": "GREATER_EQUAL"}
+            )
+        if end_date:
+            numeric_restricts.append(
+                {"namespace": "captured_at", "value_int": int(end_date.timestamp()), "op": "LESS"}
+            )
+
+        vector_store = get_vector_store()
+        if vector_store is None:
+            return [[] for _ in query_embeddings]
+        neighbors = vector_store.search(query_embeddings, top_k, restricts, numeric_restricts)
+
+        # クエリごとの (media_id, episode_id, 類似度)
+        neighbors_per_query = [
+            [_split_datapoint_id(datapoint_id) + (similarity,) for datapoint_id, similarity in query_neighbors]
+            for query_neighbors in neighbors
+        ]
+
+        # 近傍のanalysis_resultsは取得済みのものを使い、足りないものだけを1回のバッチ読み取りで取得する
+        documents = dict(analysis_results or [])
+        missing = list(dict.fromkeys(
+            media_id
+            for neighbors in neighbors_per_query
+            for media_id, _, _ in neighbors
+            if media_id not in documents
+        ))
+        if missing:
             db = get_firestore_client()
-            episodes = []
-            
-            for episode_id in episode_ids:
-                doc = db.collection('episodes').document(episode_id).get()
+            analysis_ref = db.collection("analysis_results")
+            for doc in db.get_all(
+                [analysis_ref.document(media_id) for media_id in missing],
+                field_paths=ANALYSIS_RESULT_FIELDS,
+            ):
                 if doc.exists:
-                    episode_data = doc.to_dict()
-                    episodes.append({
-                        'id': episode_id,
-                        'content': episode_data.get('content', ''),
-                        'tags': episode_data.get('vector_tags', []),
-                        'media_source_uri': episode_data.get('media_source_uri', ''),
-                        'created_at': episode_data.get('created_at'),
-                        'emotion': episode_data.get('emotion', '')
-                    })
-            
-            return episodes
-        
-        return []
-        
+                    documents[doc.id] = doc.to_dict()
+        logger.info(
+            f"Vector search: {len(query_embeddings)} queries, "
+            f"{sum(len(neighbors) for neighbors in neighbors_per_query)} neighbors, "
+            f"{len(missing)} analysis_results read"
+        )
+
+        results = []
+        for neighbors in neighbors_per_query:
+            episodes = []
+            for media_id, episode_id, similarity in neighbors:
+                analysis_data = documents.get(media_id)
+                if not analysis_data:
+                    continue
+                episode = next(
+                    (ep for ep in analysis_data.get("episodes", []) if ep.get("id") == episode_id), None
+                )
+                if episode is None:
+                    continue
+                episode_with_meta = episode.copy()
+                episode_with_meta['analysis_id'] = media_id
+                episode_with_meta['media_uri'] = analysis_data.get('media_uri')
+                episode_with_meta['created_at'] = analysis_data.get('captured_at') or analysis_data.get('created_at')
+                episode_with_meta['similarity'] = similarity
+                episodes.append(episode_with_meta)
+            results.append(episodes)
+        return results
+
     except Exception as e:
         logger.error(f"Error in vector search: {str(e)}")
-        return []
+        return [[] for _ in query_embeddings]
+
+
+def search_theme_neighbors(
+    themes: List[Dict[str, Any]],
+    child_id: str,
+    start_date: str,
+    end_date: str,
+    selected_media_ids: Optional[List[str]] = None,
+    analysis_results: Optional[List[Tuple[str, Dict[str, Any]]]] = None,
+) -> Dict[str, Dict[Tuple[str, str], float]]:
+    """
+    全テーマのクエリ埋め込みを1回のベクトル検索で検索し、類似度がしきい値以上のエピソードを返す
+
+    Returns:
+        {theme_id: {(analysis_id, episode_id): 類似度}}（rank_episodes_by_themeと同じ形式）
+    """
+    threshold = get_similarity_threshold()
+    query_embeddings = get_theme_embeddings(themes, embed_texts)
+    if selected_media_ids:
+        # 選択されたメディアは期間を問わない
+        neighbors = search_similar_episodes(
+            query_embeddings.tolist(), child_id, top_k=VECTOR_SEARCH_TOP_K,
+            media_ids=selected_media_ids, analysis_results=analysis_results,
+        )
+    else:
+        neighbors = search_similar_episodes(
+            query_embeddings.tolist(), child_id,
+            _parse_period_date(start_date), _parse_period_date(end_date, end_of_day=True),
+            top_k=VECTOR_SEARCH_TOP_K, analysis_results=analysis_results,
+        )
+    return {
+        theme["id"]: {
+            (episode["analysis_id"], episode.get("id")): round(float(episode["similarity"]), 4)
+            for episode in episodes
+            if episode["similarity"] >= threshold
+        }
+        for theme, episodes in zip(themes, neighbors)
+    }
 
 
 # ========== ツール関数 ==========
@@ -258,6 +370,8 @@ def analyze_period_and_themes(
         end = datetime.strptime(end_date, "%Y-%m-%d")
 
         # テーマと検索クエリを定義（最初の3つは動的タイトル生成）
+        # IDと検索クエリを変更する場合は media_processing_agent/functions/theme_labels.py の THEMES も揃え、
+        # reindex_theme_labels_http で保存済みのテーマラベルを付け直す
         themes = [
             {
                 "id": "interest",
@@ -354,75 +468,160 @@ def analyze_period_and_themes(
         return {"status": "error", "error_message": str(e)}
 
 
-def collect_episodes_by_theme(
-    theme_info: Dict[str, Any], 
-    child_id: str, 
-    start_date: str, 
+def _parse_period_date(value: str, end_of_day: bool = False) -> datetime:
+    """
+    期間の日付文字列をUTCのdatetimeに変換する
+
+    Args:
+        value: YYYY-MM-DD形式またはISO形式の日時
+        end_of_day: YYYY-MM-DD形式の場合に翌日0時（その日の終わり、排他的）を返す
+    """
+    if "T" in value:
+        parsed = datetime.fromisoformat(value)
+    else:
+        parsed = datetime.strptime(value, "%Y-%m-%d")
+        if end_of_day:
+            parsed += timedelta(days=1)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+# ノートブック生成で使うanalysis_resultsのフィールド（それ以外は読み込まない）
+ANALYSIS_RESULT_FIELDS = [
+    "episodes",
+    "media_uri",
+    "thumbnail_url",
+    "captured_at",
+    "created_at",
+    "child_id",
+    "episode_count",
+    "image_renditions",
+    "image_placeholder",
+    "theme_set_version",
+    "episode_embeddings",
+    "embedding_model",
+]
+
+
+def fetch_analysis_results(
+    child_id: str,
+    start_date: str,
     end_date: str,
-    selected_media_ids: Optional[List[str]] = None
-) -> Dict[str, Any]:
+    selected_media_ids: Optional[List[str]] = None,
+) -> List[Tuple[str, Dict[str, Any]]]:
     """
-    テーマに基づいてエピソードを収集する
-    注意: エピソードはanalysis_resultsドキュメント内に含まれている
+    ノートブックの対象となるanalysis_resultsを1度だけ取得する（全テーマで共有する）
+
+    期間指定の場合はchild_idとcaptured_atの範囲で1回のクエリを実行する
+    （複合インデックス analysis_results: child_id ASC, captured_at ASC が必要）
+    選択指定の場合はget_allで1回のバッチ読み取りを行う
+    いずれもANALYSIS_RESULT_FIELDSのフィールドだけを読み込む
 
     Args:
-        theme_info: テーマ情報（ID、タイトル、検索クエリ）
+        child_id: 子供のID
+        start_date: 開始日（YYYY-MM-DD形式、またはISO形式）
+        end_date: 終了日（YYYY-MM-DD形式の場合はその日を含む）
+        selected_media_ids: 選択されたanalysis_resultsのID（指定時はこれらのみを取得し、期間は問わない）
+
+    Returns:
+        (ドキュメントID, ドキュメントのデータ) のリスト
+    """
+    db = get_firestore_client()
+    analysis_ref = db.collection("analysis_results")
+    results = []
+
+    if selected_media_ids:
+        logger.info(f"Filtering analysis results by selected IDs: {selected_media_ids}")
+        # 1回のバッチ読み取り（BatchGetDocuments）でまとめて取得する
+        doc_ids = list(dict.fromkeys(selected_media_ids))
+        docs = db.get_all(
+            [analysis_ref.document(doc_id) for doc_id in doc_ids],
+            field_paths=ANALYSIS_RESULT_FIELDS,
+        )
+        fetched = {doc.id: doc.to_dict() for doc in docs if doc.exists}
+        # get_allは順不同で返すため、選択された順に並べ直す
+        results = [(doc_id, fetched[doc_id]) for doc_id in doc_ids if doc_id in fetched]
+        reads = len(doc_ids)
+    else:
+        start = _parse_period_date(start_date)
+        end = _parse_period_date(end_date, end_of_day=True)
+        query = (
+            analysis_ref.where("child_id", "==", child_id)
+            .where("captured_at", ">=", start)
+            .where("captured_at", "<", end)
+            .select(ANALYSIS_RESULT_FIELDS)
+        )
+        results = [(doc.id, doc.to_dict()) for doc in query.stream()]
+        # 結果が0件のクエリも1読み取りとして課金される
+        reads = max(len(results), 1)
+
+    logger.info(
+        f"Fetched {len(results)} analysis results for child {child_id} "
+        f"({start_date} to {end_date}): {reads} document reads"
+    )
+    return results
+
+
+def collect_episodes_for_themes(
+    themes: List[Dict[str, Any]],
+    child_id: str,
+    start_date: str,
+    end_date: str,
+    selected_media_ids: Optional[List[str]] = None,
+    analysis_results: Optional[List[Tuple[str, Dict[str, Any]]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    全テーマのエピソードを1回の走査で収集する
+    保存時に付与されたテーマラベル（theme_set_versionがthemesと同じ場合）をそのまま参照し、
+    ラベルがないエピソードは本文とタグをThemeMatcherで照合して、一致した全テーマに振り分ける
+    保存済みの埋め込みがある場合は、テーマとの類似度がしきい値以上のエピソードも加える
+    （埋め込みが保存されていないanalysis_resultsはVector Searchの近傍で補う）
+
+    Args:
+        themes: テーマ情報のリスト（ID、タイトル、検索クエリ）
         child_id: 子供のID
         start_date: 開始日
         end_date: 終了日
         selected_media_ids: 選択されたanalysis_resultsのID（指定時はこれらのみを対象）
+        analysis_results: fetch_analysis_resultsで取得済みの結果（Noneの場合はここで取得）
 
     Returns:
-        収集されたエピソード
+        テーマごとのcollect_episodes_by_themeと同じ形式の結果（themesと同じ順）
+        各エピソードにはテーマのスコア（theme_score、保存時のラベルまたは検索クエリの一致による0〜1）と、
+        照合した場合は一致したクエリ（theme_matches）、埋め込みで振り分けた場合は類似度（theme_similarity）を付与する
+        類似度は尺度が異なるためtheme_scoreには混ぜない（類似度だけで振り分けたエピソードのtheme_scoreは0）
     """
     try:
-        logger.info(f"Collecting episodes for theme: {theme_info['title']}")
-
-        db = get_firestore_client()
+        if analysis_results is None:
+            analysis_results = fetch_analysis_results(child_id, start_date, end_date, selected_media_ids)
 
-        # 日付をパース
-        start = (
-            datetime.fromisoformat(start_date)
-            if "T" in start_date
-            else datetime.strptime(start_date, "%Y-%m-%d")
-        )
-        end = (
-            datetime.fromisoformat(end_date)
-            if "T" in end_date
-            else datetime.strptime(end_date, "%Y-%m-%d")
-        )
-
-        # analysis_resultsコレクションからエピソードを取得
-        analysis_ref = db.collection("analysis_results")
-        
-        # selected_media_idsが指定されている場合は、それらのanalysis_resultsのみを取得
-        if selected_media_ids:
-            logger.info(f"Filtering analysis results by selected IDs: {selected_media_ids}")
-            # IDでフィルタリング
-            # Firestoreの制限によりinクエリは最大10件までなので、バッチ処理
-            all_analysis_results = []
-            for i in range(0, len(selected_media_ids), 10):
-                batch_ids = selected_media_ids[i:i+10]
-                logger.info(f"Querying analysis_results with IDs in: {batch_ids}")
-                # ドキュメントIDで直接取得
-                for doc_id in batch_ids:
-                    doc = analysis_ref.document(doc_id).get()
-                    if doc.exists:
-                        all_analysis_results.append(doc)
-            logger.info(f"Total analysis results found: {len(all_analysis_results)}")
-        else:
-            # 通常の期間ベースの取得
-            logger.info(f"Getting all analysis results for child_id: {child_id}")
-            all_analysis_results = analysis_ref.where("child_id", "==", child_id).stream()
-
-        # analysis_resultsからエピソードを抽出してテーママッチング
-        episodes = []
+        matcher = get_theme_matcher(themes)
+        # 保存時にmedia_processing_agentが付与したラベルは、テーマ定義が同じ場合のみ使う
+        theme_set_version = get_theme_set_version(themes)
+        episodes_by_theme: Dict[str, List[Dict[str, Any]]] = {theme["id"]: [] for theme in themes}
         total_analysis_processed = 0
-        
-        for doc in all_analysis_results:
+        labelled_analysis = 0
+
+        # 保存済みの埋め込みとテーマのクエリ埋め込みの類似度（1回の行列積）でも振り分ける
+        semantic_hits: Dict[str, Dict[Tuple[str, str], float]] = {}
+        if is_semantic_matching_enabled():
+            try:
+                semantic_hits = rank_episodes_by_theme(themes, analysis_results, embed_texts)
+                # 埋め込みを保存する前のanalysis_resultsはVector Searchで補う（全テーマで1回の検索）
+                if get_vector_store() is not None and any(not data.get("episode_embeddings") for _, data in analysis_results):
+                    vector_hits = search_theme_neighbors(
+                        themes, child_id, start_date, end_date, selected_media_ids, analysis_results
+                    )
+                    for theme_id, hits in vector_hits.items():
+                        merged = semantic_hits.setdefault(theme_id, {})
+                        for key, similarity in hits.items():
+                            merged[key] = max(merged.get(key, similarity), similarity)
+            except Exception as e:
+                logger.warning(f"Semantic theme ranking failed, using keyword matching only: {e}")
+        
+        for analysis_id, analysis_data in analysis_results:
             total_analysis_processed += 1
-            analysis_data = doc.to_dict()
-            analysis_id = doc.id
             
             # captured_atまたはcreated_atを使用して日付を確認
             analysis_date = analysis_data.get("captured_at") or analysis_data.get("created_at")
@@ -431,70 +630,112 @@ def collect_episodes_by_theme(
             if total_analysis_processed <= 3:
                 logger.info(f"Processing analysis_result {analysis_id}: media_uri={analysis_data.get('media_uri')}, episode_count={analysis_data.get('episode_count', 0)}")
 
-            # analysis_dateが存在し、期間内かチェック（selected_media_idsがある場合はスキップ）
-            if analysis_date:
-                if isinstance(analysis_date, str):
-                    analysis_date = datetime.fromisoformat(analysis_date)
-                
-                # selected_media_idsが指定されている場合は期間チェックをスキップ
-                if selected_media_ids or (start <= analysis_date <= end):
-                    # analysis_results内のepisodes配列を処理
-                    analysis_episodes = analysis_data.get("episodes", [])
+            # 期間はクエリで絞り込み済み（selected_media_idsがある場合は期間を問わない）
+            if not analysis_date:
+                continue
+            if isinstance(analysis_date, str):
+                analysis_date = datetime.fromisoformat(analysis_date)
+
+            # 動画はサムネイル、写真は縮小版のレンディションを使用
+            display_url = get_display_image_url(analysis_data)
+            labelled = analysis_data.get("theme_set_version") == theme_set_version
+            labelled_analysis += labelled
+
+            # analysis_results内のepisodes配列を処理
+            for episode in analysis_data.get("episodes", []):
+                if labelled:
+                    # 保存時に付与されたラベルとスコアを参照する
+                    theme_scores = episode.get("theme_scores", {})
+                    themed = {
+                        theme_id: (theme_scores.get(theme_id, 0.0), None)
+                        for theme_id in episode.get("theme_labels", [])
+                        if theme_id in episodes_by_theme
+                    }
+                else:
+                    # いずれかの検索クエリがコンテンツまたはタグに含まれているテーマ
+                    themed = {
+                        theme_id: (score_matched_queries(theme_matches), theme_matches)
+                        for theme_id, theme_matches in matcher.match_queries(episode).items()
+                    }
+
+                # 類似度で振り分けたテーマを加える（類似度はtheme_similarityとして別に付与する）
+                for theme_id, hits in semantic_hits.items():
+                    if (analysis_id, episode.get("id")) in hits and theme_id not in themed:
+                        themed[theme_id] = (0.0, None)
+
+                for theme_id, (theme_score, theme_matches) in themed.items():
+                    # エピソードに追加情報を付与
+                    episode_with_meta = episode.copy()
+                    episode_with_meta['analysis_id'] = analysis_id
+                    episode_with_meta['media_uri'] = analysis_data.get('media_uri')
+                    episode_with_meta['child_id'] = analysis_data.get('child_id')
+                    episode_with_meta['created_at'] = analysis_date
+                    episode_with_meta['image_urls'] = [display_url] if display_url else []
+                    if analysis_data.get('image_placeholder'):
+                        episode_with_meta['image_placeholder'] = analysis_data['image_placeholder']
+                    episode_with_meta['theme_score'] = theme_score
+                    similarity = semantic_hits.get(theme_id, {}).get((analysis_id, episode.get("id")))
+                    if similarity is not None:
+                        episode_with_meta['theme_similarity'] = similarity
+                    if theme_matches is not None:
+                        episode_with_meta['theme_matches'] = theme_matches
                     
-                    for episode in analysis_episodes:
-                        # 検索クエリとのマッチングをチェック
-                        content = episode.get("content", "").lower()
-                        tags = [tag.lower() for tag in episode.get("tags", [])]
-                        
-                        # いずれかの検索クエリがコンテンツまたはタグに含まれているか
-                        matches = False
-                        for search_query in theme_info.get("search_queries", []):
-                            query_lower = search_query.lower()
-                            if query_lower in content or any(query_lower in tag for tag in tags):
-                                matches = True
-                                break
-                        
-                        if matches:
-                            # エピソードに追加情報を付与
-                            episode_with_meta = episode.copy()
-                            episode_with_meta['analysis_id'] = analysis_id
-                            episode_with_meta['media_uri'] = analysis_data.get('media_uri')
-                            episode_with_meta['child_id'] = analysis_data.get('child_id')
-                            episode_with_meta['created_at'] = analysis_date
-                            
-                            # 動画の場合はサムネイルURLを使用、それ以外はmedia_uriを使用
-                            media_uri = analysis_data.get('media_uri', '')
-                            thumbnail_url = analysis_data.get('thumbnail_url')
-                            
-                            if thumbnail_url and is_video_file(media_uri):
-                                # 動画の場合はサムネイルURLを使用
-                                episode_with_meta['image_urls'] = [thumbnail_url]
-                            else:
-                                # 画像の場合は通常のmedia_uriを使用
-                                episode_with_meta['image_urls'] = [media_uri] if media_uri else []
-                            
-                            episodes.append(episode_with_meta)
-                            logger.info(f"Episode from analysis {analysis_id} matches theme '{theme_info['title']}'")
-        
-        logger.info(f"Processed {total_analysis_processed} analysis results, found {len(episodes)} episodes matching theme")
-
-        if len(episodes) == 0:
-            logger.warning(f"No episodes found for theme '{theme_info['title']}' with child_id={child_id}")
-            if selected_media_ids:
-                logger.warning(f"Selected media IDs were: {selected_media_ids}")
+                    episodes_by_theme[theme_id].append(episode_with_meta)
         
-        return {
-            "status": "success",
-            "report": {
-                "theme": theme_info,
-                "episodes": episodes,
-                "episode_count": len(episodes),
-            },
-        }
+        logger.info(
+            f"Used ingestion-time theme labels for {labelled_analysis}/{total_analysis_processed} analysis results "
+            f"(theme set {theme_set_version}, the rest matched by search queries)"
+        )
+        results = []
+        for theme in themes:
+            episodes = episodes_by_theme[theme["id"]]
+            logger.info(f"Processed {total_analysis_processed} analysis results, found {len(episodes)} episodes matching theme '{theme['title']}'")
+            if len(episodes) == 0:
+                logger.warning(f"No episodes found for theme '{theme['title']}' with child_id={child_id}")
+                if selected_media_ids:
+                    logger.warning(f"Selected media IDs were: {selected_media_ids}")
+            results.append({
+                "status": "success",
+                "report": {
+                    "theme": theme,
+                    "episodes": episodes,
+                    "episode_count": len(episodes),
+                },
+            })
+        return results
 
     except Exception as e:
-        logger.error(f"Error in collect_episodes_by_theme: {str(e)}")
-        return {"status": "error", "error_message": str(e)}
+        logger.error(f"Error in collect_episodes_for_themes: {str(e)}")
+        return [{"status": "error", "error_message": str(e)} for _ in themes]
+
+
+def collect_episodes_by_theme(
+    theme_info: Dict[str, Any], 
+    child_id: str, 
+    start_date: str, 
+    end_date: str,
+    selected_media_ids: Optional[List[str]] = None,
+    analysis_results: Optional[List[Tuple[str, Dict[str, Any]]]] = None,
+) -> Dict[str, Any]:
+    """
+    テーマに基づいてエピソードを収集する
+    注意: エピソードはanalysis_resultsドキュメント内に含まれている
+
+    Args:
+        theme_info: テーマ情報（ID、タイトル、検索クエリ）
+        child_id: 子供のID
+        start_date: 開始日
+        end_date: 終了日
+        selected_media_ids: 選択されたanalysis_resultsのID（指定時はこれらのみを対象）
+        analysis_results: fetch_analysis_resultsで取得済みの結果（Noneの場合はここで取得）
+
+    Returns:
+        収集されたエピソード
+    """
+    logger.info(f"Collecting episodes for theme: {theme_info['title']}")
+    return collect_episodes_for_themes(
+        [theme_info], child_id, start_date, end_date, selected_media_ids, analysis_results
+    )[0]
 
 
 def generate_dynamic_title(
@@ -750,7 +991,8 @@ def select_best_photo_with_llm(
         # エピソードの情報を整理
         photo_candidates = []
         for i, episode in enumerate(episodes_with_photos[:10]):  # 最大10枚まで
-            photo_url = episode.get("media_uri") or (episode["image_urls"][0] if episode.get("image_urls") else None)
+            # image_urlsは軽量なサムネイル・レンディションなので優先する
+            photo_url = (episode["image_urls"][0] if episode.get("image_urls") else None) or episode.get("media_uri")
             if photo_url:
                 photo_candidates.append({
                     "index": i,
@@ -803,7 +1045,10 @@ def select_best_photo_with_llm(
     except Exception as e:
         logger.error(f"Error in select_best_photo_with_llm: {str(e)}")
         # エラーの場合は最初の写真を返す
-        return episodes_with_photos[0].get("media_uri") or episodes_with_photos[0]["image_urls"][0] if episodes_with_photos else None
+        if not episodes_with_photos:
+            return None
+        first = episodes_with_photos[0]
+        return (first["image_urls"][0] if first.get("image_urls") else None) or first.get("media_uri")
 
 
 def llm_based_episode_distribution(
@@ -1045,7 +1290,7 @@ def generate_topic_content(
 
         # Geminiモデルを初期化
         initialize_vertex_ai()
-        model = GenerativeModel(MODEL_NAME)
+        model = get_model("topic_content")
 
         # プロンプトを構築（名前の一貫性を保つ）
         child_name = child_info.get("nickname") or child_info.get("name", "お子さん")
@@ -1058,7 +1303,9 @@ def generate_topic_content(
         
         # 動的タイトル生成（必要な場合）
         if theme.get("title_generation", False) and theme.get("title") is None:
-            dynamic_title = generate_dynamic_title(episodes, theme, child_name, model)
+            dynamic_title = generate_dynamic_title(
+                episodes, theme, child_name, get_model("generate_dynamic_title")
+            )
             theme = theme.copy()  # 元のthemeを変更しないようにコピー
             theme["title"] = dynamic_title
         
@@ -1158,7 +1405,9 @@ def generate_topic_content(
             # ベストショットの場合は特別な選定ロジック（複数選択）
             if is_best_shot_section and all_period_episodes:
                 logger.info("Using special best shot selection from all period media")
-                best_shots = select_best_media_for_best_shot(all_period_episodes, child_name, model)
+                best_shots = select_best_media_for_best_shot(
+                    all_period_episodes, child_name, get_model("best_shot_selection")
+                )
                 if best_shots:
                     # 最初のものをメイン写真として使用
                     photo = best_shots[0]
@@ -1185,7 +1434,9 @@ def generate_topic_content(
                 # 写真が見つからない場合、LLMによる選定を試行
                 if not photo:
                     logger.info(f"No photo found for theme '{theme['title']}', attempting LLM selection")
-                    selected_photo = select_best_photo_with_llm(episodes, theme, child_name, model)
+                    selected_photo = select_best_photo_with_llm(
+                        episodes, theme, child_name, get_model("photo_selection")
+                    )
                     if selected_photo:
                         photo = selected_photo
                         logger.info(f"Successfully selected photo with LLM")
@@ -1203,9 +1454,9 @@ def generate_topic_content(
                         # ランダムに写真を選択（または最初の写真を使用）
                         import random
                         random_episode = random.choice(episodes_with_photos[:10])  # 最初の10件から選択
-                        photo = random_episode.get("media_uri") or (
+                        photo = (
                             random_episode["image_urls"][0] if random_episode.get("image_urls") else None
-                        )
+                        ) or random_episode.get("media_uri")
                         logger.info(f"Selected photo from period episodes: {photo[:50] if photo else 'None'}")
             
             # 最終確認：写真が必要なレイアウトなのに写真がない場合の警告
@@ -1306,7 +1557,7 @@ def generate_topic_content(
 キャプション：
 """
                     
-                    caption_response = model.generate_content(caption_prompt)
+                    caption_response = get_model("caption").generate_content(caption_prompt)
                     caption = caption_response.text.strip().replace("キャプション：", "").strip()
                 except Exception as e:
                     logger.error(f"Error generating caption: {str(e)}")
@@ -1440,7 +1691,8 @@ def sequential_topic_generation(
     try:
         # Geminiモデルを初期化
         initialize_vertex_ai()
-        model = GenerativeModel(MODEL_NAME)
+        model = get_model("sequential_topic")
+        caption_model = get_model("caption")
         
         # 子供の名前を取得
         child_name = child_info.get("nickname") or child_info.get("name", "お子さん")
@@ -1448,13 +1700,14 @@ def sequential_topic_generation(
             if not (child_name.endswith("ちゃん") or child_name.endswith("くん") or child_name.endswith("さん")):
                 child_name = f"{child_name}ちゃん"
         
-        # 全エピソードを収集
+        # 全エピソードを収集（収集元のテーマIDも同じ順で保持する）
         all_episodes = []
+        episode_theme_ids = []
         for theme_data in all_collected_episodes:
-            if "report" in theme_data:
-                all_episodes.extend(theme_data["report"]["episodes"])
-            else:
-                all_episodes.extend(theme_data.get("episodes", []))
+            data = theme_data["report"] if "report" in theme_data else theme_data
+            episodes = data.get("episodes", [])
+            all_episodes.extend(episodes)
+            episode_theme_ids.extend([data.get("theme", {}).get("id")] * len(episodes))
         
         logger.info(f"sequential_topic_generation: Total episodes collected: {len(all_episodes)}")
         
@@ -1462,6 +1715,7 @@ def sequential_topic_generation(
         generated_topics = []
         used_episode_ids = set()
         used_media_urls = set()
+        total_prompt_chars = 0
         
         layout_types = ["large_photo", "text_only", "small_photo", "medium_photo", "center"]
         
@@ -1472,6 +1726,7 @@ def sequential_topic_generation(
             if i == 4:  # 5番目のセクション（まとめ）
                 # トピックの内容を改行で結合
                 topics_text = "\n".join([f"- {t['title']}: {t['content']}" for t in generated_topics])
+                candidates = select_section_candidates(all_episodes, episode_theme_ids, used_episode_ids)
                 
                 summary_prompt = f"""
 今週の{child_name}の活動をまとめてください。
@@ -1480,7 +1735,7 @@ def sequential_topic_generation(
 {topics_text}
 
 【未使用のエピソード】
-{_format_episodes_for_llm(all_episodes, used_episode_ids)}
+{_format_episodes_for_llm(all_episodes, used_episode_ids, candidates)}
 
 【要求】
 - 150-200文字で今週全体を総括
@@ -1489,7 +1744,12 @@ def sequential_topic_generation(
 
 まとめ文章のみ出力：
 """
-                response = model.generate_content(summary_prompt)
+                total_prompt_chars += len(summary_prompt)
+                logger.info(
+                    f"Section {i+1} prompt: {len(summary_prompt)} chars, "
+                    f"{len(candidates)}/{len(all_episodes)} candidate episodes"
+                )
+                response = get_model("weekly_summary").generate_content(summary_prompt)
                 summary_content = response.text.strip()
                 
                 topic = {
@@ -1511,6 +1771,16 @@ def sequential_topic_generation(
                     for j, t in enumerate(generated_topics)
                 ])
             
+            # Geminiに送るエピソードを関連度・メディアの有無・多様性で上位K件に絞り込む
+            candidates = select_section_candidates(
+                all_episodes,
+                episode_theme_ids,
+                used_episode_ids,
+                theme_id=theme.get("id"),
+                needs_media=layout != "text_only",
+                used_media_urls=used_media_urls,
+            )
+
             # LLMにトピック生成を依頼
             topic_prompt = f"""
 あなたは{child_name}の週間ノートブックの編集者です。
@@ -1521,7 +1791,7 @@ def sequential_topic_generation(
 - テーマヒント: {theme.get('prompt_hint', '')}
 
 【利用可能なエピソード】
-{_format_episodes_for_llm(all_episodes, used_episode_ids)}
+{_format_episodes_for_llm(all_episodes, used_episode_ids, candidates)}
 
 【既に作成済みのトピック】
 {previous_topics_summary if previous_topics_summary else "まだトピックは作成されていません"}
@@ -1542,6 +1812,11 @@ def sequential_topic_generation(
     "reasoning": "なぜこのエピソードを選んだか"
 }}
 """
+            total_prompt_chars += len(topic_prompt)
+            logger.info(
+                f"Section {i+1} prompt: {len(topic_prompt)} chars, "
+                f"{len(candidates)}/{len(all_episodes)} candidate episodes"
+            )
             
             response = model.generate_content(topic_prompt)
             response_text = response.text.strip()
@@ -1571,7 +1846,7 @@ def sequential_topic_generation(
                 media_idx = topic_plan["selected_media_index"]
                 if 0 <= media_idx < len(all_episodes):
                     episode = all_episodes[media_idx]
-                    photo = episode.get("media_uri") or episode.get("media_source_uri") or (episode.get("image_urls", [None])[0] if episode.get("image_urls") else None)
+                    photo = episode_media_url(episode)
                     logger.info(f"Topic {i+1}: Selected media from episode {media_idx}: {photo}")
                     
                     if photo and photo not in used_media_urls:
@@ -1590,13 +1865,14 @@ def sequential_topic_generation(
                 "subtitle": topic_plan.get("abstract_theme") if layout == "large_photo" else None,
                 "content": topic_plan["content"],
                 "photo": photo,
-                "caption": _generate_caption_for_media(photo, topic_plan["content"], child_name, model) if photo and layout in ["small_photo", "medium_photo"] else None,
+                "caption": _generate_caption_for_media(photo, topic_plan["content"], child_name, caption_model) if photo and layout in ["small_photo", "medium_photo"] else None,
                 "generated": True
             }
             
             generated_topics.append(topic)
             logger.info(f"Generated topic {i+1}: {topic['title']} - Photo: {photo if photo else 'None'} - {topic_plan['reasoning']}")
         
+        logger.info(f"sequential_topic_generation: {total_prompt_chars} prompt chars over {len(generated_topics)} sections")
         return generated_topics
         
     except Exception as e:
@@ -1604,10 +1880,16 @@ def sequential_topic_generation(
         return []
 
 
-def _format_episodes_for_llm(episodes: List[Dict[str, Any]], used_indices: set) -> str:
-    """エピソードをLLM用にフォーマット"""
+def _format_episodes_for_llm(
+    episodes: List[Dict[str, Any]],
+    used_indices: set,
+    candidate_indices: Optional[List[int]] = None,
+) -> str:
+    """エピソードをLLM用にフォーマット（candidate_indicesを指定した場合はその位置のエピソードのみ、その順で）"""
     formatted = []
-    for i, ep in enumerate(episodes):
+    indices = range(len(episodes)) if candidate_indices is None else candidate_indices
+    for i in indices:
+        ep = episodes[i]
         if i not in used_indices:
             media_type = "動画" if ep.get("media_uri") and is_video_file(ep["media_uri"]) else "写真" if ep.get("media_uri") or ep.get("image_urls") else "なし"
             formatted.append(
@@ -1622,14 +1904,14 @@ def _find_unused_media(episodes: List[Dict[str, Any]], used_urls: set, preferred
     
     # まず優先エピソードから探す
     for ep in preferred_episodes:
-        media = ep.get("media_uri") or ep.get("media_source_uri") or (ep.get("image_urls", [None])[0] if ep.get("image_urls") else None)
+        media = episode_media_url(ep)
         if media and media not in used_urls:
             logger.info(f"Found unused media from preferred episodes: {media}")
             return media
     
     # 次に全エピソードから探す
     for ep in episodes:
-        media = ep.get("media_uri") or ep.get("media_source_uri") or (ep.get("image_urls", [None])[0] if ep.get("image_urls") else None)
+        media = episode_media_url(ep)
         if media and media not in used_urls:
             logger.info(f"Found unused media from all episodes: {media}")
             return media
@@ -1897,18 +2179,23 @@ def orchestrate_notebook_generation(
     """
     try:
         logger.info(f"orchestrate_notebook_generation called for child {child_id}, period: {start_date} to {end_date}")
-        # 全エピソードを収集
+        cache_stats_before = get_llm_cache().get_stats()
+        embedding_stats_before = get_embedding_cache().get_stats()
+        # 対象のanalysis_resultsを1度だけ取得し、全テーマで共有する
+        analysis_results = fetch_analysis_results(child_id, start_date, end_date, selected_media_ids)
+        
+        # 全テーマのエピソードを1回の走査で収集
         all_collected_episodes = []
+        theme_results = collect_episodes_for_themes(
+            themes=themes,
+            child_id=child_id,
+            start_date=start_date,
+            end_date=end_date,
+            selected_media_ids=selected_media_ids,
+            analysis_results=analysis_results,
+        )
         
-        for theme in themes:
-            episodes_result = collect_episodes_by_theme(
-                theme_info=theme,
-                child_id=child_id,
-                start_date=start_date,
-                end_date=end_date,
-                selected_media_ids=selected_media_ids
-            )
-            
+        for theme, episodes_result in zip(themes, theme_results):
             if episodes_result.get("status") == "success":
                 all_collected_episodes.append(episodes_result)
                 logger.info(f"Theme '{theme['title']}' collected {episodes_result['report']['episode_count']} episodes")
@@ -1951,11 +2238,34 @@ def orchestrate_notebook_generation(
                 if topic.get("generated", False):
                     total_episodes_used += 1
         
+        # このノートブック生成でのLLMキャッシュ利用状況
+        cache_stats_after = get_llm_cache().get_stats()
+        llm_cache_stats = {
+            key: cache_stats_after[key] - cache_stats_before[key]
+            for key in ["memory_hits", "persistent_hits", "misses"]
+        }
+        lookups = sum(llm_cache_stats.values())
+        llm_cache_stats["hit_rate"] = (
+            (llm_cache_stats["memory_hits"] + llm_cache_stats["persistent_hits"]) / lookups
+            if lookups else 0.0
+        )
+        logger.info(f"LLM cache stats for this notebook: {llm_cache_stats}")
+
+        # 埋め込みキャッシュ（テーマのクエリ埋め込み）の利用状況
+        embedding_stats_after = get_embedding_cache().get_stats()
+        embedding_cache_stats = {
+            key: embedding_stats_after[key] - embedding_stats_before[key]
+            for key in ["memory_hits", "persistent_hits", "misses", "requests", "cost_saved_usd"]
+        }
+        logger.info(f"Embedding cache stats for this notebook: {embedding_cache_stats}")
+        
         return {
             "status": result.get("status", "error"),
             "report": {
                 "topics": result["report"].get("topics", []),
-                "total_episodes_used": total_episodes_used
+                "total_episodes_used": total_episodes_used,
+                "llm_cache_stats": llm_cache_stats,
+                "embedding_cache_stats": embedding_cache_stats,
             }
         }
         
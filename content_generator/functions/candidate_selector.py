@@ -0,0 +1,153 @@
+"""
+Candidate pre-selection for notebook sections
+
+sequential_topic_generation がセクションごとにGeminiへ送るエピソードを、未使用の全エピソードではなく
+セクションあたり上位K件に絞り込む（週のエピソード数が多くてもプロンプトの大きさが一定に収まる）
+
+- 関連度: セクションのテーマのスコア（theme_score。埋め込みの類似度 theme_similarity は尺度が異なるため使わない）、
+  他テーマでのスコア（少しだけ加味）、写真が必要なセクションでは未使用のメディアがあるか
+- 多様性: タグのJaccard類似度と同じメディアかどうかでMMR（Maximal Marginal Relevance）を行い、
+  似た場面ばかりが候補に並ばないようにする（使用済みのエピソードとも似ていないものを優先する）
+
+同じエピソードが複数テーマで収集されている場合は1件にまとめ、いずれかの位置が使用済みなら候補から除く
+
+環境変数:
+    NOTEBOOK_CANDIDATES_PER_SECTION: セクションごとにGeminiへ送るエピソードの上限（既定は24、0で絞り込まない）
+    NOTEBOOK_CANDIDATE_MMR_LAMBDA: MMRで関連度に置く重み（0〜1、既定は0.7。小さいほど多様性を優先）
+"""
+import logging
+import os
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 他テーマでのスコアに掛ける重み
+OTHER_THEME_WEIGHT = 0.25
+# 写真が必要なセクションで、未使用のメディアがあるエピソードに加える関連度
+MEDIA_BONUS = 0.3
+# 同じメディアのエピソード同士の類似度の下限
+SAME_MEDIA_SIMILARITY = 0.5
+
+
+def get_candidates_per_section() -> int:
+    return int(os.getenv("NOTEBOOK_CANDIDATES_PER_SECTION", "24"))
+
+
+def get_mmr_lambda() -> float:
+    return float(os.getenv("NOTEBOOK_CANDIDATE_MMR_LAMBDA", "0.7"))
+
+
+def episode_key(episode: Dict[str, Any]) -> Tuple[Any, Any]:
+    """収集元のテーマが異なっても同じエピソードを同一視するためのキー"""
+    return (episode.get("analysis_id"), episode.get("id"))
+
+
+def episode_media_url(episode: Dict[str, Any]) -> Optional[str]:
+    """
+    トピックの写真に使うメディアのURL（sequential_topic_generationもこの関数で選ぶ）
+
+    軽量な表示用画像（image_urls[0]: 写真は縮小版のレンディション、動画はサムネイル）を優先し、
+    ない場合のみ元のメディアを使う
+    """
+    if episode.get("image_urls"):
+        return episode["image_urls"][0]
+    return episode.get("media_uri") or episode.get("media_source_uri")
+
+
+def _similarity(a: Tuple[Any, frozenset], b: Tuple[Any, frozenset]) -> float:
+    """タグのJaccard類似度（同じメディアの場合は下限をSAME_MEDIA_SIMILARITYにする）"""
+    media_a, tags_a = a
+    media_b, tags_b = b
+    union = len(tags_a | tags_b)
+    similarity = len(tags_a & tags_b) / union if union else 0.0
+    if media_a is not None and media_a == media_b:
+        similarity = max(similarity, SAME_MEDIA_SIMILARITY)
+    return similarity
+
+
+def select_section_candidates(
+    episodes: List[Dict[str, Any]],
+    episode_theme_ids: Sequence[Optional[str]],
+    used_indices: Set[int],
+    theme_id: Optional[str] = None,
+    needs_media: bool = False,
+    used_media_urls: Optional[Set[str]] = None,
+    top_k: Optional[int] = None,
+    mmr_lambda: Optional[float] = None,
+) -> List[int]:
+    """
+    セクションのプロンプトに含めるエピソードを選ぶ
+
+    Args:
+        episodes: sequential_topic_generationの全エピソード（プロンプトの番号はこのリストの位置）
+        episode_theme_ids: 各エピソードを収集したテーマのID（episodesと同じ順）
+        used_indices: 使用済みのエピソードの位置
+        theme_id: セクションのテーマのID（Noneの場合は全テーマのスコアの最大値で順位付けする）
+        needs_media: 写真・動画が必要なセクションか
+        used_media_urls: 使用済みのメディアのURL
+        top_k: 選ぶ件数の上限（NoneならNOTEBOOK_CANDIDATES_PER_SECTION、0以下なら絞り込まない）
+        mmr_lambda: MMRで関連度に置く重み（NoneならNOTEBOOK_CANDIDATE_MMR_LAMBDA）
+
+    Returns:
+        選んだエピソードの位置（関連度と多様性の高い順）
+    """
+    top_k = get_candidates_per_section() if top_k is None else top_k
+    mmr_lambda = get_mmr_lambda() if mmr_lambda is None else mmr_lambda
+    used_media_urls = used_media_urls or set()
+
+    used_keys = {episode_key(episodes[index]) for index in used_indices if 0 <= index < len(episodes)}
+
+    # エピソードごとに、代表の位置（セクションのテーマで収集した位置を優先）とテーマごとのスコアをまとめる
+    positions: Dict[Tuple[Any, Any], int] = {}
+    scores: Dict[Tuple[Any, Any], Dict[Optional[str], float]] = {}
+    for index, (episode, source_theme_id) in enumerate(zip(episodes, episode_theme_ids)):
+        key = episode_key(episode)
+        if key in used_keys:
+            continue
+        theme_scores = scores.setdefault(key, {})
+        theme_scores[source_theme_id] = max(theme_scores.get(source_theme_id, 0.0), episode.get("theme_score", 0.0))
+        if key not in positions or (source_theme_id == theme_id and episode_theme_ids[positions[key]] != theme_id):
+            positions[key] = index
+
+    keys = list(positions)
+    if top_k <= 0 or len(keys) <= top_k:
+        return sorted(positions.values())
+
+    relevance = []
+    for key in keys:
+        theme_scores = scores[key]
+        if theme_id is None:
+            value = max(theme_scores.values(), default=0.0)
+        else:
+            other = max((score for source, score in theme_scores.items() if source != theme_id), default=0.0)
+            value = theme_scores.get(theme_id, 0.0) + OTHER_THEME_WEIGHT * other
+        if needs_media:
+            url = episode_media_url(episodes[positions[key]])
+            if url and url not in used_media_urls:
+                value += MEDIA_BONUS
+        relevance.append(value)
+
+    def features(episode):
+        return (episode.get("analysis_id"), frozenset(episode.get("tags") or []))
+
+    candidate_features = [features(episodes[positions[key]]) for key in keys]
+    # 各候補の、選択済み（使用済みを含む）のエピソードとの最大類似度
+    redundancy = [0.0] * len(keys)
+    for used_feature in {features(episodes[index]) for index in used_indices if 0 <= index < len(episodes)}:
+        for row, feature in enumerate(candidate_features):
+            redundancy[row] = max(redundancy[row], _similarity(feature, used_feature))
+
+    selected: List[int] = []
+    remaining = set(range(len(keys)))
+    while remaining and len(selected) < top_k:
+        # 同点は元の順（収集順）を優先
+        best = max(
+            remaining,
+            key=lambda row: (mmr_lambda * relevance[row] - (1 - mmr_lambda) * redundancy[row], -row),
+        )
+        remaining.discard(best)
+        selected.append(best)
+        for row in remaining:
+            redundancy[row] = max(redundancy[row], _similarity(candidate_features[row], candidate_features[best]))
+
+    return [positions[keys[row]] for row in selected]
@@ -0,0 +1,209 @@
+"""
+Geminiレスポンスキャッシュ
+
+(モデル名, プロンプトのハッシュ, 生成設定) をキーに、入力が同じなら結果も同じとみなせる
+呼び出し（キャプション、動的タイトル、失敗後のノートブック再生成など）の結果を再利用する
+
+- メモリ上のLRU（件数上限あり）
+- 任意の永続層（Firestore または ローカルディスク、TTL付き）
+
+環境変数:
+    LLM_CACHE_CALL_SITES: キャッシュを有効にする呼び出し箇所（カンマ区切り）
+    LLM_CACHE_BACKEND: 永続層（"firestore" / "disk"、未設定ならメモリのみ）
+    LLM_CACHE_DIR: diskバックエンドの保存先
+    LLM_CACHE_TTL_SEC: 永続層のTTL（秒）
+    LLM_CACHE_MAX_ENTRIES: メモリLRUの最大件数
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from google.cloud import firestore
+
+logger = logging.getLogger(__name__)
+
+# 入力から出力がほぼ決まる呼び出し箇所のみ既定でキャッシュする
+DEFAULT_CACHED_CALL_SITES = "generate_dynamic_title,caption"
+CACHE_COLLECTION = "llm_response_cache"
+
+
+def get_cached_call_sites() -> set:
+    raw = os.getenv("LLM_CACHE_CALL_SITES", DEFAULT_CACHED_CALL_SITES)
+    return {site.strip() for site in raw.split(",") if site.strip()}
+
+
+def make_cache_key(model_name: str, contents: Any, generation_config: Any = None) -> str:
+    """(モデル, プロンプトのハッシュ, 生成設定) からキャッシュキーを生成"""
+    prompt_hash = hashlib.sha256(
+        json.dumps(contents, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    config_repr = json.dumps(generation_config, sort_keys=True, default=str)
+    return hashlib.sha256(
+        f"{model_name}\n{prompt_hash}\n{config_repr}".encode("utf-8")
+    ).hexdigest()
+
+
+class LLMResponseCache:
+    """メモリLRU + 任意の永続層からなるレスポンスキャッシュ"""
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        backend: Optional[str] = None,
+        ttl_sec: int = 7 * 24 * 3600,
+        cache_dir: str = "/tmp/llm_cache",
+    ):
+        self.max_entries = max_entries
+        self.backend = backend
+        self.ttl_sec = ttl_sec
+        self.cache_dir = cache_dir
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._firestore_client = None
+        self.stats = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "evictions": 0}
+
+    # ---------- 公開API ----------
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._memory[key]
+
+        text = self._persistent_get(key) if self.backend else None
+        with self._lock:
+            if text is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["persistent_hits"] += 1
+        self._memory_put(key, text)
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        self._memory_put(key, text)
+        if self.backend:
+            self._persistent_put(key, text)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            (stats["memory_hits"] + stats["persistent_hits"]) / lookups if lookups else 0.0
+        )
+        return stats
+
+    # ---------- メモリ層 ----------
+
+    def _memory_put(self, key: str, text: str) -> None:
+        with self._lock:
+            self._memory[key] = text
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    # ---------- 永続層 ----------
+
+    def _get_firestore_client(self):
+        if self._firestore_client is None:
+            self._firestore_client = firestore.Client(
+                project=os.getenv("GOOGLE_CLOUD_PROJECT", "hackason-464007")
+            )
+        return self._firestore_client
+
+    def _persistent_get(self, key: str) -> Optional[str]:
+        try:
+            if self.backend == "firestore":
+                doc = self._get_firestore_client().collection(CACHE_COLLECTION).document(key).get()
+                entry = doc.to_dict() if doc.exists else None
+            elif self.backend == "disk":
+                path = os.path.join(self.cache_dir, f"{key}.json")
+                if not os.path.exists(path):
+                    return None
+                with open(path, encoding="utf-8") as f:
+                    entry = json.load(f)
+            else:
+                return None
+
+            if not entry or entry.get("expires_at", 0) < time.time():
+                return None
+            return entry.get("text")
+
+        except Exception as e:
+            logger.warning(f"LLM cache read failed ({self.backend}): {e}")
+            return None
+
+    def _persistent_put(self, key: str, text: str) -> None:
+        entry = {"text": text, "expires_at": time.time() + self.ttl_sec}
+        try:
+            if self.backend == "firestore":
+                self._get_firestore_client().collection(CACHE_COLLECTION).document(key).set(entry)
+            elif self.backend == "disk":
+                os.makedirs(self.cache_dir, exist_ok=True)
+                path = os.path.join(self.cache_dir, f"{key}.json")
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"LLM cache write failed ({self.backend}): {e}")
+
+
+class CachedResponse:
+    """キャッシュから返すレスポンス（呼び出し側は .text のみ使用する）"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class CachedModel:
+    """GenerativeModelをラップし、generate_contentの結果をキャッシュする"""
+
+    def __init__(self, model, model_name: str, call_site: str, cache: LLMResponseCache):
+        self._model = model
+        self.model_name = model_name
+        self.call_site = call_site
+        self._cache = cache
+
+    def generate_content(self, contents, **kwargs):
+        # テキストのみのプロンプトだけをキャッシュ対象にする
+        if not isinstance(contents, str) or kwargs.get("stream"):
+            return self._model.generate_content(contents, **kwargs)
+
+        key = make_cache_key(self.model_name, contents, kwargs.get("generation_config"))
+        cached_text = self._cache.get(key)
+        if cached_text is not None:
+            logger.info(f"LLM cache hit for {self.call_site}")
+            return CachedResponse(cached_text)
+
+        response = self._model.generate_content(contents, **kwargs)
+        self._cache.put(key, response.text)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+_cache: Optional[LLMResponseCache] = None
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """プロセス内で共有するキャッシュを取得（遅延初期化）"""
+    global _cache
+    if _cache is None:
+        _cache = LLMResponseCache(
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512")),
+            backend=os.getenv("LLM_CACHE_BACKEND") or None,
+            ttl_sec=int(os.getenv("LLM_CACHE_TTL_SEC", str(7 * 24 * 3600))),
+            cache_dir=os.getenv("LLM_CACHE_DIR", "/tmp/llm_cache"),
+        )
+    return _cache
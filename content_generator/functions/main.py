@@ -224,6 +224,7 @@ def generate_notebook_on_create(event: Event[DocumentSnapshot]) -> None:
                 'valid_topics': save_result["report"]["valid_topics"],
                 'missing_topics': save_result["report"]["missing_topics"],
                 'selected_media_count': len(selected_media_ids),
+                'llm_cache': orchestration_result["report"].get("llm_cache_stats", {}),
                 'generated_at': firestore.SERVER_TIMESTAMP,
                 'generated_by': 'firestore_trigger'
             })
@@ -0,0 +1,177 @@
+"""
+Local semantic theme ranking over stored episode embeddings
+
+media_processing_agent が analysis_results の episode_embeddings に保存した小さい埋め込み
+（int8 / float16、L2正規化済み）を行列にまとめ、テーマのクエリ埋め込みとの
+コサイン類似度を1回の行列積で計算する（エピソードごと・クエリごとのリモート呼び出しはしない）
+
+テーマのクエリ埋め込みは検索クエリを連結した文から計算し、プロセス内でキャッシュする
+（同じテーマ定義ならインスタンスが再利用される間は再計算しない）
+
+環境変数:
+    SEMANTIC_THEME_MATCHING: 埋め込みの類似度でもテーマに振り分ける（既定はfalse。しきい値を検証してから有効化する）
+    SEMANTIC_THEME_THRESHOLD: テーマに含めるコサイン類似度の下限（既定は0.55、未検証の値）
+"""
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# media_processing_agent の EMBEDDING_MODEL_NAME と同じモデル
+EMBEDDING_MODEL_NAME = "text-embedding-004"
+
+# 保存形式ごとの1要素のバイト数
+BYTES_PER_VALUE = {"float16": 2, "int8": 1}
+
+_query_embeddings: Dict[Tuple[str, str], np.ndarray] = {}
+_query_embeddings_lock = threading.Lock()
+
+
+def is_semantic_matching_enabled() -> bool:
+    return os.getenv("SEMANTIC_THEME_MATCHING", "false").lower() in ("1", "true", "yes")
+
+
+def get_similarity_threshold() -> float:
+    return float(os.getenv("SEMANTIC_THEME_THRESHOLD", "0.55"))
+
+
+def decode_embedding(stored: Dict[str, Any]) -> np.ndarray:
+    """保存された埋め込み（media_processing_agent の encode_embedding の形式）をfloat32に戻す"""
+    if stored["dtype"] == "float16":
+        return np.frombuffer(stored["data"], dtype="<f2").astype(np.float32)
+    if stored["dtype"] == "int8":
+        return np.frombuffer(stored["data"], dtype=np.int8).astype(np.float32) * np.float32(stored["scale"])
+    raise ValueError(f"Unsupported embedding dtype: {stored['dtype']}")
+
+
+def theme_query_text(theme: Dict[str, Any]) -> str:
+    """テーマのクエリ埋め込みに使う文（エピソード側と同じく語をスペースで連結）"""
+    return " ".join(theme.get("search_queries", []))
+
+
+def get_theme_embeddings(
+    themes: List[Dict[str, Any]],
+    embed_fn: Callable[[List[str]], List[List[float]]],
+) -> np.ndarray:
+    """
+    テーマのクエリ埋め込み（L2正規化済み、テーマ数×次元）を取得する
+
+    キャッシュにないテーマだけをまとめて1回で計算する
+
+    Args:
+        themes: テーマ情報のリスト
+        embed_fn: 文のリストから埋め込みのリストを返す関数
+
+    Returns:
+        themesと同じ順のfloat32の行列
+    """
+    texts = [theme_query_text(theme) for theme in themes]
+    with _query_embeddings_lock:
+        missing = [text for text in dict.fromkeys(texts) if (EMBEDDING_MODEL_NAME, text) not in _query_embeddings]
+    if missing:
+        logger.info(f"Computing query embeddings for {len(missing)} themes")
+        for text, values in zip(missing, embed_fn(missing)):
+            vector = np.asarray(values, dtype=np.float32)
+            norm = float(np.linalg.norm(vector))
+            with _query_embeddings_lock:
+                _query_embeddings[(EMBEDDING_MODEL_NAME, text)] = vector / norm if norm > 0 else vector
+    with _query_embeddings_lock:
+        return np.stack([_query_embeddings[(EMBEDDING_MODEL_NAME, text)] for text in texts])
+
+
+def build_episode_matrix(
+    analysis_results: List[Tuple[str, Dict[str, Any]]],
+) -> Tuple[List[Tuple[str, str]], Optional[np.ndarray]]:
+    """
+    analysis_resultsの保存済み埋め込みを1つの行列にまとめる
+
+    エピソードごとに変換せず、同じ形式のバイト列を連結して形式ごとに1回で変換する
+
+    Returns:
+        ([(analysis_id, episode_id), ...], エピソード数×次元の行列（埋め込みがない場合はNone）)
+    """
+    # 形式ごとの (キー, バイト列, scale)
+    grouped: Dict[str, List[Tuple[Tuple[str, str], bytes, float]]] = {dtype: [] for dtype in BYTES_PER_VALUE}
+    for analysis_id, analysis_data in analysis_results:
+        if analysis_data.get("embedding_model", EMBEDDING_MODEL_NAME) != EMBEDDING_MODEL_NAME:
+            continue
+        for episode_id, stored in (analysis_data.get("episode_embeddings") or {}).items():
+            dtype = stored.get("dtype")
+            if dtype not in grouped or not stored.get("data"):
+                logger.warning(f"Skipping embedding {analysis_id}/{episode_id}: unsupported dtype {dtype}")
+                continue
+            grouped[dtype].append(((analysis_id, episode_id), bytes(stored["data"]), stored.get("scale", 1.0)))
+
+    # 次元は最初の埋め込みに揃え、異なるものは除く
+    first = next(((dtype, rows[0][1]) for dtype, rows in grouped.items() if rows), None)
+    if first is None:
+        return [], None
+    dim = len(first[1]) // BYTES_PER_VALUE[first[0]]
+
+    keys = []
+    blocks = []
+    for dtype, rows in grouped.items():
+        width = dim * BYTES_PER_VALUE[dtype]
+        rows = [row for row in rows if len(row[1]) == width]
+        if not rows:
+            continue
+        buffer = b"".join(data for _, data, _ in rows)
+        if dtype == "float16":
+            block = np.frombuffer(buffer, dtype="<f2").reshape(len(rows), dim).astype(np.float32)
+        else:
+            scales = np.array([scale for _, _, scale in rows], dtype=np.float32)
+            block = np.frombuffer(buffer, dtype=np.int8).reshape(len(rows), dim).astype(np.float32) * scales[:, None]
+        keys.extend(key for key, _, _ in rows)
+        blocks.append(block)
+    return keys, np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+
+
+def rank_episodes_by_theme(
+    themes: List[Dict[str, Any]],
+    analysis_results: List[Tuple[str, Dict[str, Any]]],
+    embed_fn: Callable[[List[str]], List[List[float]]],
+    threshold: Optional[float] = None,
+) -> Dict[str, Dict[Tuple[str, str], float]]:
+    """
+    期間内のエピソードをテーマごとに類似度で順位付けする
+
+    Args:
+        themes: テーマ情報のリスト
+        analysis_results: fetch_analysis_resultsの結果（episode_embeddingsを含む）
+        embed_fn: テーマのクエリ埋め込みを計算する関数（キャッシュにない場合のみ呼ばれる）
+        threshold: この類似度以上のエピソードだけを返す（Noneの場合はSEMANTIC_THEME_THRESHOLD）
+
+    Returns:
+        {theme_id: {(analysis_id, episode_id): 類似度}}（類似度の高い順）
+    """
+    threshold = get_similarity_threshold() if threshold is None else threshold
+    keys, matrix = build_episode_matrix(analysis_results)
+    if matrix is None:
+        return {theme["id"]: {} for theme in themes}
+
+    theme_matrix = get_theme_embeddings(themes, embed_fn)
+    if theme_matrix.shape[1] != matrix.shape[1]:
+        logger.warning(f"Embedding dimensions differ: episodes {matrix.shape[1]}, themes {theme_matrix.shape[1]}")
+        return {theme["id"]: {} for theme in themes}
+
+    # 保存時にL2正規化済みのため、行列積がそのままコサイン類似度になる（量子化誤差分だけずれる）
+    similarities = matrix @ theme_matrix.T
+
+    ranked = {}
+    for column, theme in enumerate(themes):
+        scores = similarities[:, column]
+        rows = np.flatnonzero(scores >= threshold)
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+        ranked[theme["id"]] = dict(zip(
+            [keys[row] for row in rows.tolist()],
+            np.round(scores[rows].astype(np.float64), 4).tolist(),
+        ))
+    logger.info(
+        f"Ranked {len(keys)} episode embeddings against {len(themes)} themes: "
+        + ", ".join(f"{theme_id}={len(hits)}" for theme_id, hits in ranked.items())
+    )
+    return ranked
@@ -0,0 +1,110 @@
+"""
+Precompiled theme matcher
+
+全テーマの search_queries を小文字化したパターン表に事前にまとめ、エピソードの本文とタグ（区切り文字で連結したもの）を
+それぞれ1回だけ小文字化して、テーマごとに一致したクエリを返す
+（テーマ数×クエリ数×タグ数の小文字化・部分文字列検索の繰り返しを置き換える）
+
+一致位置は求めず、テーマごとにクエリをC実装の `in` で検索し、スコアが飽和する件数
+（THEME_SCORE_SATURATION）が一致した時点でそのテーマの検索を打ち切る
+（一致位置をすべて求める方式やPythonでオートマトンを辿るAho-Corasickは、クエリ数が数十件の規模では
+一致が多いエピソードほど、最初の一致で打ち切る従来のループより遅くなる）
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+# タグを連結する区切り文字（クエリに含まれない文字）
+TAG_SEPARATOR = "\x00"
+
+# この数以上のクエリに一致したらスコア1.0とする（media_processing_agent の theme_labels と同じ）
+THEME_SCORE_SATURATION = 3
+
+
+def get_theme_set_version(themes: List[Dict[str, Any]]) -> str:
+    """
+    テーマ定義（IDと検索クエリ）のバージョン
+
+    media_processing_agent の theme_labels が保存時に記録する theme_set_version と同じ計算で、
+    一致する場合は保存済みのテーマラベルをそのまま使える
+    """
+    definition = [[theme["id"], list(theme.get("search_queries", []))] for theme in themes]
+    encoded = json.dumps(definition, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()[:12]
+
+
+def score_matched_queries(queries: List[str]) -> float:
+    """match_queriesの1テーマ分の一致したクエリから、保存時のラベルと同じ基準のスコア（0〜1）を計算する"""
+    return round(min(1.0, len(set(queries)) / THEME_SCORE_SATURATION), 3)
+
+
+class ThemeMatcher:
+    """
+    テーマの検索クエリを事前にまとめたマッチャー
+
+    使い方:
+        matcher = ThemeMatcher(themes)
+        queries = matcher.match_queries(episode)
+        # {"interest": ["好き", ...], ...}（スコアが飽和したら打ち切り）
+    """
+
+    def __init__(self, themes: List[Dict[str, Any]]):
+        """
+        Args:
+            themes: analyze_period_and_themesのテーマ（id と search_queries を使う）
+        """
+        self.theme_ids: List[str] = []
+        # theme_id -> (小文字化したパターン, query) のリスト（定義順、重複なし）
+        patterns: Dict[str, List[Tuple[str, str]]] = {}
+        for theme in themes:
+            self.theme_ids.append(theme["id"])
+            theme_patterns = patterns.setdefault(theme["id"], [])
+            for query in theme.get("search_queries", []):
+                pattern = query.lower()
+                if not pattern or TAG_SEPARATOR in pattern:
+                    continue
+                if (pattern, query) not in theme_patterns:
+                    theme_patterns.append((pattern, query))
+        self._theme_patterns: List[Tuple[str, List[Tuple[str, str]]]] = list(patterns.items())
+
+    def match_queries(
+        self, episode: Dict[str, Any], limit: int = THEME_SCORE_SATURATION
+    ) -> Dict[str, List[str]]:
+        """
+        エピソードの本文またはタグに含まれるクエリをテーマごとに返す（大文字小文字は区別しない）
+
+        Args:
+            episode: エピソード（content と tags を使う）
+            limit: テーマごとにこの件数のクエリが一致したら打ち切る（1ならテーマの判定のみ）
+
+        Returns:
+            {theme_id: [query, ...]}（定義順に最大limit件）。一致しなかったテーマは含まない
+        """
+        content = episode.get("content", "").lower()
+        tags = TAG_SEPARATOR.join(episode.get("tags", [])).lower()
+        matches: Dict[str, List[str]] = {}
+        for theme_id, patterns in self._theme_patterns:
+            for pattern, query in patterns:
+                if pattern in content or pattern in tags:
+                    theme_queries = matches.setdefault(theme_id, [])
+                    theme_queries.append(query)
+                    if len(theme_queries) >= limit:
+                        break
+        return matches
+
+
+# テーマの組み合わせはほぼ固定のため、件数を超えたら作り直す程度で十分
+MATCHER_CACHE_SIZE = 32
+_matcher_cache: Dict[Tuple, ThemeMatcher] = {}
+
+
+def get_theme_matcher(themes: List[Dict[str, Any]]) -> ThemeMatcher:
+    """同じテーマ・クエリの組み合わせに対してはコンパイル済みのマッチャーを再利用する"""
+    key = tuple((theme["id"], tuple(theme.get("search_queries", []))) for theme in themes)
+    matcher: Optional[ThemeMatcher] = _matcher_cache.get(key)
+    if matcher is None:
+        matcher = ThemeMatcher(themes)
+        if len(_matcher_cache) >= MATCHER_CACHE_SIZE:
+            _matcher_cache.clear()
+        _matcher_cache[key] = matcher
+    return matcher
@@ -0,0 +1,74 @@
+"""
+select_section_candidates の絞り込み（MMRによる多様性、テーマをまたいだ重複の除去、
+使用済みメディアを避ける写真のボーナス）と episode_media_url の優先順の確認
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+from candidate_selector import episode_media_url, select_section_candidates  # noqa: E402
+
+
+def make_episode(analysis_id, episode_id, tags, theme_score, **fields):
+    return dict(
+        {"analysis_id": analysis_id, "id": episode_id, "tags": tags, "theme_score": theme_score},
+        **fields,
+    )
+
+
+def test_mmr_prefers_a_different_scene_over_a_near_duplicate():
+    episodes = [
+        make_episode("media0", "ep0", ["砂場", "スコップ"], 0.9),
+        make_episode("media1", "ep1", ["砂場", "スコップ"], 0.85),
+        make_episode("media2", "ep2", ["絵本", "ソファ"], 0.6),
+    ]
+    theme_ids = ["interest"] * 3
+
+    diverse = select_section_candidates(episodes, theme_ids, set(), theme_id="interest", top_k=2, mmr_lambda=0.7)
+    relevance_only = select_section_candidates(episodes, theme_ids, set(), theme_id="interest", top_k=2, mmr_lambda=1.0)
+
+    assert diverse == [0, 2]
+    assert relevance_only == [0, 1]
+
+
+def test_episode_collected_by_several_themes_is_listed_once_and_used_ones_are_dropped():
+    shared = make_episode("media0", "ep0", ["公園"], 0.2)
+    episodes = [
+        shared,
+        dict(shared, theme_score=0.9),
+        make_episode("media1", "ep1", ["ブランコ"], 0.5),
+        make_episode("media2", "ep2", ["すべり台"], 0.4),
+        make_episode("media2", "ep2", ["すべり台"], 0.7),
+    ]
+    theme_ids = ["place", "interest", "interest", "interest", "place"]
+
+    # 上限なし: 同じエピソードはセクションのテーマで収集した位置にまとめ、使用済みは他テーマの位置も除く
+    assert select_section_candidates(episodes, theme_ids, {3}, theme_id="interest", top_k=0) == [1, 2]
+
+
+def test_media_bonus_skips_episodes_whose_rendition_is_already_used():
+    episodes = [
+        make_episode("media0", "ep0", ["積み木"], 0.5, media_uri="gs://bucket/a.jpg",
+                     image_urls=["https://storage.googleapis.com/bucket/renditions/a_800.jpg"]),
+        make_episode("media1", "ep1", ["お絵かき"], 0.5, media_uri="gs://bucket/b.jpg",
+                     image_urls=["https://storage.googleapis.com/bucket/renditions/b_800.jpg"]),
+    ]
+    used_media_urls = {"https://storage.googleapis.com/bucket/renditions/a_800.jpg"}
+
+    selected = select_section_candidates(
+        episodes, ["interest", "interest"], set(), theme_id="interest",
+        needs_media=True, used_media_urls=used_media_urls, top_k=1,
+    )
+
+    assert selected == [1]
+
+
+def test_episode_media_url_prefers_the_display_image():
+    assert episode_media_url({
+        "media_uri": "gs://bucket/movie.mp4",
+        "image_urls": ["https://storage.googleapis.com/bucket/thumbnails/movie.jpg"],
+    }) == "https://storage.googleapis.com/bucket/thumbnails/movie.jpg"
+    assert episode_media_url({"media_uri": "gs://bucket/a.jpg", "image_urls": []}) == "gs://bucket/a.jpg"
+    assert episode_media_url({"media_source_uri": "gs://bucket/b.jpg"}) == "gs://bucket/b.jpg"
+    assert episode_media_url({}) is None
@@ -0,0 +1,86 @@
+"""
+EmbeddingCache.get_embeddings の再利用（正規化した文の重複、メモリLRU、disk永続層、リクエストの分割）と
+統計（ヒット数・リクエスト数・文字数）の確認
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+pytest.importorskip("google.cloud.firestore")
+
+import embedding_cache  # noqa: E402
+from embedding_cache import EmbeddingCache  # noqa: E402
+
+MODEL_NAME = "text-embedding-004"
+
+
+class FakeEmbedder:
+    """受け取った文を記録し、文の長さから埋め込みを作る"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+def test_duplicates_and_repeats_are_embedded_once():
+    cache = EmbeddingCache()
+    embedder = FakeEmbedder()
+
+    first = cache.get_embeddings(MODEL_NAME, ["水遊び", "水遊び", "砂場　 遊び"], embedder)
+    second = cache.get_embeddings(MODEL_NAME, ["水遊び"], embedder)
+
+    # 全角スペースと連続する空白は正規化して1つの空白にする
+    assert embedder.calls == [["水遊び", "砂場 遊び"]]
+    assert first == [[3.0, 1.0], [3.0, 1.0], [5.0, 1.0]]
+    assert second == [[3.0, 1.0]]
+    stats = cache.get_stats()
+    assert (stats["memory_hits"], stats["persistent_hits"], stats["misses"]) == (2, 0, 2)
+    assert stats["requests"] == 1
+    assert stats["embedded_chars"] == len("水遊び") + len("砂場 遊び")
+    assert stats["saved_chars"] == 2 * len("水遊び")
+    assert stats["hit_rate"] == 0.5
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = EmbeddingCache(max_entries=2)
+    embedder = FakeEmbedder()
+
+    cache.get_embeddings(MODEL_NAME, ["a", "b"], embedder)
+    cache.get_embeddings(MODEL_NAME, ["a"], embedder)
+    cache.get_embeddings(MODEL_NAME, ["c"], embedder)
+    cache.get_embeddings(MODEL_NAME, ["a", "b"], embedder)
+
+    assert embedder.calls == [["a", "b"], ["c"], ["b"]]
+    assert cache.get_stats()["evictions"] == 2
+
+
+def test_disk_backend_serves_a_new_process(tmp_path):
+    EmbeddingCache(backend="disk", cache_dir=str(tmp_path)).get_embeddings(MODEL_NAME, ["積み木"], FakeEmbedder())
+    cold = EmbeddingCache(backend="disk", cache_dir=str(tmp_path))
+    embedder = FakeEmbedder()
+
+    assert cold.get_embeddings(MODEL_NAME, ["積み木"], embedder) == [[3.0, 1.0]]
+    assert embedder.calls == []
+    assert cold.get_stats()["persistent_hits"] == 1
+
+
+def test_misses_are_split_into_requests_of_the_maximum_size(monkeypatch):
+    monkeypatch.setattr(embedding_cache, "MAX_TEXTS_PER_REQUEST", 2)
+    cache = EmbeddingCache()
+    embedder = FakeEmbedder()
+
+    cache.get_embeddings(MODEL_NAME, ["a", "b", "c", "d", "e"], embedder)
+
+    assert [len(call) for call in embedder.calls] == [2, 2, 1]
+    assert cache.get_stats()["requests"] == 3
+
+
+def test_embedder_returning_the_wrong_count_is_an_error():
+    with pytest.raises(ValueError):
+        EmbeddingCache().get_embeddings(MODEL_NAME, ["a", "b"], lambda texts: [[1.0]])
@@ -0,0 +1,29 @@
+"""
+content_generator と media_processing_agent は別々にデプロイするため同じモジュールを1つずつ持つ
+片方だけを修正してもう片方が古いままにならないよう、内容が一致することを確認する
+"""
+import os
+
+import pytest
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+# 両方の functions に同じ内容で置くモジュール
+SHARED_MODULES = ["vector_store.py", "embedding_cache.py"]
+
+
+@pytest.mark.parametrize("module", SHARED_MODULES)
+def test_shared_module_copies_are_identical(module):
+    paths = [
+        os.path.join(REPO_ROOT, package, "functions", module)
+        for package in ("content_generator", "media_processing_agent")
+    ]
+    contents = []
+    for path in paths:
+        with open(path, "rb") as f:
+            contents.append(f.read())
+
+    assert contents[0] == contents[1], (
+        f"{module} differs between content_generator and media_processing_agent; "
+        f"apply the change to both copies"
+    )
@@ -0,0 +1,47 @@
+"""
+ThemeMatcher.match_queries の照合（大文字小文字を区別しない、スコアが飽和する件数での打ち切り、
+タグをまたいだ一致をしない）と、テーマのスコアの計算の確認
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+from theme_matcher import ThemeMatcher, get_theme_set_version, score_matched_queries  # noqa: E402
+
+THEMES = [
+    {"id": "interest", "search_queries": ["好き", "夢中", "Ball", "遊び"]},
+    {"id": "place", "search_queries": ["公園", "遊び"]},
+    {"id": "first_time", "search_queries": ["初めて"]},
+]
+
+
+def test_match_queries_stops_at_the_limit_in_definition_order():
+    matcher = ThemeMatcher(THEMES)
+    episode = {"content": "ボール遊びに夢中。BALLが好き", "tags": []}
+
+    assert matcher.match_queries(episode) == {"interest": ["好き", "夢中", "Ball"], "place": ["遊び"]}
+    assert matcher.match_queries(episode, limit=1) == {"interest": ["好き"], "place": ["遊び"]}
+
+
+def test_match_queries_searches_tags_without_matching_across_them():
+    matcher = ThemeMatcher(THEMES)
+
+    assert matcher.match_queries({"content": "", "tags": ["公", "園"]}) == {}
+    assert matcher.match_queries({"content": "", "tags": ["近所の公園で", "初めての"]}) == {
+        "place": ["公園"],
+        "first_time": ["初めて"],
+    }
+
+
+def test_scores_saturate_at_three_distinct_queries():
+    assert score_matched_queries(["遊び"]) == 0.333
+    assert score_matched_queries(["遊び", "遊び"]) == 0.333
+    assert score_matched_queries(["好き", "夢中", "Ball"]) == 1.0
+
+
+def test_theme_set_version_changes_with_the_queries():
+    changed = [dict(THEMES[0], search_queries=["好き"])] + THEMES[1:]
+
+    assert get_theme_set_version(THEMES) == get_theme_set_version([dict(theme) for theme in THEMES])
+    assert get_theme_set_version(THEMES) != get_theme_set_version(changed)
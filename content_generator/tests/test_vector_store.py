@@ -0,0 +1,193 @@
+"""
+VectorStore のインターフェースと、VertexVectorStore の検索が find_neighbors を持つクライアント
+（MatchServiceClient）を使うことの確認
+
+Vertexのクライアントは実際のクラスから autospec したモックに置き換えるため、存在しないクラスや
+メソッドを呼んだ場合はテストが失敗する
+"""
+import os
+import sys
+from unittest import mock
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+from vector_store import LocalVectorStore, VectorStore, VertexVectorStore  # noqa: E402
+
+
+@pytest.fixture
+def aiplatform_v1():
+    return pytest.importorskip("google.cloud.aiplatform_v1")
+
+
+def test_backend_missing_a_method_fails_at_instantiation():
+    class IncompleteStore(VectorStore):
+        def upsert(self, datapoints):
+            return len(datapoints)
+
+        def delete(self, datapoint_ids):
+            return len(datapoint_ids)
+
+    with pytest.raises(TypeError):
+        IncompleteStore()
+
+
+def test_local_store_implements_the_interface(tmp_path):
+    store = LocalVectorStore(str(tmp_path))
+    assert store.upsert([{"datapoint_id": "media1_ep1", "feature_vector": [1.0, 0.0]}]) == 1
+    assert store.search([[1.0, 0.0]], top_k=1) == [[("media1_ep1", 1.0)]]
+
+
+def make_datapoint(datapoint_id, vector, child_id=None, captured_at=None):
+    datapoint = {"datapoint_id": datapoint_id, "feature_vector": vector}
+    if child_id is not None:
+        datapoint["restricts"] = [{"namespace": "child_id", "allow_list": [child_id]}]
+    if captured_at is not None:
+        datapoint["numeric_restricts"] = [{"namespace": "captured_at", "value_int": captured_at}]
+    return datapoint
+
+
+def test_local_store_applies_token_and_numeric_filters(tmp_path):
+    store = LocalVectorStore(str(tmp_path))
+    store.upsert([
+        make_datapoint("a", [1.0, 0.0], child_id="child1", captured_at=100),
+        make_datapoint("b", [0.9, 0.1], child_id="child1", captured_at=200),
+        make_datapoint("c", [0.8, 0.2], child_id="child2", captured_at=150),
+        make_datapoint("d", [0.7, 0.3], child_id="child1"),
+    ])
+
+    def ids(**filters):
+        return [datapoint_id for datapoint_id, _ in store.search([[1.0, 0.0]], top_k=10, **filters)[0]]
+
+    child1 = [{"namespace": "child_id", "allow_list": ["child1"]}]
+    assert ids(restricts=child1) == ["a", "b", "d"]
+    # 値がないデータポイントは数値条件で除外される
+    assert ids(restricts=child1, numeric_restricts=[
+        {"namespace": "captured_at", "value_int": 150, "op": "GREATER_EQUAL"},
+    ]) == ["b"]
+    assert ids(numeric_restricts=[{"namespace": "captured_at", "value_int": 200, "op": "LESS"}]) == ["a", "c"]
+    assert ids(numeric_restricts=[{"namespace": "unknown", "value_int": 0}]) == []
+    assert ids(restricts=[{"namespace": "child_id", "allow_list": ["child3"]}]) == []
+
+
+def test_local_store_upsert_overwrites_and_delete_removes(tmp_path):
+    store = LocalVectorStore(str(tmp_path))
+    store.upsert([make_datapoint("a", [1.0, 0.0], child_id="child1"), make_datapoint("b", [0.0, 1.0])])
+    store.upsert([make_datapoint("a", [0.0, 1.0], child_id="child2")])
+    store.delete(["b"])
+
+    assert store.list_ids() == ["a"]
+    assert store.search([[0.0, 1.0]], top_k=1, restricts=[{"namespace": "child_id", "allow_list": ["child2"]}]) == [[("a", 1.0)]]
+    # 保存先から読み込み直しても同じ内容になる
+    assert LocalVectorStore(str(tmp_path)).list_ids() == ["a"]
+
+
+def random_unit_vectors(count, dim, seed):
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_ivf_with_every_list_probed_matches_brute_force(tmp_path):
+    vectors = random_unit_vectors(600, 16, seed=0)
+    datapoints = [make_datapoint(f"p{row}", vector.tolist()) for row, vector in enumerate(vectors)]
+    queries = random_unit_vectors(5, 16, seed=1).tolist()
+    ivf = LocalVectorStore(str(tmp_path / "ivf"), ivf_lists=8, ivf_probes=8)
+    brute_force = LocalVectorStore(str(tmp_path / "flat"), ivf_lists=-1)
+    ivf.upsert(datapoints)
+    brute_force.upsert(datapoints)
+
+    def ids(results):
+        return [[datapoint_id for datapoint_id, _ in neighbors] for neighbors in results]
+
+    assert ids(ivf.search(queries, top_k=10)) == ids(brute_force.search(queries, top_k=10))
+
+
+def test_ivf_finds_a_stored_vector_with_one_probe_and_reloads_the_lists(tmp_path):
+    vectors = random_unit_vectors(600, 16, seed=2)
+    store = LocalVectorStore(str(tmp_path), ivf_lists=16, ivf_probes=1)
+    store.upsert([make_datapoint(f"p{row}", vector.tolist()) for row, vector in enumerate(vectors)])
+
+    # データポイントは内積が最大のリストに割り当てられるため、同じベクトルのクエリは自身のリストを検索する
+    assert [neighbors[0][0] for neighbors in store.search(vectors[:20].tolist(), top_k=3)] == [f"p{row}" for row in range(20)]
+
+    reloaded = LocalVectorStore(str(tmp_path), ivf_lists=16, ivf_probes=1)
+    assert reloaded._centroids is not None and not reloaded._dirty
+    assert reloaded.search([vectors[7].tolist()], top_k=1)[0][0][0] == "p7"
+
+
+def test_ivf_searches_every_filtered_row_when_the_probed_lists_are_short(tmp_path):
+    vectors = random_unit_vectors(600, 16, seed=3)
+    store = LocalVectorStore(str(tmp_path), ivf_lists=16, ivf_probes=1)
+    store.upsert([
+        make_datapoint(f"p{row}", vector.tolist(), child_id="every100" if row % 100 == 0 else "every10" if row % 10 == 0 else "other")
+        for row, vector in enumerate(vectors)
+    ])
+
+    def ids(child_ids, top_k):
+        restricts = [{"namespace": "child_id", "allow_list": child_ids}]
+        return sorted(datapoint_id for datapoint_id, _ in store.search([vectors[1].tolist()], top_k, restricts)[0])
+
+    # 絞り込み後の件数が少ない場合は総当たり
+    assert ids(["every100"], top_k=6) == sorted(f"p{row}" for row in range(0, 600, 100))
+    # 検索したリストに絞り込みを満たす行がtop_kより少ない場合は、絞り込みを満たす全行を評価する
+    every10 = [row for row in range(600) if row % 10 == 0]
+    assert ids(["every10", "every100"], top_k=len(every10)) == sorted(f"p{row}" for row in every10)
+
+
+def make_response(aiplatform_v1, datapoint_ids):
+    neighbors = [
+        aiplatform_v1.FindNeighborsResponse.Neighbor(
+            datapoint=aiplatform_v1.IndexDatapoint(datapoint_id=datapoint_id), distance=0.9 - index * 0.1
+        )
+        for index, datapoint_id in enumerate(datapoint_ids)
+    ]
+    return aiplatform_v1.FindNeighborsResponse(
+        nearest_neighbors=[aiplatform_v1.FindNeighborsResponse.NearestNeighbors(neighbors=neighbors)]
+    )
+
+
+def autospec_client(cls):
+    instance = mock.create_autospec(cls, instance=True)
+    factory = mock.Mock(return_value=instance)
+    return factory, instance
+
+
+def test_search_uses_match_service_client(aiplatform_v1):
+    assert hasattr(aiplatform_v1.MatchServiceClient, "find_neighbors")
+    match_factory, match_client = autospec_client(aiplatform_v1.MatchServiceClient)
+    match_client.find_neighbors.return_value = make_response(aiplatform_v1, ["media1_ep1", "media2_ep2"])
+
+    store = VertexVectorStore(
+        "project", "us-central1", index_endpoint_id="123", endpoint_domain="1.us-central1-1.vdb.vertexai.goog"
+    )
+    with mock.patch.object(aiplatform_v1, "MatchServiceClient", match_factory):
+        results = store.search(
+            [[0.1, 0.2]], top_k=2,
+            restricts=[{"namespace": "child_id", "allow_list": ["child1"]}],
+            numeric_restricts=[{"namespace": "captured_at", "value_int": 1, "op": "GREATER_EQUAL"}],
+        )
+
+    assert match_factory.call_args.kwargs["client_options"] == {"api_endpoint": "1.us-central1-1.vdb.vertexai.goog"}
+    request = match_client.find_neighbors.call_args.kwargs["request"]
+    assert request["index_endpoint"] == "projects/project/locations/us-central1/indexEndpoints/123"
+    # リクエストはそのまま FindNeighborsRequest に変換できる
+    aiplatform_v1.FindNeighborsRequest(request)
+    assert [[datapoint_id for datapoint_id, _ in neighbors] for neighbors in results] == [["media1_ep1", "media2_ep2"]]
+
+
+def test_endpoint_domain_is_read_from_index_endpoint(aiplatform_v1):
+    endpoint_factory, endpoint_client = autospec_client(aiplatform_v1.IndexEndpointServiceClient)
+    endpoint_client.get_index_endpoint.return_value = aiplatform_v1.IndexEndpoint(
+        public_endpoint_domain_name="2.us-central1-1.vdb.vertexai.goog"
+    )
+    match_factory, match_client = autospec_client(aiplatform_v1.MatchServiceClient)
+    match_client.find_neighbors.return_value = make_response(aiplatform_v1, [])
+
+    store = VertexVectorStore("project", "us-central1", index_endpoint_id="123")
+    with mock.patch.object(aiplatform_v1, "IndexEndpointServiceClient", endpoint_factory), \
+            mock.patch.object(aiplatform_v1, "MatchServiceClient", match_factory):
+        assert store.search([[0.1, 0.2]]) == [[]]
+
+    assert match_factory.call_args.kwargs["client_options"] == {"api_endpoint": "2.us-central1-1.vdb.vertexai.goog"}
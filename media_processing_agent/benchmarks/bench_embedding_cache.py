@@ -0,0 +1,105 @@
+"""
+Benchmark: embedding cache for episode tag texts
+
+合成したメディア（1件あたり2〜4エピソード、タグは頻度に偏りのある語彙から2〜3語）を順に登録する流れで、
+- per-episode: 従来どおりエピソードごとに1リクエスト
+- batched: メディアごとに1リクエスト（キャッシュなし）
+- cached: メディアごとに1リクエスト + メモリLRU
+- cold start + disk: 新しいプロセス（メモリは空）でdisk永続層から同じ内容をバックフィル
+のリクエスト数・埋め込んだ文字数・ヒット率・節約額・埋め込み待ちの時間（1リクエストの遅延を仮定）を比較する
+
+埋め込みは文のハッシュから作る決定的な疑似ベクトルで、Vertex AIは呼び出さない
+
+Usage:
+    python bench_embedding_cache.py --media 2000 --vocabulary 300 --request-ms 80
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+from embedding_cache import EmbeddingCache, normalize_text  # noqa: E402
+
+DIM = 768
+MODEL_NAME = "text-embedding-004"
+
+
+def make_media(count, vocabulary, rng):
+    words = [f"タグ{index}" for index in range(vocabulary)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+    media = []
+    for _ in range(count):
+        episodes = []
+        for _ in range(rng.randint(2, 4)):
+            tags = rng.choices(words, weights=weights, k=rng.randint(2, 3))
+            # 表記ゆれ（全角スペース区切り）を混ぜる
+            episodes.append("　".join(tags) if rng.random() < 0.1 else " ".join(tags))
+        media.append(episodes)
+    return media
+
+
+class FakeEmbedder:
+    """リクエスト数と文字数を数える疑似埋め込みモデル"""
+
+    def __init__(self):
+        self.requests = 0
+        self.chars = 0
+
+    def __call__(self, texts):
+        self.requests += 1
+        self.chars += sum(len(text) for text in texts)
+        vectors = []
+        for text in texts:
+            seed = hashlib.sha256(text.encode("utf-8")).digest()
+            rng = random.Random(seed)
+            vectors.append([rng.uniform(-1, 1) for _ in range(DIM)])
+        return vectors
+
+
+def run(label, media, request_ms, cache=None, per_episode=False):
+    embedder = FakeEmbedder()
+    start = time.perf_counter()
+    for episodes in media:
+        if cache is None:
+            batches = [[text] for text in episodes] if per_episode else [[normalize_text(t) for t in episodes]]
+            for batch in batches:
+                embedder(batch)
+        else:
+            cache.get_embeddings(MODEL_NAME, episodes, embedder)
+    cpu = time.perf_counter() - start
+    waited = embedder.requests * request_ms / 1000
+    line = f"{label:<18} {embedder.requests:>9} {embedder.chars:>10} {waited:>10.1f} {cpu:>8.2f}"
+    if cache is not None:
+        stats = cache.get_stats()
+        line += f" {stats['hit_rate']:>8.2f} {stats['cost_saved_usd']:>10.5f}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--media", type=int, default=2000)
+    parser.add_argument("--vocabulary", type=int, default=300)
+    parser.add_argument("--request-ms", type=float, default=80.0, help="1リクエストあたりの仮定の遅延（ミリ秒）")
+    parser.add_argument("--max-entries", type=int, default=4096)
+    args = parser.parse_args()
+
+    media = make_media(args.media, args.vocabulary, random.Random(0))
+    episodes = sum(len(items) for items in media)
+    print(f"{args.media} media, {episodes} episodes, {len({normalize_text(t) for m in media for t in m})} distinct tag texts")
+    print(f"{'mode':<18} {'requests':>9} {'chars':>10} {'wait s':>10} {'cpu s':>8} {'hit rate':>8} {'saved USD':>10}")
+    run("per-episode", media, args.request_ms, per_episode=True)
+    run("batched", media, args.request_ms)
+    run("cached", media, args.request_ms, EmbeddingCache(max_entries=args.max_entries))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        run("cached + disk", media, args.request_ms, EmbeddingCache(max_entries=args.max_entries, backend="disk", cache_dir=cache_dir))
+        run("cold start + disk", media, args.request_ms, EmbeddingCache(max_entries=args.max_entries, backend="disk", cache_dir=cache_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark: 候補フレームのデコード・品質評価（プロセス内 vs プロセスプール）
+
+ワーカー数ごとに select_best_frame の処理時間を計測し、プロセス内で処理した場合と
+同じフレーム・スコアが選ばれるかを確認する（プールの起動時間は別に表示）
+速度向上は利用可能なvCPU数が上限になる
+
+Usage:
+    python bench_frame_pool.py                     # 合成した1080pの動画で計測
+    python bench_frame_pool.py --video a.mov --workers 1 2 4 --candidates 5 16
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+import numpy as np  # noqa: E402
+
+from bench_frame_sampling import make_clip  # noqa: E402
+from frame_pool import get_pool_workers, reset_frame_pool, select_best_frame, warm_up_frame_pool  # noqa: E402
+from video_thumbnail import FrameSampler  # noqa: E402
+
+
+def run(path, timestamps, workers):
+    with FrameSampler(path) as sampler:
+        return select_best_frame(sampler, timestamps, workers=workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="計測する動画ファイル")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[5, 16])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"default workers (cgroup CPU quota, memory cap): {get_pool_workers()}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.video
+        if not path:
+            path = os.path.join(tmp_dir, "clip_1080p.mp4")
+            make_clip(path, 40, size=(1920, 1080))
+
+        with FrameSampler(path) as sampler:
+            duration = sampler.info["duration"]
+
+        print(f"{'candidates':>10} {'workers':>8} {'startup s':>10} {'median s':>9} {'speedup':>8} {'same':>5}")
+        for count in args.candidates:
+            timestamps = list(np.linspace(duration * 0.1, duration * 0.9, count))
+            reference_frame, reference_scored = run(path, timestamps, 1)
+            baseline = None
+            for workers in args.workers:
+                reset_frame_pool()
+                start = time.perf_counter()
+                warm_up_frame_pool(workers)
+                startup = time.perf_counter() - start
+
+                samples = []
+                for _ in range(args.runs):
+                    start = time.perf_counter()
+                    frame, scored = run(path, timestamps, workers)
+                    samples.append(time.perf_counter() - start)
+                median = statistics.median(samples)
+                baseline = baseline or median
+                same = np.array_equal(frame, reference_frame) and np.allclose(
+                    [score for _, score in scored], [score for _, score in reference_scored]
+                )
+                print(
+                    f"{count:>10} {workers:>8} {startup:>10.2f} {median:>9.3f} "
+                    f"{baseline / median:>7.2f}x {'yes' if same else 'NO':>5}"
+                )
+        reset_frame_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark: 候補フレーム抽出（従来方式 vs FrameSampler）
+
+従来方式: 長さ取得用に1回 + 候補ごとにVideoCaptureを開いてシーク
+FrameSampler: 1回だけ開き、候補位置を時刻順にgrab/retrieveで取得
+
+Usage:
+    python bench_frame_sampling.py                 # 合成した短い動画と長い動画で計測
+    python bench_frame_sampling.py --video a.mov --video b.mp4
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+
+from video_thumbnail import FrameSampler, extract_frame_at_timestamp  # noqa: E402
+
+
+def make_clip(path, seconds, fps=30, size=(1280, 720)):
+    """動きのある合成動画を作成"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    for i in range(int(seconds * fps)):
+        frame = np.roll(background, i * 4, axis=1)
+        cv2.circle(frame, (i * 7 % size[0], size[1] // 2), 80, (255, 255, 255), -1)
+        writer.write(frame)
+    writer.release()
+
+
+def candidate_timestamps(duration):
+    if duration <= 2:
+        return [0.5, 1.0]
+    if duration <= 5:
+        return [0.5, 1.0, 2.0, duration * 0.7]
+    return [duration * p for p in (0.2, 0.3, 0.4, 0.5, 0.6)]
+
+
+def legacy(path):
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    duration = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) / fps if fps > 0 else 0
+    cap.release()
+    return [extract_frame_at_timestamp(path, ts)[0] for ts in candidate_timestamps(duration)]
+
+
+def sampler(path):
+    with FrameSampler(path) as s:
+        return [frame for frame, _ in s.sample(candidate_timestamps(s.info["duration"]))]
+
+
+def measure(fn, path, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn(path)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", action="append", help="計測する動画ファイル（複数指定可）")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        videos = args.video
+        if not videos:
+            videos = []
+            for label, seconds in (("short_4s", 4), ("long_60s", 60)):
+                path = os.path.join(tmp_dir, f"{label}.mp4")
+                make_clip(path, seconds)
+                videos.append(path)
+
+        print(f"{'video':<20} {'legacy ms':>10} {'sampler ms':>11} {'speedup':>8} {'decoded':>8} {'seeks':>6}")
+        for path in videos:
+            legacy_ms = measure(legacy, path, args.runs)
+            sampler_ms = measure(sampler, path, args.runs)
+            with FrameSampler(path) as s:
+                s.sample(candidate_timestamps(s.info["duration"]))
+                decoded, seeks = s.decoded_frames, s.seeks
+            print(
+                f"{os.path.basename(path):<20} {legacy_ms:>10.1f} {sampler_ms:>11.1f} "
+                f"{legacy_ms / sampler_ms:>7.2f}x {decoded:>8} {seeks:>6}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark: フレーム品質スコア（従来方式 vs FrameScorer）
+
+従来方式: フレームごとにCascadeClassifierを読み込み、フル解像度でラプラシアンと顔検出
+FrameScorer: Cascadeはプロセスで1回だけ読み込み、縮小グレースケールで候補をまとめて評価
+
+速度に加えて、両者のスコア差と候補内の順位（どのフレームが選ばれるか）の一致を確認する
+
+Usage:
+    python bench_frame_scorer.py                        # 合成フレームで計測
+    python bench_frame_scorer.py --image a.jpg --image b.jpg
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+
+from frame_scorer import FrameScorer  # noqa: E402
+
+
+def legacy_calculate_frame_quality(frame):
+    """変更前のcalculate_frame_quality"""
+    score = 0.0
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    brightness = np.mean(gray)
+    score += (1.0 - abs(brightness - 128) / 128) * 0.3
+    score += min(np.std(gray) / 80, 1.0) * 0.3
+    sharpness = np.var(cv2.Laplacian(gray, cv2.CV_64F))
+    score += min(sharpness / 1000, 1.0) * 0.2
+    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    if len(face_cascade.detectMultiScale(gray, 1.1, 4)) > 0:
+        score += 0.2
+    return min(score, 1.0)
+
+
+def make_candidates(size=(1920, 1080), count=5, seed=0):
+    """明るさ・ブレの異なる候補フレームを合成"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    base = np.zeros((height, width, 3), dtype=np.uint8)
+    gradient = np.linspace(40, 200, width, dtype=np.float32)
+    base[:] = gradient[None, :, None].astype(np.uint8)
+    for _ in range(40):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.circle(base, center, int(rng.integers(20, 200)), color, -1)
+    for _ in range(20):
+        p1 = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        p2 = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.line(base, p1, p2, (255, 255, 255), int(rng.integers(1, 6)))
+
+    frames = []
+    for i in range(count):
+        frame = base.astype(np.float32) * float(rng.uniform(0.5, 1.3))
+        frame += rng.normal(0, 6, frame.shape)
+        frame = np.clip(frame, 0, 255).astype(np.uint8)
+        blur = int(rng.integers(0, 4)) * 2 + 1
+        if blur > 1:
+            frame = cv2.GaussianBlur(frame, (blur * 2 + 1, blur * 2 + 1), blur)
+        frames.append(frame)
+    return frames
+
+
+def measure(fn, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", action="append", help="候補として評価する画像（複数指定で1セット）")
+    parser.add_argument("--sets", type=int, default=20, help="合成する候補セット数")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.image:
+        candidate_sets = [[cv2.imread(path) for path in args.image]]
+    else:
+        candidate_sets = [make_candidates(seed=seed) for seed in range(args.sets)]
+
+    scorer = FrameScorer()
+    scorer.score(candidate_sets[0][0])  # Cascadeの読み込みを計測から除外
+
+    legacy_ms = measure(lambda: [[legacy_calculate_frame_quality(f) for f in s] for s in candidate_sets], args.runs)
+    scorer_ms = measure(lambda: [scorer.score_batch(s) for s in candidate_sets], args.runs)
+
+    diffs = []
+    same_choice = 0
+    for frames in candidate_sets:
+        legacy_scores = [legacy_calculate_frame_quality(f) for f in frames]
+        new_scores = scorer.score_batch(frames)
+        diffs.extend(abs(a - b) for a, b in zip(legacy_scores, new_scores))
+        same_choice += int(np.argmax(legacy_scores) == np.argmax(new_scores))
+
+    frames_total = sum(len(s) for s in candidate_sets)
+    print(f"frames: {frames_total} in {len(candidate_sets)} candidate sets")
+    print(f"legacy:      {legacy_ms:8.1f} ms ({legacy_ms / frames_total:.1f} ms/frame)")
+    print(f"FrameScorer: {scorer_ms:8.1f} ms ({scorer_ms / frames_total:.1f} ms/frame)  {legacy_ms / scorer_ms:.2f}x")
+    print(f"score diff:  mean {statistics.mean(diffs):.4f}, max {max(diffs):.4f}")
+    print(f"best frame agreement: {same_choice}/{len(candidate_sets)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark: batch vs streaming perspective planning
+
+objective_analyzerの結果（facts）に対して、
+- batch: perspective_determiner完了後にdynamic_multi_analyzerを順次実行
+- streaming: 視点が確定するたびにdynamic_multi_analyzerを並行実行
+の2モードを実行し、最初のエピソードまでの時間と全体の時間を比較する
+
+Usage:
+    python bench_perspective_streaming.py --media-uri gs://bucket/path/photo.jpg
+    python bench_perspective_streaming.py --facts-json facts.json --runs 5
+
+Vertex AIへの実呼び出しを行うため、GOOGLE_CLOUD_PROJECT等の認証情報が必要
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+import vertexai  # noqa: E402
+
+from agent import (  # noqa: E402
+    dynamic_multi_analyzer,
+    get_location,
+    get_project_id,
+    objective_analyzer,
+    perspective_determiner,
+    streaming_perspective_analysis,
+)
+
+
+def run_batch(facts, child_age_months):
+    started = time.monotonic()
+    first_episode = None
+    result = perspective_determiner(facts, child_age_months)
+    perspectives = result.get("report", {}).get("perspectives", [])
+    for perspective in perspectives:
+        dynamic_multi_analyzer(facts, perspective)
+        if first_episode is None:
+            first_episode = time.monotonic() - started
+    return first_episode, time.monotonic() - started, False
+
+
+def run_streaming(facts, child_age_months):
+    result = streaming_perspective_analysis(facts, child_age_months)
+    timings = result.get("report", {}).get("timings", {})
+    return timings.get("first_episode_sec"), timings.get("total_sec"), timings.get("fallback", False)
+
+
+def summarize(label, samples):
+    firsts = [s[0] for s in samples if s[0] is not None]
+    totals = [s[1] for s in samples if s[1] is not None]
+    fallbacks = sum(1 for s in samples if s[2])
+    print(
+        f"{label:<10} time-to-first-episode median={statistics.median(firsts):.2f}s "
+        f"total median={statistics.median(totals):.2f}s "
+        f"(min={min(totals):.2f}s max={max(totals):.2f}s, fallbacks={fallbacks}/{len(samples)})"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--media-uri", help="objective_analyzerに渡すメディアURI")
+    source.add_argument("--facts-json", help="objective_analyzerの出力（report）を保存したJSONファイル")
+    parser.add_argument("--age-months", type=int, default=12)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    vertexai.init(project=get_project_id(), location=get_location())
+
+    if args.facts_json:
+        with open(args.facts_json, encoding="utf-8") as f:
+            facts = json.load(f)
+    else:
+        facts_result = objective_analyzer(args.media_uri)
+        if facts_result.get("status") != "success":
+            print(f"objective_analyzer failed: {facts_result.get('error_message')}")
+            sys.exit(1)
+        facts = facts_result["report"]
+
+    batch_samples = []
+    streaming_samples = []
+    for i in range(args.runs):
+        # 交互に実行してモデル側の負荷変動の影響を均す
+        batch_samples.append(run_batch(facts, args.age_months))
+        streaming_samples.append(run_streaming(facts, args.age_months))
+        print(f"run {i + 1}/{args.runs}: batch={batch_samples[-1][1]:.2f}s streaming={streaming_samples[-1][1]:.2f}s")
+
+    summarize("batch", batch_samples)
+    summarize("streaming", streaming_samples)
+
+
+if __name__ == "__main__":
+    main()
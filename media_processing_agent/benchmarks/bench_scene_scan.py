@@ -0,0 +1,103 @@
+"""
+Benchmark: サムネイル候補の選び方（固定割合 vs シーン走査）
+
+固定割合: 長さの20〜60%の5点
+シーン走査: 全体を低解像度で走査し、シーン区間ごとに安定した点を候補にする
+候補の中で最も高い品質スコアと、デコードコスト（grab/retrieve/シークの見積もり）・処理時間を比較する
+
+Usage:
+    python bench_scene_scan.py                     # 合成した複数シーンの動画で計測
+    python bench_scene_scan.py --video a.mov --budget 400
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+
+from frame_scorer import get_frame_scorer  # noqa: E402
+from scene_scan import select_scene_candidates  # noqa: E402
+from video_thumbnail import SCENE_CANDIDATES, FrameSampler, get_candidate_timestamps  # noqa: E402
+
+
+def make_scene_clip(path, fps=30, size=(1280, 720)):
+    """
+    シーンの異なる合成動画を作成
+    固定割合の候補が当たる20〜60%は暗く激しく動くシーンで、前後に静止した明るいシーンを置く
+    """
+    width, height = size
+    rng = np.random.default_rng(0)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    scenes = [
+        (4, "static"),
+        (16, "shaky"),
+        (8, "static"),
+        (12, "shaky"),
+    ]
+    for index, (seconds, kind) in enumerate(scenes):
+        base = np.full((height, width, 3), 60 + index * 40, dtype=np.uint8)
+        cv2.rectangle(base, (width // 4, height // 4), (width * 3 // 4, height * 3 // 4), (200, 180, 160), -1)
+        for _ in range(40):
+            x, y = rng.integers(0, width), rng.integers(0, height)
+            cv2.circle(base, (int(x), int(y)), int(rng.integers(5, 30)), tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+        for i in range(seconds * fps):
+            if kind == "static":
+                frame = base
+            else:
+                shift = int(rng.integers(-40, 40))
+                frame = cv2.GaussianBlur(np.roll(base, shift, axis=1), (21, 21), 0) // 3
+            writer.write(frame)
+    writer.release()
+
+
+def run(path, use_scan, budget):
+    scorer = get_frame_scorer()
+    start = time.perf_counter()
+    with FrameSampler(path) as sampler:
+        timestamps = []
+        if use_scan:
+            timestamps = select_scene_candidates(sampler, SCENE_CANDIDATES, budget)["timestamps"]
+        if not timestamps:
+            timestamps = get_candidate_timestamps(sampler.info["duration"])
+        candidates = sampler.sample(timestamps, max_grab_distance=FrameSampler.SEEK_COST_FRAMES if use_scan else None)
+        cost = sampler.decode_cost
+    scores = scorer.score_batch([frame for frame, _ in candidates])
+    elapsed = time.perf_counter() - start
+    best = int(np.argmax(scores)) if scores else 0
+    return {
+        "best_score": max(scores) if scores else 0.0,
+        "best_ts": candidates[best][1]["timestamp"] if candidates else 0.0,
+        "decode_cost": cost,
+        "elapsed": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", action="append", help="計測する動画ファイル（複数指定可）")
+    parser.add_argument("--budget", type=int, default=600, help="シーン走査のデコード予算（フレーム数）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        videos = args.video
+        if not videos:
+            videos = [os.path.join(tmp_dir, "scenes_40s.mp4")]
+            make_scene_clip(videos[0])
+
+        print(f"{'video':<18} {'method':<7} {'best score':>10} {'best ts':>8} {'decode cost':>12} {'sec':>6}")
+        for path in videos:
+            for label, use_scan in (("fixed", False), ("scan", True)):
+                result = run(path, use_scan, args.budget)
+                print(
+                    f"{os.path.basename(path):<18} {label:<7} {result['best_score']:>10.3f} "
+                    f"{result['best_ts']:>7.1f}s {result['decode_cost']:>12} {result['elapsed']:>6.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark: サムネイル用の動画取得（全体取得 vs 範囲取得）
+
+GCSのBlobの代わりにローカルファイルから読み出すBlobを使い、
+取得バイト数・リクエスト数・一時ファイルのディスク使用量と、候補フレームが全体取得時と一致するかを確認する
+
+Usage:
+    python bench_video_download.py                 # 合成した動画（8秒 / 120秒）で計測
+    python bench_video_download.py --video a.mov
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+import numpy as np  # noqa: E402
+
+from bench_frame_sampling import make_clip  # noqa: E402
+from video_source import VideoDownload  # noqa: E402
+from video_thumbnail import FrameSampler, get_candidate_timestamps  # noqa: E402
+
+
+class LocalFileBlob:
+    """google.cloud.storage.Blobの範囲取得APIをローカルファイルで再現する"""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.requests = 0
+
+    def download_as_bytes(self, start=0, end=None):
+        self.requests += 1
+        end = self.size - 1 if end is None else end
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+    def download_to_file(self, file_obj, start=0, end=None):
+        file_obj.write(self.download_as_bytes(start, end))
+
+
+class LocalVideoDownload(VideoDownload):
+    def _download(self):
+        self._blob = LocalFileBlob(self.video_url)
+        self.stats["object_bytes"] = self._blob.size
+        if not self._download_ranged(self._blob.size):
+            self._download_blob_full()
+
+
+def sample(path):
+    with FrameSampler(path) as sampler:
+        return sampler.sample(get_candidate_timestamps(sampler.info["duration"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", action="append", help="計測する動画ファイル（複数指定可）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        videos = args.video
+        if not videos:
+            videos = []
+            for label, seconds in (("short_8s", 8), ("long_120s", 120)):
+                path = os.path.join(tmp_dir, f"{label}.mp4")
+                make_clip(path, seconds)
+                videos.append(path)
+
+        print(f"{'video':<16} {'mode':<7} {'object MB':>10} {'fetched MB':>11} {'disk MB':>8} {'requests':>9} {'frames':>7}")
+        for path in videos:
+            reference = sample(path)
+            with LocalVideoDownload(path, timestamps_fn=lambda duration, fps: get_candidate_timestamps(duration)) as download:
+                frames = sample(download.path)
+                stats = download.stats
+                requests = download._blob.requests
+            same = len(frames) == len(reference) and all(
+                np.array_equal(a[0], b[0]) for a, b in zip(frames, reference)
+            )
+            print(
+                f"{os.path.basename(path):<16} {stats['mode']:<7} {stats['object_bytes'] / 2**20:>10.1f} "
+                f"{stats['downloaded_bytes'] / 2**20:>11.1f} {stats['temp_disk_bytes'] / 2**20:>8.1f} "
+                f"{requests:>9} {'same' if same else 'DIFF':>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Benchmark: プレビュー変換（低ビットレートMP4 / アニメーションWebP）
+
+元動画に対するプレビューのサイズ・ビットレート・圧縮率と変換時間を計測する
+
+Usage:
+    python bench_video_preview.py                  # 合成した動画（8秒 / 60秒）で計測
+    python bench_video_preview.py --video a.mov
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+from bench_frame_sampling import make_clip  # noqa: E402
+from video_preview import render_webp_loop, transcode_preview  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", action="append", help="計測する動画ファイル（複数指定可）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        videos = args.video
+        if not videos:
+            videos = []
+            for label, seconds in (("short_8s", 8), ("long_60s", 60)):
+                path = os.path.join(tmp_dir, f"{label}.mp4")
+                make_clip(path, seconds)
+                videos.append(path)
+
+        print(
+            f"{'video':<14} {'source MB':>10} {'preview':>10} {'sec':>6} {'MB':>6} {'kbps':>6} "
+            f"{'ratio':>6} {'encode s':>9} {'webp KB':>8} {'webp s':>7}"
+        )
+        for path in videos:
+            source_bytes = os.path.getsize(path)
+            preview = transcode_preview(path, os.path.join(tmp_dir, "preview.mp4"))
+            loop = render_webp_loop(path, os.path.join(tmp_dir, "loop.webp"))
+            kbps = preview["bytes"] * 8 / 1000 / preview["duration"] if preview["duration"] else 0
+            print(
+                f"{os.path.basename(path):<14} {source_bytes / 2**20:>10.1f} "
+                f"{preview['width']:>4}x{preview['height']:<5} {preview['duration']:>6.1f} "
+                f"{preview['bytes'] / 2**20:>6.2f} {kbps:>6.0f} {source_bytes / preview['bytes']:>5.1f}x "
+                f"{preview['transcode_sec']:>9.2f} {loop.get('bytes', 0) / 1024:>8.0f} {loop.get('transcode_sec', 0):>7.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,24 @@ from datetime import datetime, timezone
 import json
 import logging
 import asyncio
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from google.cloud.aiplatform_v1beta1.types import index_endpoint
-from vertexai.generative_models import GenerativeModel, Part
+from vertexai.generative_models import Part
 from vertexai.language_models import TextEmbeddingModel
 import vertexai
 from google.cloud import firestore
-from google.cloud.aiplatform import MatchingEngineIndex
-from google.cloud import storage
+
+import hedging
+from image_renditions import get_saved_media_renditions
+from embedding_cache import get_embedding_cache
+from episode_embeddings import encode_embedding, get_embedding_dtype
+from json_stream import StreamingArrayParser
+from model_router import get_model
+from vector_gc import record_indexed_datapoints
+from vector_store import get_vector_store
+from theme_labels import get_theme_set_version, label_episodes
 
 # Load environment variables
 load_dotenv()
@@ -36,10 +46,16 @@ def get_index_endpoint_id():
     return os.getenv("VERTEX_AI_INDEX_ENDPOINT_ID")
 
 
+def is_perspective_streaming_enabled():
+    return os.getenv("PERSPECTIVE_STREAMING", "false").lower() in ("1", "true", "yes")
+
+
+# Must match the content generator's embedding model (query and episode vectors are compared)
+EMBEDDING_MODEL_NAME = "text-embedding-004"
+
 # Initialize services lazily
 _db = None
 _embedding_model = None
-_vector_search_index = None
 
 
 def get_firestore_client():
@@ -53,23 +69,23 @@ def get_embedding_model():
     global _embedding_model
     if _embedding_model is None:
         vertexai.init(project=get_project_id(), location=get_location())
-        _embedding_model = TextEmbeddingModel.from_pretrained("text-embedding-004")
+        _embedding_model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL_NAME)
     return _embedding_model
 
 
-def get_vector_search_index():
-    global _vector_search_index
-    if _vector_search_index is None:
-        index_id = get_index_id()
-        if index_id:
-            _vector_search_index = MatchingEngineIndex(
-                index_name=f"projects/{get_project_id()}/locations/{get_location()}/indexes/{index_id}"
-            )
-    return _vector_search_index
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Embed texts in one request, skipping texts already in the embedding cache"""
+    return get_embedding_cache().get_embeddings(
+        EMBEDDING_MODEL_NAME,
+        texts,
+        lambda batch: [embedding.values for embedding in get_embedding_model().get_embeddings(batch)],
+    )
 
 
 logger = logging.getLogger(__name__)
-MODEL_NAME = "gemini-2.5-flash"
+MAX_PERSPECTIVES = 4
+# Images per multi-part objective analysis request in upload sessions
+MAX_SESSION_IMAGES = 8
 
 # Child ID will be set when the agent is invoked
 # Default to "demo" if not provided
@@ -101,58 +117,83 @@ def convert_firebase_url_to_gs(firebase_url: str) -> str:
     return firebase_url  # Return original if conversion fails
 
 
-def objective_analyzer(media_uri: str) -> dict:
-    """Extract objective facts from media files"""
-    model = GenerativeModel(MODEL_NAME)
+OBJECTIVE_FACTS_FORMAT = """
+        {
+            "scene_description": "その場のシーン全体の描写（場所、時間帯、周りの状況など）",
+            "child_actions": ["子供が行っている具体的な行動のリスト"],
+            "child_expressions": ["観察できる表情や感情表現"],
+            "objects_and_items": ["子供が触れている、使っている、見ている物のリスト"],
+            "environment_details": ["背景、場所、周囲の人や物の詳細"],
+            "body_posture": ["姿勢や体の位置（座っている、立っている、寝ているなど）"],
+            "spoken_or_sounds": ["聞こえる言葉、音、声（ある場合）"],
+            "clothing_and_appearance": ["服装や身に着けているもの"]
+        }"""
+
+
+def detect_mime_type(media_uri: str) -> str:
+    """Determine MIME type from the media URL extension"""
+    media_uri_lower = media_uri.lower()
+
+    # Extract extension from URL (handle query parameters)
+    url_path = media_uri_lower.split("?")[0]
+
+    # Check common image formats
+    if any(url_path.endswith(ext) for ext in [".jpg", ".jpeg"]):
+        mime_type = "image/jpeg"
+    elif url_path.endswith(".png"):
+        mime_type = "image/png"
+    elif url_path.endswith(".gif"):
+        mime_type = "image/gif"
+    elif url_path.endswith(".webp"):
+        mime_type = "image/webp"
+    elif url_path.endswith(".bmp"):
+        mime_type = "image/bmp"
+    # Check common video formats
+    elif url_path.endswith(".mp4"):
+        mime_type = "video/mp4"
+    elif url_path.endswith(".avi"):
+        mime_type = "video/x-msvideo"
+    elif url_path.endswith(".mov"):
+        mime_type = "video/quicktime"
+    elif url_path.endswith(".webm"):
+        mime_type = "video/webm"
+    elif url_path.endswith(".mkv"):
+        mime_type = "video/x-matroska"
+    else:
+        # Default to image/jpeg if can't determine
+        mime_type = "image/jpeg"
+        logger.warning(
+            f"Could not determine MIME type from URL, defaulting to {mime_type}"
+        )
+
+    return mime_type
+
+
+def build_media_part(media_uri: str):
+    """Create a Gemini Part for the media, returning (part, mime_type)"""
+    # Try to convert Firebase URL to gs:// format for better access
+    original_uri = media_uri
+    if "firebasestorage.app" in media_uri:
+        media_uri = convert_firebase_url_to_gs(media_uri)
+
+    mime_type = detect_mime_type(original_uri)
+    logger.info(f"Detected MIME type: {mime_type} for URL: {media_uri}")
+
+    # Try gs:// URL first, then fallback to original URL
     try:
-        # Try to convert Firebase URL to gs:// format for better access
-        original_uri = media_uri
-        if "firebasestorage.app" in media_uri:
-            media_uri = convert_firebase_url_to_gs(media_uri)
-
-        # Determine MIME type from URL extension
-        media_uri_lower = original_uri.lower()
-
-        # Extract extension from URL (handle query parameters)
-        url_path = media_uri_lower.split("?")[0]
-
-        # Check common image formats
-        if any(url_path.endswith(ext) for ext in [".jpg", ".jpeg"]):
-            mime_type = "image/jpeg"
-        elif url_path.endswith(".png"):
-            mime_type = "image/png"
-        elif url_path.endswith(".gif"):
-            mime_type = "image/gif"
-        elif url_path.endswith(".webp"):
-            mime_type = "image/webp"
-        elif url_path.endswith(".bmp"):
-            mime_type = "image/bmp"
-        # Check common video formats
-        elif url_path.endswith(".mp4"):
-            mime_type = "video/mp4"
-        elif url_path.endswith(".avi"):
-            mime_type = "video/x-msvideo"
-        elif url_path.endswith(".mov"):
-            mime_type = "video/quicktime"
-        elif url_path.endswith(".webm"):
-            mime_type = "video/webm"
-        elif url_path.endswith(".mkv"):
-            mime_type = "video/x-matroska"
-        else:
-            # Default to image/jpeg if can't determine
-            mime_type = "image/jpeg"
-            logger.warning(
-                f"Could not determine MIME type from URL, defaulting to {mime_type}"
-            )
+        media_part = Part.from_uri(uri=media_uri, mime_type=mime_type)
+    except Exception as gs_error:
+        logger.warning(f"gs:// URL failed, trying original URL: {gs_error}")
+        media_part = Part.from_uri(uri=original_uri, mime_type=mime_type)
 
-        logger.info(f"Detected MIME type: {mime_type} for URL: {media_uri}")
+    return media_part, mime_type
 
-        # Try gs:// URL first, then fallback to original URL
-        try:
-            media_part = Part.from_uri(uri=media_uri, mime_type=mime_type)
-        except Exception as gs_error:
-            logger.warning(f"gs:// URL failed, trying original URL: {gs_error}")
-            media_part = Part.from_uri(uri=original_uri, mime_type=mime_type)
+
+def objective_analyzer(media_uri: str) -> dict:
+    """Extract objective facts from media files"""
+    model = get_model("objective_analyzer")
+    try:
+        media_part, mime_type = build_media_part(media_uri)
 
         prompt = """
         あなたは、写真や動画からシーンを正確に読み取る分析システムです。
@@ -164,20 +205,10 @@ def objective_analyzer(media_uri: str) -> dict:
         - 子供の表情や動作を客観的に記録する
         - 成長や発達の推測は行わず、見たままを記述する
 
-        【出力形式】
-        {
-            "scene_description": "その場のシーン全体の描写（場所、時間帯、周りの状況など）",
-            "child_actions": ["子供が行っている具体的な行動のリスト"],
-            "child_expressions": ["観察できる表情や感情表現"],
-            "objects_and_items": ["子供が触れている、使っている、見ている物のリスト"],
-            "environment_details": ["背景、場所、周囲の人や物の詳細"],
-            "body_posture": ["姿勢や体の位置（座っている、立っている、寝ているなど）"],
-            "spoken_or_sounds": ["聞こえる言葉、音、声（ある場合）"],
-            "clothing_and_appearance": ["服装や身に着けているもの"]
-        }
+        【出力形式】""" + OBJECTIVE_FACTS_FORMAT + """
         """
 
-        response = model.generate_content([media_part, prompt])
+        response = hedging.generate_content("objective_analyzer", model, [media_part, prompt])
         response_text = response.text.strip()
 
         logger.info(f"Raw response from model: {response_text[:200]}...")
@@ -235,15 +266,97 @@ def objective_analyzer(media_uri: str) -> dict:
         return {"status": "error", "error_message": str(e)}
 
 
-def perspective_determiner(facts: Dict[str, Any], child_age_months: int) -> dict:
-    """Determine analysis perspectives focused on scene identification and action description"""
-    model = GenerativeModel(MODEL_NAME)
+def batch_objective_analyzer(media_uris: List[str]) -> dict:
+    """
+    Extract objective facts for several images in a single Gemini call.
+    The report is a list aligned with media_uris; entries the model did not
+    return are analysed individually with objective_analyzer.
+    """
+    if len(media_uris) == 1:
+        single = objective_analyzer(media_uris[0])
+        return {"status": "success", "report": [single]}
+
+    model = get_model("batch_objective_analyzer")
+    facts_by_index: Dict[int, Dict[str, Any]] = {}
     try:
-        facts_json = json.dumps(facts, ensure_ascii=False, indent=2)
-        media_type = facts.get("media_type", "image")
+        contents = []
+        for i, media_uri in enumerate(media_uris):
+            media_part, _ = build_media_part(media_uri)
+            contents.append(f"【画像{i + 1}】")
+            contents.append(media_part)
 
-        # 動画・写真共通でシーン特定に焦点を当てる
         prompt = f"""
+        あなたは、写真や動画からシーンを正確に読み取る分析システムです。
+        上記の{len(media_uris)}枚の画像は同じお出かけで撮影されたものです。
+        画像ごとに、観察できる具体的なシーン情報と行動事実をリストアップしてください。
+
+        【分析の重点】
+        - 子供が「何をしているか」を具体的に特定する
+        - その場の状況や環境を詳しく描写する
+        - 子供の表情や動作を客観的に記録する
+        - 成長や発達の推測は行わず、見たままを記述する
+        - 画像同士の情報を混ぜず、各画像に写っている内容のみを記述する
+
+        【出力形式】
+        {{
+            "images": [
+                {{
+                    "index": 画像番号（1から{len(media_uris)}）,
+                    "facts": 下記の形式
+                }}
+            ]
+        }}
+
+        factsの形式:""" + OBJECTIVE_FACTS_FORMAT + """
+        """
+        contents.append(prompt)
+
+        response = hedging.generate_content("batch_objective_analyzer", model, contents)
+        response_text = response.text.strip()
+
+        logger.info(f"Raw batch response from model: {response_text[:200]}...")
+
+        import re
+
+        json_match = re.search(r"```json\s*(.*?)\s*```", response_text, re.DOTALL)
+        if json_match:
+            response_text = json_match.group(1)
+        else:
+            json_match = re.search(r"\{.*\}", response_text, re.DOTALL)
+            if json_match:
+                response_text = json_match.group(0)
+
+        for item in json.loads(response_text).get("images", []):
+            index = item.get("index")
+            facts = item.get("facts")
+            if isinstance(index, int) and 1 <= index <= len(media_uris) and isinstance(facts, dict):
+                facts["media_type"] = "image"
+                facts_by_index[index - 1] = facts
+
+    except Exception as e:
+        logger.error(f"Batch objective analysis failed, analysing individually: {e}")
+
+    results = []
+    for i, media_uri in enumerate(media_uris):
+        if i in facts_by_index:
+            results.append({"status": "success", "report": facts_by_index[i]})
+        else:
+            results.append(objective_analyzer(media_uri))
+
+    logger.info(
+        f"Batch objective analysis: {len(facts_by_index)}/{len(media_uris)} images "
+        f"from one call, {len(media_uris) - len(facts_by_index)} individual fallbacks"
+    )
+    return {"status": "success", "report": results}
+
+
+def _build_perspective_prompt(facts: Dict[str, Any], child_age_months: int) -> str:
+    """Build the perspective planning prompt shared by batch and streaming modes"""
+    facts_json = json.dumps(facts, ensure_ascii=False, indent=2)
+    media_type = facts.get("media_type", "image")
+
+    # 動画・写真共通でシーン特定に焦点を当てる
+    prompt = f"""
         あなたは、子供の行動シーンを特定・分析する専門家です。
         観察された事実から、このメディアで「子供が何をしているか」を具体的に特定してください。
 
@@ -291,13 +404,21 @@ def perspective_determiner(facts: Dict[str, Any], child_age_months: int) -> dict
         }}
         """
 
-        prompt += """
+    prompt += """
         
         【重要】
         - 視点数は最大4つまで
         - 実際に観察された内容に基づく視点のみを選択
         - 各視点は重複しないように独立した観点から選ぶ
         """
+    return prompt
+
+
+def perspective_determiner(facts: Dict[str, Any], child_age_months: int) -> dict:
+    """Determine analysis perspectives focused on scene identification and action description"""
+    model = get_model("perspective_determiner")
+    try:
+        prompt = _build_perspective_prompt(facts, child_age_months)
 
         response = model.generate_content(prompt)
         response_text = response.text.strip()
@@ -327,7 +448,7 @@ def perspective_determiner(facts: Dict[str, Any], child_age_months: int) -> dict
 
 def dynamic_multi_analyzer(facts: Dict[str, Any], perspective: Dict[str, Any]) -> dict:
     """Analyze facts from a specific perspective"""
-    model = GenerativeModel(MODEL_NAME)
+    model = get_model("dynamic_multi_analyzer")
     try:
         # Validate perspective structure
         if "type" not in perspective:
@@ -382,7 +503,7 @@ def dynamic_multi_analyzer(facts: Dict[str, Any], perspective: Dict[str, Any]) -
         - 親が見て「この瞬間素敵だな」と思えるような表現を心がける
         """
 
-        response = model.generate_content(prompt)
+        response = hedging.generate_content("dynamic_multi_analyzer", model, prompt)
         response_text = response.text.strip()
 
         # Extract JSON from response
@@ -404,6 +525,108 @@ def dynamic_multi_analyzer(facts: Dict[str, Any], perspective: Dict[str, Any]) -
         return {"status": "error", "error_message": str(e)}
 
 
+def streaming_perspective_analysis(
+    facts: Dict[str, Any], child_age_months: int
+) -> dict:
+    """
+    Stream perspective planning and start dynamic_multi_analyzer for each
+    perspective as soon as its JSON object closes.
+    Falls back to the batch perspective_determiner if the stream breaks.
+    """
+    started = time.monotonic()
+    timings = {
+        "first_perspective_sec": None,
+        "first_episode_sec": None,
+        "total_sec": None,
+        "fallback": False,
+    }
+    dispatched = []  # (perspective, future) in dispatch order
+    dispatched_types = set()
+    analysis_note = ""
+
+    with ThreadPoolExecutor(max_workers=MAX_PERSPECTIVES) as executor:
+
+        def dispatch(perspective: Dict[str, Any]):
+            perspective_type = perspective.get("type")
+            if not perspective_type or perspective_type in dispatched_types:
+                return
+            if len(dispatched) >= MAX_PERSPECTIVES:
+                return
+            dispatched_types.add(perspective_type)
+            future = executor.submit(dynamic_multi_analyzer, facts, perspective)
+            dispatched.append((perspective, future))
+            logger.info(f"Dispatched perspective from stream: {perspective_type}")
+
+        try:
+            model = get_model("perspective_determiner")
+            parser = StreamingArrayParser("perspectives")
+            stream = model.generate_content(
+                _build_perspective_prompt(facts, child_age_months), stream=True
+            )
+            for chunk in stream:
+                for perspective in parser.feed(chunk.text):
+                    if timings["first_perspective_sec"] is None:
+                        timings["first_perspective_sec"] = time.monotonic() - started
+                    dispatch(perspective)
+
+            if not parser.complete:
+                raise ValueError("Perspective stream ended before the array closed")
+            analysis_note = parser.parse_document().get("analysis_note", "")
+
+        except Exception as e:
+            logger.warning(
+                f"Perspective stream failed after {len(dispatched)} perspectives, "
+                f"falling back to batch: {e}"
+            )
+            timings["fallback"] = True
+            perspectives_result = perspective_determiner(facts, child_age_months)
+            if perspectives_result.get("status") == "success":
+                perspectives_data = perspectives_result.get("report", {})
+                analysis_note = perspectives_data.get("analysis_note", "")
+                for perspective in perspectives_data.get("perspectives", []):
+                    dispatch(perspective)
+            elif not dispatched:
+                return perspectives_result
+
+        if not dispatched:
+            return {
+                "status": "error",
+                "error_message": "No perspectives determined for analysis",
+            }
+
+        results = {}
+        future_index = {future: i for i, (_, future) in enumerate(dispatched)}
+        for future in as_completed(future_index):
+            if timings["first_episode_sec"] is None:
+                timings["first_episode_sec"] = time.monotonic() - started
+            results[future_index[future]] = future.result()
+
+    episodes = []
+    for i, (perspective, _) in enumerate(dispatched):
+        analysis_result = results[i]
+        if analysis_result.get("status") == "success":
+            analysis_data = analysis_result.get("report", {})
+            analysis_data["type"] = perspective["type"]
+            analysis_data["perspective_type"] = perspective["type"]
+            episodes.append(analysis_data)
+            logger.info(f"✅ Successfully analyzed perspective: {perspective['type']}")
+        else:
+            logger.error(f"❌ Failed to analyze perspective {perspective['type']}: {analysis_result.get('error_message', 'Unknown error')}")
+
+    timings["total_sec"] = time.monotonic() - started
+    logger.info(f"Streaming perspective analysis timings: {timings}")
+
+    return {
+        "status": "success",
+        "report": {
+            "perspectives": [perspective for perspective, _ in dispatched],
+            "analysis_note": analysis_note,
+            "episodes": episodes,
+            "timings": timings,
+        },
+    }
+
+
 
 
 def generate_emotional_title(episodes: List[Dict[str, Any]]) -> str:
@@ -444,7 +667,7 @@ def generate_emotional_title(episodes: List[Dict[str, Any]]) -> str:
         
         # タイトル生成用のプロンプト作成
         vertexai.init(project=get_project_id(), location=get_location())
-        model = GenerativeModel(MODEL_NAME)
+        model = get_model("generate_emotional_title")
 
         
         # エピソードからより詳細な情報を抽出
@@ -502,6 +725,8 @@ def save_multi_episode_analysis(
     user_id: str = "",
     captured_at: datetime = None,
     thumbnail_url: str = None,
+    thumbnail_renditions: Optional[List[Dict[str, Any]]] = None,
+    video_metadata: Optional[Dict[str, Any]] = None,
 ) -> dict:
     """Save multiple episodes as nested array in a single media document"""
     try:
@@ -544,6 +769,9 @@ def save_multi_episode_analysis(
             }
             episodes_data.append(episode_entry)
 
+        # Notebook theme labels/scores so notebook generation can look them up
+        label_episodes(episodes_data)
+
         # Generate emotional title for timeline
         emotional_title = generate_emotional_title(episodes_data)
 
@@ -556,6 +784,7 @@ def save_multi_episode_analysis(
             "emotional_title": emotional_title,  # For timeline display
             "episodes": episodes_data,
             "episode_count": len(episodes_data),
+            "theme_set_version": get_theme_set_version(),
             "captured_at": captured_at if captured_at else datetime.now(timezone.utc),  # Use provided captured_at or current time
             "created_at": datetime.now(timezone.utc),
             "updated_at": datetime.now(timezone.utc),
@@ -564,6 +793,20 @@ def save_multi_episode_analysis(
         # Add thumbnail URL if provided (for videos)
         if thumbnail_url:
             media_data["thumbnail_url"] = thumbnail_url
+        # Size/format variants so clients can fetch the smallest adequate one
+        if thumbnail_renditions:
+            media_data["thumbnail_renditions"] = thumbnail_renditions
+        # Duration/dimensions/orientation so clients don't have to load the video
+        if video_metadata:
+            media_data["video_metadata"] = video_metadata
+
+        # Photo renditions/placeholder or video preview if the storage trigger
+        # finished first (otherwise it patches this document when it completes)
+        if media_source_uri:
+            try:
+                media_data.update(get_saved_media_renditions(db, media_source_uri))
+            except Exception as e:
+                logger.warning(f"Failed to read media renditions: {e}")
 
         # Save to Firestore
         media_ref = db.collection("analysis_results").document(media_id)
@@ -595,76 +838,96 @@ def index_episodes(
     child_id: str = "",
     captured_at: datetime = None,
 ) -> dict:
-    """Index multiple episodes for vector search"""
+    """Index multiple episodes for vector search and keep a compact copy of their embeddings"""
     try:
         # Use provided child_id or default
         if not child_id:
             child_id = globals().get("CHILD_ID", "demo")
 
-        vector_search_index = get_vector_search_index()
-        if not vector_search_index:
-            logger.warning("Vector search index not configured. Skipping indexing.")
-            return {"status": "skipped", "message": "Vector indexing not configured"}
+        vector_store = get_vector_store()
+        embedding_dtype = get_embedding_dtype()
+        if vector_store is None:
+            logger.warning("Vector store not configured. Skipping indexing.")
+            if not embedding_dtype:
+                return {"status": "skipped", "message": "Vector indexing not configured"}
 
-        indexed_count = 0
+        # (episode_id, tag text) of the episodes to embed
+        entries = []
         for episode in episodes:
+            # Extract episode data
+            if isinstance(episode, dict) and "report" in episode:
+                ep_data = episode["report"]
+            else:
+                ep_data = episode
+
+            episode_id = ep_data.get("id", str(uuid.uuid4()))
+
+            # Create text for embedding - tags only
+            tags = ep_data.get("tags", [])
+            if not tags:
+                logger.warning(f"No tags found for episode {episode_id}, skipping indexing")
+                continue
+            entries.append((episode_id, " ".join(tags)))
+
+        # Embed all episodes in one request (recurring tag texts come from the embedding cache)
+        vectors = embed_texts([text for _, text in entries]) if entries else []
+
+        indexed_count = 0
+        stored_embeddings = {}
+        datapoints = []
+        for (episode_id, _), embedding_vector in zip(entries, vectors):
+            # Compact copy for local theme ranking in notebook generation
+            if embedding_dtype:
+                stored_embeddings[episode_id] = encode_embedding(embedding_vector, embedding_dtype)
+
+            if vector_store is None:
+                continue
+
+            # Create datapoint
+            datapoint = {
+                "datapoint_id": f"{media_id}_{episode_id}",
+                "feature_vector": embedding_vector,
+                "restricts": [
+                    {"namespace": "media_id", "allow_list": [media_id]},
+                    {"namespace": "child_id", "allow_list": [child_id]},
+                ],
+            }
+
+            # captured_at timestamp as a numeric restrict (the notebook's period filter)
+            if captured_at:
+                datapoint["numeric_restricts"] = [
+                    {"namespace": "captured_at", "value_int": int(captured_at.timestamp())}
+                ]
+
+            datapoints.append(datapoint)
+
+        # Upsert all episodes of the media in one request
+        if datapoints:
             try:
-                # Extract episode data
-                if isinstance(episode, dict) and "report" in episode:
-                    ep_data = episode["report"]
-                else:
-                    ep_data = episode
-
-                episode_id = ep_data.get("id", str(uuid.uuid4()))
-
-                # Create text for embedding - tags only
-                tags = ep_data.get("tags", [])
-                if not tags:
-                    logger.warning(f"No tags found for episode {episode_id}, skipping indexing")
-                    continue
-
-                embedding_text = " ".join(tags)
-
-                # Generate embeddings
-                embedding_model = get_embedding_model()
-                embeddings = embedding_model.get_embeddings([embedding_text])
-
-                if embeddings and len(embeddings) > 0:
-                    embedding_vector = embeddings[0].values
-
-                    # Create datapoint
-                    datapoint_id = f"{media_id}_{episode_id}"
-                    restricts = [
-                        {"namespace": "media_id", "allow_list": [media_id]},
-                        {"namespace": "child_id", "allow_list": [child_id]},
-                    ]
-                    
-                    # Add captured_at timestamp if provided
-                    if captured_at:
-                        captured_at_timestamp = int(captured_at.timestamp())
-                        restricts.append(
-                            {"namespace": "captured_at", "value_int": captured_at_timestamp}
-                        )
-                    
-                    datapoint = {
-                        "datapoint_id": datapoint_id,
-                        "feature_vector": embedding_vector,
-                        "restricts": restricts,
-                    }
-
-                    # Upsert to index
-                    vector_search_index.upsert_datapoints([datapoint])
-                    indexed_count += 1
-                    logger.info(f"Indexed episode {episode_id}")
+                indexed_count = vector_store.upsert(datapoints)
+                datapoint_ids = [datapoint["datapoint_id"] for datapoint in datapoints]
+                logger.info(f"Indexed episodes {datapoint_ids}")
+                # Ledger of indexed IDs for garbage collection (the index cannot list its contents)
+                record_indexed_datapoints(get_firestore_client(), media_id, child_id, datapoint_ids)
+            except Exception as e:
+                logger.error(f"Failed to upsert episodes to the vector store: {e}")
 
+        if stored_embeddings:
+            try:
+                get_firestore_client().collection("analysis_results").document(media_id).update({
+                    "episode_embeddings": stored_embeddings,
+                    "embedding_model": EMBEDDING_MODEL_NAME,
+                })
             except Exception as e:
-                logger.error(f"Failed to index episode: {e}")
-                continue
+                logger.warning(f"Failed to store episode embeddings: {e}")
+                stored_embeddings = {}
 
         logger.info(f"✅ Successfully indexed {indexed_count}/{len(episodes)} episodes")
+        logger.info(f"Embedding cache stats: {get_embedding_cache().get_stats()}")
         return {
             "status": "success",
             "indexed_count": indexed_count,
+            "stored_embedding_count": len(stored_embeddings),
             "total_episodes": len(episodes),
         }
 
@@ -702,7 +965,7 @@ def calculate_age_months(birth_date: datetime) -> int:
     return max(0, months)  # Ensure non-negative
 
 
-def generate_video_thumbnail_if_needed(media_uri: str) -> Optional[str]:
+def generate_video_thumbnail_if_needed(media_uri: str) -> Optional[Dict[str, Any]]:
     """
     動画ファイルのサムネイルが存在しない場合は生成する
     
@@ -710,11 +973,13 @@ def generate_video_thumbnail_if_needed(media_uri: str) -> Optional[str]:
         media_uri: 動画ファイルのURI（gs://またはhttps://）
         
     Returns:
-        サムネイルのURL（生成済みまたは新規生成）、失敗時はNone
+        {"thumbnail_url": サムネイルのURL, "renditions": サイズ・フォーマット別のURL一覧,
+         "video_metadata": 動画のメタデータ}（生成済みまたは新規生成）、失敗時はNone
     """
     try:
         # video_thumbnailモジュールをインポート
-        from video_thumbnail import generate_video_thumbnail, get_thumbnail_path
+        from thumbnail_claim import ensure_video_thumbnail
+        from video_thumbnail import get_thumbnail_path
         
         # URIからバケット名とパスを抽出
         if media_uri.startswith('gs://'):
@@ -746,26 +1011,15 @@ def generate_video_thumbnail_if_needed(media_uri: str) -> Optional[str]:
         # サムネイルのパスを生成
         thumbnail_path = get_thumbnail_path(object_path)
         
-        # サムネイルが既に存在するか確認
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        thumbnail_blob = bucket.blob(thumbnail_path)
-        
-        if thumbnail_blob.exists():
-            logger.info(f"Thumbnail already exists: gs://{bucket_name}/{thumbnail_path}")
-            return f"gs://{bucket_name}/{thumbnail_path}"
-        
-        # サムネイルを生成（自動的に最適なフレームを選択）
-        logger.info(f"Generating thumbnail for: {media_uri}")
-        thumbnail_url = generate_video_thumbnail(
+        # 既存のサムネイルを再利用し、Storageトリガーと同時に実行された場合は
+        # どちらか一方だけが生成する
+        return ensure_video_thumbnail(
             video_url=media_uri,
             bucket_name=bucket_name,
-            output_path=thumbnail_path,
-            time_offset=None  # 自動選択モード
+            thumbnail_path=thumbnail_path,
+            caller="analysis",
         )
         
-        return thumbnail_url
-        
     except Exception as e:
         logger.error(f"Error in generate_video_thumbnail_if_needed: {str(e)}")
         return None
@@ -799,6 +1053,8 @@ def process_media_for_cloud_function(
     child_id: str = "",
     child_age_months: int = None,  # Auto-calculate if not provided
     captured_at: datetime = None,  # Media capture date/time
+    streaming: Optional[bool] = None,  # Defaults to PERSPECTIVE_STREAMING env
+    facts_result: Optional[Dict[str, Any]] = None,  # Precomputed objective_analyzer result
 ) -> Dict[str, Any]:
     """
     Cloud Functionsから呼び出せる関数
@@ -817,8 +1073,9 @@ def process_media_for_cloud_function(
         # Generate unique media ID
         media_id = str(uuid.uuid4())
 
-        # 1. 客観的事実を分析
-        facts_result = objective_analyzer(media_uri)
+        # 1. 客観的事実を分析（アップロードセッションでまとめて分析済みの場合は再利用）
+        if facts_result is None:
+            facts_result = objective_analyzer(media_uri)
         if facts_result.get("status") != "success":
             return facts_result
 
@@ -826,29 +1083,46 @@ def process_media_for_cloud_function(
         
         # 動画の場合はサムネイルを生成
         thumbnail_url = None
+        thumbnail_renditions = None
+        video_metadata = None
         if facts.get("media_type") == "video":
-            thumbnail_url = generate_video_thumbnail_if_needed(media_uri)
-            if thumbnail_url:
+            thumbnail = generate_video_thumbnail_if_needed(media_uri)
+            if thumbnail:
+                thumbnail_url = thumbnail["thumbnail_url"]
+                thumbnail_renditions = thumbnail["renditions"]
+                video_metadata = thumbnail.get("video_metadata") or None
                 logger.info(f"Generated video thumbnail: {thumbnail_url}")
 
-        # 2. 月齢に基づいて分析視点を決定
-        perspectives_result = perspective_determiner(facts, child_age_months)
-        if perspectives_result.get("status") != "success":
-            return perspectives_result
+        if streaming is None:
+            streaming = is_perspective_streaming_enabled()
+
+        # 2-3. ストリーミングモード: 視点が確定するたびに分析を開始
+        if streaming:
+            streaming_result = streaming_perspective_analysis(facts, child_age_months)
+            if streaming_result.get("status") != "success":
+                return streaming_result
+            perspectives_data = streaming_result.get("report", {})
+            episodes = perspectives_data.get("episodes", [])
+            perspectives = []
+        else:
+            # 2. 月齢に基づいて分析視点を決定
+            perspectives_result = perspective_determiner(facts, child_age_months)
+            if perspectives_result.get("status") != "success":
+                return perspectives_result
 
-        perspectives_data = perspectives_result.get("report", {})
-        perspectives = perspectives_data.get("perspectives", [])
+            perspectives_data = perspectives_result.get("report", {})
+            perspectives = perspectives_data.get("perspectives", [])
 
-        if not perspectives:
-            return {
-                "status": "error",
-                "error_message": "No perspectives determined for analysis",
-            }
+            if not perspectives:
+                return {
+                    "status": "error",
+                    "error_message": "No perspectives determined for analysis",
+                }
 
-        logger.info(f"Determined {len(perspectives)} perspectives for analysis")
+            logger.info(f"Determined {len(perspectives)} perspectives for analysis")
+            episodes = []
 
         # 3. 各視点から並行して分析を実行
-        episodes = []
         for perspective in perspectives:
             analysis_result = dynamic_multi_analyzer(facts, perspective)
 
@@ -878,6 +1152,8 @@ def process_media_for_cloud_function(
             user_id=user_id,
             captured_at=captured_at,
             thumbnail_url=thumbnail_url,  # サムネイルURLを追加
+            thumbnail_renditions=thumbnail_renditions,
+            video_metadata=video_metadata,
         )
 
         if save_result.get("status") != "success":
@@ -892,7 +1168,7 @@ def process_media_for_cloud_function(
         )
 
         # Return comprehensive result
-        return {
+        result = {
             "status": "success",
             "media_id": media_id,
             "emotional_title": save_result.get("emotional_title", ""),
@@ -902,10 +1178,52 @@ def process_media_for_cloud_function(
             "perspectives": [ep["type"] for ep in episodes],
             "analysis_note": perspectives_data.get("analysis_note", ""),
         }
+        if video_metadata:
+            result["video_metadata"] = video_metadata
+        if hedging.is_hedging_enabled():
+            result["hedge_stats"] = hedging.get_hedged_caller().get_stats()
+            logger.info(f"Gemini hedge stats: {result['hedge_stats']}")
+        return result
 
     except Exception as e:
         logger.error(f"Error processing media: {str(e)}")
         return {"status": "error", "error_message": str(e)}
 
 
+def process_media_session_for_cloud_function(
+    uploads: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """
+    同じアップロードセッション（同一user_id/child_idの短時間内の写真）をまとめて処理する
+    客観的事実の抽出は複数画像を1回のGemini呼び出しで行い、
+    以降は各メディアごとに通常のパイプラインを実行する
+
+    Args:
+        uploads: process_media_for_cloud_functionの引数（media_uri, user_id, child_id,
+            child_age_months, captured_at）を持つ辞書のリスト
+
+    Returns:
+        uploadsと同じ順序の処理結果リスト
+    """
+    facts_results: List[Dict[str, Any]] = []
+    for i in range(0, len(uploads), MAX_SESSION_IMAGES):
+        chunk = uploads[i:i + MAX_SESSION_IMAGES]
+        batch_result = batch_objective_analyzer([u["media_uri"] for u in chunk])
+        facts_results.extend(batch_result.get("report", []))
+
+    results = []
+    for upload, facts_result in zip(uploads, facts_results):
+        results.append(
+            process_media_for_cloud_function(
+                media_uri=upload["media_uri"],
+                user_id=upload.get("user_id", ""),
+                child_id=upload.get("child_id", ""),
+                child_age_months=upload.get("child_age_months"),
+                captured_at=upload.get("captured_at"),
+                facts_result=facts_result,
+            )
+        )
+    return results
+
+
 # Cloud Functions では ADK Agent は使用しない
@@ -0,0 +1,251 @@
+"""
+Text embedding cache
+
+(モデル名, 正規化した文) をキーに TextEmbeddingModel.get_embeddings の結果を再利用する
+（media_processing_agent と content_generator に同じファイルを置く。片方だけを変更すると
+content_generator/tests/test_shared_modules.py が失敗する）
+エピソードのタグ（「水遊びに夢中」など）やテーマのクエリは同じ文が繰り返し現れ、
+バックフィルでは全件を埋め込み直すため、同じ文は1度だけ計算する
+
+- メモリ上のLRU（件数上限あり、float32のバイト列で保持）
+- 任意の永続層（Firestore または ローカルディスク）。埋め込みは同じモデルなら変わらないためTTLは設けない
+- どちらにもない文だけをまとめて1回のリクエストで計算する（1リクエストの上限を超える分は分割）
+
+文はNFKC正規化（全角英数字・全角スペースを半角に）し、連続する空白を1つにまとめて前後を除いたものを
+キーにし、モデルにも正規化後の文を渡す（表記ゆれで同じ文の埋め込みが変わらないようにする）
+
+環境変数:
+    EMBEDDING_CACHE_BACKEND: 永続層（"firestore" / "disk"、未設定ならメモリのみ）
+    EMBEDDING_CACHE_DIR: diskバックエンドの保存先
+    EMBEDDING_CACHE_MAX_ENTRIES: メモリLRUの最大件数
+    EMBEDDING_COST_PER_1K_CHARS: 節約額の見積もりに使う1,000文字あたりの料金（USD）
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from google.cloud import firestore
+
+logger = logging.getLogger(__name__)
+
+CACHE_COLLECTION = "embedding_cache"
+# text-embedding-004 の1リクエストあたりの最大件数
+MAX_TEXTS_PER_REQUEST = 250
+# Firestoreの1回の読み書きの件数
+FIRESTORE_BATCH_SIZE = 500
+# text-embedding-004 のオンライン推論の入力料金（1,000文字あたり）
+DEFAULT_COST_PER_1K_CHARS = "0.000025"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """キャッシュキーとモデルへの入力に使う正規化した文"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def make_cache_key(model_name: str, normalized_text: str) -> str:
+    """(モデル, 正規化した文) からキャッシュキーを生成"""
+    return hashlib.sha256(f"{model_name}\n{normalized_text}".encode("utf-8")).hexdigest()
+
+
+def _to_bytes(values) -> bytes:
+    return array("f", values).tobytes()
+
+
+def _from_bytes(data: bytes) -> List[float]:
+    values = array("f")
+    values.frombytes(data)
+    return values.tolist()
+
+
+class EmbeddingCache:
+    """メモリLRU + 任意の永続層からなる埋め込みキャッシュ"""
+
+    def __init__(
+        self,
+        max_entries: int = 4096,
+        backend: Optional[str] = None,
+        cache_dir: str = "/tmp/embedding_cache",
+        cost_per_1k_chars: float = float(DEFAULT_COST_PER_1K_CHARS),
+    ):
+        self.max_entries = max_entries
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.cost_per_1k_chars = cost_per_1k_chars
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._firestore_client = None
+        self.stats = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "requests": 0,
+            "embedded_chars": 0,
+            "saved_chars": 0,
+        }
+
+    # ---------- 公開API ----------
+
+    def get_embeddings(
+        self,
+        model_name: str,
+        texts: List[str],
+        embed_fn: Callable[[List[str]], List[List[float]]],
+    ) -> List[List[float]]:
+        """
+        文のリストの埋め込みを取得する
+
+        メモリ・永続層にない文だけを重複を除いてまとめ、embed_fnを1回（上限を超える場合は分割）呼ぶ
+
+        Args:
+            model_name: 埋め込みモデル名（キーの一部）
+            texts: 埋め込む文のリスト
+            embed_fn: 正規化した文のリストから埋め込みのリストを返す関数
+
+        Returns:
+            textsと同じ順の埋め込み（float32に丸めた値）
+        """
+        normalized = [normalize_text(text) for text in texts]
+        keys = {text: make_cache_key(model_name, text) for text in normalized}
+        found: Dict[str, bytes] = {}
+
+        with self._lock:
+            for text, key in keys.items():
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[text] = self._memory[key]
+            memory_hits = len(found)
+
+        pending = [text for text in keys if text not in found]
+        persistent = self._persistent_get_many([keys[text] for text in pending]) if self.backend and pending else {}
+        for text in pending:
+            data = persistent.get(keys[text])
+            if data is not None:
+                found[text] = data
+                self._memory_put(keys[text], data)
+
+        missing = [text for text in keys if text not in found]
+        computed = {}
+        if missing:
+            for start in range(0, len(missing), MAX_TEXTS_PER_REQUEST):
+                chunk = missing[start:start + MAX_TEXTS_PER_REQUEST]
+                vectors = embed_fn(chunk)
+                if len(vectors) != len(chunk):
+                    raise ValueError(f"Expected {len(chunk)} embeddings, got {len(vectors)}")
+                for text, values in zip(chunk, vectors):
+                    computed[keys[text]] = found[text] = _to_bytes(values)
+                    self._memory_put(keys[text], found[text])
+            if self.backend:
+                self._persistent_put_many(computed)
+
+        # 重複した文は2回目以降をメモリのヒットとして数える（リクエストに含めずに済んだため）
+        duplicate_count = len(normalized) - len(keys)
+        saved_chars = sum(len(text) for text in normalized) - sum(len(text) for text in missing)
+        with self._lock:
+            self.stats["memory_hits"] += memory_hits + duplicate_count
+            self.stats["persistent_hits"] += len(keys) - memory_hits - len(missing)
+            self.stats["misses"] += len(missing)
+            self.stats["requests"] += -(-len(missing) // MAX_TEXTS_PER_REQUEST)
+            self.stats["embedded_chars"] += sum(len(text) for text in missing)
+            self.stats["saved_chars"] += saved_chars
+
+        return [_from_bytes(found[text]) for text in normalized]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            (stats["memory_hits"] + stats["persistent_hits"]) / lookups if lookups else 0.0
+        )
+        stats["cost_saved_usd"] = stats["saved_chars"] / 1000 * self.cost_per_1k_chars
+        return stats
+
+    # ---------- メモリ層 ----------
+
+    def _memory_put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    # ---------- 永続層 ----------
+
+    def _get_firestore_client(self):
+        if self._firestore_client is None:
+            self._firestore_client = firestore.Client(
+                project=os.getenv("GOOGLE_CLOUD_PROJECT", "hackason-464007")
+            )
+        return self._firestore_client
+
+    def _persistent_get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        found = {}
+        try:
+            if self.backend == "firestore":
+                client = self._get_firestore_client()
+                collection = client.collection(CACHE_COLLECTION)
+                for start in range(0, len(keys), FIRESTORE_BATCH_SIZE):
+                    refs = [collection.document(key) for key in keys[start:start + FIRESTORE_BATCH_SIZE]]
+                    for doc in client.get_all(refs, field_paths=["data"]):
+                        data = (doc.to_dict() or {}).get("data") if doc.exists else None
+                        if data:
+                            found[doc.id] = bytes(data)
+            elif self.backend == "disk":
+                for key in keys:
+                    path = os.path.join(self.cache_dir, f"{key}.f32")
+                    if os.path.exists(path):
+                        with open(path, "rb") as f:
+                            found[key] = f.read()
+        except Exception as e:
+            logger.warning(f"Embedding cache read failed ({self.backend}): {e}")
+        return found
+
+    def _persistent_put_many(self, entries: Dict[str, bytes]) -> None:
+        try:
+            if self.backend == "firestore":
+                client = self._get_firestore_client()
+                collection = client.collection(CACHE_COLLECTION)
+                items = list(entries.items())
+                for start in range(0, len(items), FIRESTORE_BATCH_SIZE):
+                    batch = client.batch()
+                    for key, data in items[start:start + FIRESTORE_BATCH_SIZE]:
+                        batch.set(collection.document(key), {"data": data, "created_at": firestore.SERVER_TIMESTAMP})
+                    batch.commit()
+            elif self.backend == "disk":
+                os.makedirs(self.cache_dir, exist_ok=True)
+                for key, data in entries.items():
+                    path = os.path.join(self.cache_dir, f"{key}.f32")
+                    tmp_path = f"{path}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Embedding cache write failed ({self.backend}): {e}")
+
+
+_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """プロセス内で共有するキャッシュを取得（遅延初期化）"""
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache(
+            max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "4096")),
+            backend=os.getenv("EMBEDDING_CACHE_BACKEND") or None,
+            cache_dir=os.getenv("EMBEDDING_CACHE_DIR", "/tmp/embedding_cache"),
+            cost_per_1k_chars=float(os.getenv("EMBEDDING_COST_PER_1K_CHARS", DEFAULT_COST_PER_1K_CHARS)),
+        )
+    return _cache
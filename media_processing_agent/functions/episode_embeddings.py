@@ -0,0 +1,62 @@
+"""
+Compact episode embeddings stored on analysis_results
+
+index_episodes で計算したエピソードの埋め込みを、Vector Searchへの登録とは別に
+analysis_results の episode_embeddings（エピソードIDごと）へ小さく保存する
+ノートブック生成（content_generator）はこれを読み込み、テーマとの類似度を
+リモート呼び出しなしで1回の行列積で計算する
+
+保存形式（{"dtype", "data", "scale"}、data はFirestoreのバイト列）:
+    int8: L2正規化した値を scale（最大絶対値/127）で量子化（768次元で768バイト）
+    float16: L2正規化した値をそのまま半精度で保存（768次元で1,536バイト）
+
+環境変数:
+    EPISODE_EMBEDDING_DTYPE: 保存形式（int8 / float16 / none、既定はint8、noneで保存しない）
+"""
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+SUPPORTED_DTYPES = ("int8", "float16")
+
+
+def get_embedding_dtype() -> Optional[str]:
+    """埋め込みの保存形式（保存しない場合はNone）"""
+    dtype = os.getenv("EPISODE_EMBEDDING_DTYPE", "int8").lower()
+    return dtype if dtype in SUPPORTED_DTYPES else None
+
+
+def encode_embedding(values: List[float], dtype: str = "int8") -> Dict[str, Any]:
+    """
+    埋め込みをL2正規化して小さい形式に変換する
+
+    Args:
+        values: 埋め込みベクトル
+        dtype: "int8" または "float16"
+
+    Returns:
+        {"dtype", "data"（バイト列）, "scale"（int8の場合、復元時に掛ける値）}
+    """
+    vector = np.asarray(values, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    if norm > 0:
+        vector = vector / norm
+
+    if dtype == "float16":
+        return {"dtype": "float16", "data": vector.astype("<f2").tobytes()}
+    if dtype == "int8":
+        peak = float(np.abs(vector).max()) if vector.size else 0.0
+        scale = peak / 127 if peak > 0 else 1.0
+        quantized = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return {"dtype": "int8", "data": quantized.tobytes(), "scale": scale}
+    raise ValueError(f"Unsupported embedding dtype: {dtype}")
+
+
+def decode_embedding(stored: Dict[str, Any]) -> np.ndarray:
+    """encode_embeddingで保存した埋め込みをfloat32に戻す"""
+    if stored["dtype"] == "float16":
+        return np.frombuffer(stored["data"], dtype="<f2").astype(np.float32)
+    if stored["dtype"] == "int8":
+        return np.frombuffer(stored["data"], dtype=np.int8).astype(np.float32) * np.float32(stored["scale"])
+    raise ValueError(f"Unsupported embedding dtype: {stored['dtype']}")
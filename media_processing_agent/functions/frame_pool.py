@@ -0,0 +1,299 @@
+"""
+Process-pool execution for CPU-bound candidate frame work
+
+候補フレームのデコード（grab/retrieve）と品質評価（cvtColor・ラプラシアン・顔検出）はCPU処理のため、
+スレッドでは並列化されない。vCPUが複数ある場合は、候補位置を時刻順に分割してプロセスプールで
+デコード・評価し、フレームは共有メモリに直接書き込んで親プロセスへは結果（位置・スコア）だけを返す
+親プロセスは共有メモリ上のフレームを参照し、採用した1枚だけをコピーする
+
+CPU数はホストではなくcgroupのクォータ（Cloud Functionsの割り当て）から決め、spawnしたワーカーが
+それぞれcv2・numpyを読み込むため、空きメモリで起動できる数も上限にする
+
+環境変数:
+    FRAME_POOL_WORKERS: ワーカープロセス数（既定はcgroupのCPUクォータ、読めない場合は1。1以下で無効化）
+    FRAME_POOL_WORKER_MEMORY_MB: ワーカー1プロセスあたりに見込むメモリ（MB、既定は400）
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from frame_scorer import get_frame_scorer
+
+logger = logging.getLogger(__name__)
+
+# spawnしたワーカーがcv2・numpyを読み込み、フレームをデコードするのに見込むメモリ
+DEFAULT_WORKER_MEMORY_MB = 400
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _read_cgroup_file(*paths: str) -> Optional[str]:
+    """最初に読めたcgroupファイルの内容（どれも読めない場合はNone）"""
+    for path in paths:
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except OSError:
+            continue
+    return None
+
+
+def get_cpu_quota() -> Optional[int]:
+    """
+    cgroupのCPUクォータ（vCPU数、切り捨てで最低1）
+
+    os.sched_getaffinity や os.cpu_count はホストのCPU数を返すため、Cloud Functionsの割り当て
+    （1 vCPUなど）はcgroupから読む。クォータが読めない・無制限の場合はNone
+    """
+    raw = _read_cgroup_file("/sys/fs/cgroup/cpu.max")
+    if raw:
+        quota, _, period = raw.partition(" ")
+    else:
+        quota = _read_cgroup_file("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") or "max"
+        period = _read_cgroup_file("/sys/fs/cgroup/cpu/cpu.cfs_period_us") or "100000"
+    if quota in ("max", "-1"):
+        return None
+    try:
+        return max(1, int(quota) // int(period or "100000"))
+    except ValueError:
+        return None
+
+
+def get_available_memory() -> Optional[int]:
+    """cgroupのメモリ上限から使用量を引いた残り（バイト、上限がない場合は物理メモリの空き）"""
+    limit = _read_cgroup_file("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    usage = _read_cgroup_file("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory/memory.usage_in_bytes")
+    try:
+        # cgroup v1 の無制限は非常に大きな値になる
+        if limit and limit != "max" and int(limit) < 1 << 60:
+            return max(0, int(limit) - int(usage or 0))
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def get_worker_memory() -> int:
+    """ワーカー1プロセスあたりに見込むメモリ（バイト）"""
+    return int(os.getenv("FRAME_POOL_WORKER_MEMORY_MB", str(DEFAULT_WORKER_MEMORY_MB))) * 2**20
+
+
+def get_pool_workers() -> int:
+    """
+    ワーカープロセス数
+
+    FRAME_POOL_WORKERS が指定されていればその値、未指定の場合はcgroupのCPUクォータ
+    （読めない場合は1で、プロセスプールを使わずにプロセス内で評価する）
+    いずれの場合も、空きメモリで起動できる数（get_worker_memory()ずつ）を上限にする
+    """
+    configured = os.getenv("FRAME_POOL_WORKERS")
+    workers = int(configured) if configured else (get_cpu_quota() or 1)
+    if workers <= 1:
+        return workers
+
+    available = get_available_memory()
+    if available is not None:
+        memory_workers = available // get_worker_memory()
+        if memory_workers < workers:
+            logger.info(
+                f"Frame pool limited to {memory_workers} workers by available memory "
+                f"({available / 2**20:.0f} MB, requested {workers})"
+            )
+            workers = int(memory_workers)
+    return workers
+
+
+def _init_worker() -> None:
+    # ワーカー間でCPUを取り合わないよう、OpenCV内部のスレッドは使わない
+    cv2.setNumThreads(1)
+
+
+def get_frame_pool(workers: Optional[int] = None) -> Optional[ProcessPoolExecutor]:
+    """
+    プロセス内で共有するプロセスプールを取得（ワーカー数が1以下の場合はNone）
+
+    gRPCなどのスレッドを持つ親プロセスをforkしないよう、spawnで起動する
+    起動したワーカーはインスタンスが再利用される間は使い回す
+    """
+    global _pool, _pool_workers
+    workers = get_pool_workers() if workers is None else workers
+    if workers <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+            _pool_workers = workers
+    return _pool
+
+
+def reset_frame_pool() -> None:
+    """プロセスプールを停止する（ワーカーが異常終了した場合は次回作り直す）"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _pool_workers = 0
+
+
+def _warm_up_worker(_: int) -> int:
+    import video_thumbnail  # noqa: F401
+    from frame_scorer import get_face_cascade
+    get_face_cascade()
+    return os.getpid()
+
+
+def warm_up_frame_pool(workers: Optional[int] = None) -> int:
+    """
+    ワーカーを起動してモジュールのインポートと顔検出モデルの読み込みを済ませる
+
+    Returns:
+        起動したワーカープロセス数（プールを使わない場合は0）
+    """
+    pool = get_frame_pool(workers)
+    if pool is None:
+        return 0
+    return len(set(pool.map(_warm_up_worker, range(_pool_workers * 2))))
+
+
+def _decode_and_score_worker(
+    video_path: str,
+    shm_name: str,
+    shape: Tuple[int, int, int],
+    slots: List[Tuple[int, float]],
+    max_grab_distance: Optional[int],
+) -> List[Tuple[int, Dict[str, Any], float]]:
+    """
+    ワーカープロセス: 担当する候補位置のフレームを共有メモリのスロットにデコードして評価する
+
+    Args:
+        slots: (スロット番号, タイムスタンプ) のリスト（時刻順）
+
+    Returns:
+        (スロット番号, メタデータ, スコア) のリスト（取得できなかった位置は含まない）
+    """
+    # video_thumbnailはこのモジュールをインポートするため、ワーカー内で遅延インポートする
+    from video_thumbnail import FrameSampler
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    first_slot = slots[0][0]
+    frames = np.ndarray((len(slots),) + shape, dtype=np.uint8, buffer=shm.buf[shm_offset(first_slot, shape):])
+    try:
+        written = []
+        with FrameSampler(video_path) as sampler:
+            # 1位置ずつ取得する（samplerは読み取り位置を保持するため、時刻順なら前方へ読み進める）
+            for slot, ts in slots:
+                sampled = sampler.sample([ts], max_grab_distance)
+                if not sampled:
+                    continue
+                frame, metadata = sampled[0]
+                if frame.shape != shape:
+                    raise ValueError(f"Unexpected frame shape {frame.shape}, expected {shape}")
+                frames[slot - first_slot] = frame
+                written.append((slot, metadata))
+
+        scores = get_frame_scorer().score_batch([frames[slot - first_slot] for slot, _ in written])
+        return [(slot, metadata, score) for (slot, metadata), score in zip(written, scores)]
+    finally:
+        # 共有メモリを参照する配列を解放してから閉じる
+        del frames
+        shm.close()
+
+
+def shm_offset(slot: int, shape: Tuple[int, int, int]) -> int:
+    """共有メモリ上のスロットの先頭位置（バイト）"""
+    return slot * shape[0] * shape[1] * shape[2]
+
+
+def select_best_frame(
+    sampler,
+    timestamps: List[float],
+    max_grab_distance: Optional[int] = None,
+    workers: Optional[int] = None,
+) -> Tuple[Optional[np.ndarray], List[Tuple[Dict[str, Any], float]]]:
+    """
+    候補位置のフレームをデコード・評価し、スコアが最も高いフレームを選ぶ
+
+    ワーカーが2以上かつ候補が2つ以上の場合はプロセスプールで並列に処理し、
+    それ以外（またはプールで失敗した場合）は開いているsamplerでそのまま処理する
+
+    Args:
+        sampler: 開いているFrameSampler
+        timestamps: 候補タイムスタンプ（秒）
+        max_grab_distance: シークせずに読み進める最大フレーム数
+        workers: ワーカー数（Noneの場合はFRAME_POOL_WORKERS）
+
+    Returns:
+        (最もスコアの高いフレーム（BGR形式、取得できなかった場合はNone),
+         [(メタデータ, スコア), ...]（時刻順、取得できなかった位置は含まない）)
+    """
+    width, height = sampler.info.get('width', 0), sampler.info.get('height', 0)
+    pool = get_frame_pool(workers) if len(timestamps) > 1 and width > 0 and height > 0 else None
+    if pool is not None:
+        try:
+            return _select_best_frame_parallel(pool, sampler.video_path, (height, width, 3), timestamps, max_grab_distance)
+        except Exception as e:
+            logger.warning(f"Parallel frame scoring failed, falling back to in-process: {e}")
+            if isinstance(e, BrokenProcessPool):
+                reset_frame_pool()
+
+    candidates = sampler.sample(timestamps, max_grab_distance)
+    scores = get_frame_scorer().score_batch([frame for frame, _ in candidates])
+    scored = [(metadata, score) for (_, metadata), score in zip(candidates, scores)]
+    if not candidates:
+        return None, scored
+    best = int(np.argmax(scores))
+    return candidates[best][0], scored
+
+
+def _select_best_frame_parallel(
+    pool: ProcessPoolExecutor,
+    video_path: str,
+    shape: Tuple[int, int, int],
+    timestamps: List[float],
+    max_grab_distance: Optional[int],
+) -> Tuple[Optional[np.ndarray], List[Tuple[Dict[str, Any], float]]]:
+    ordered = sorted(timestamps)
+    chunks = [
+        [(int(slot), ordered[int(slot)]) for slot in chunk]
+        for chunk in np.array_split(np.arange(len(ordered)), min(_pool_workers, len(ordered)))
+        if len(chunk) > 0
+    ]
+
+    shm = shared_memory.SharedMemory(create=True, size=shm_offset(len(ordered), shape))
+    try:
+        futures = [
+            pool.submit(_decode_and_score_worker, video_path, shm.name, shape, chunk, max_grab_distance)
+            for chunk in chunks
+        ]
+        results = sorted(
+            (item for future in futures for item in future.result()),
+            key=lambda item: item[0],
+        )
+        if not results:
+            return None, []
+
+        best_slot = max(results, key=lambda item: item[2])[0]
+        # 共有メモリは解放するため、採用したフレームだけをコピーする
+        best_frame = np.ndarray(
+            shape, dtype=np.uint8, buffer=shm.buf[shm_offset(best_slot, shape):shm_offset(best_slot + 1, shape)]
+        ).copy()
+        return best_frame, [(metadata, score) for _, metadata, score in results]
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,176 @@
+"""
+Frame quality scoring for video frames and still images
+"""
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# スコアの重み（calculate_frame_qualityと同じ配分）
+BRIGHTNESS_WEIGHT = 0.3
+CONTRAST_WEIGHT = 0.3
+SHARPNESS_WEIGHT = 0.2
+FACE_BONUS = 0.2
+# シャープネスを計算する行の帯の高さ（4Kでも作業用の配列が数MBに収まる）
+SHARPNESS_BAND_ROWS = 256
+
+_face_cascade = None
+_face_cascade_lock = threading.Lock()
+
+
+def get_face_cascade() -> cv2.CascadeClassifier:
+    """顔検出用のCascadeClassifierをプロセスで1度だけ読み込む"""
+    global _face_cascade
+    if _face_cascade is None:
+        with _face_cascade_lock:
+            if _face_cascade is None:
+                _face_cascade = cv2.CascadeClassifier(
+                    cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+                )
+    return _face_cascade
+
+
+def laplacian_variance(gray: np.ndarray, band_rows: int = SHARPNESS_BAND_ROWS) -> float:
+    """
+    3x3ラプラシアン（cv2.Laplacianの既定カーネルと同じ、端の1画素は除く）の分散
+
+    フル解像度のfloat配列を作らないよう、band_rows行ずつの帯で和と二乗和を集計する
+    """
+    height, width = gray.shape[:2]
+    if height < 3 or width < 3:
+        return 0.0
+    total = 0.0
+    total_squares = 0.0
+    for top in range(1, height - 1, band_rows):
+        bottom = min(top + band_rows, height - 1)
+        band = gray[top - 1:bottom + 1].astype(np.float32)
+        laplacian = (
+            band[:-2, 1:-1] + band[2:, 1:-1]
+            + band[1:-1, :-2] + band[1:-1, 2:]
+            - 4 * band[1:-1, 1:-1]
+        ).astype(np.float64)
+        total += float(laplacian.sum())
+        total_squares += float(np.square(laplacian).sum())
+    count = (height - 2) * (width - 2)
+    mean = total / count
+    return max(0.0, total_squares / count - mean * mean)
+
+
+class FrameScorer:
+    """
+    フレームの品質スコア（0.0〜1.0）を計算する
+
+    明るさ・コントラスト・顔検出は縮小したグレースケール画像で評価し、
+    同じサイズのフレームはまとめてNumPyで一括計算する
+    シャープネス（ラプラシアンの分散）は縮小するとブレやノイズの見え方が変わり
+    従来のスコアと比較できなくなるため、既定では元の解像度で計算する
+    （フレームごとに行の帯に分けて計算し、バッチ全体のフル解像度の配列は作らない）
+    """
+
+    def __init__(self, analysis_width: int = 640, sharpness_width: Optional[int] = None):
+        """
+        Args:
+            analysis_width: 明るさ・コントラスト・顔検出に使う画像の最大幅
+            sharpness_width: シャープネス計算に使う画像の最大幅（Noneの場合は元の解像度）
+        """
+        self.analysis_width = analysis_width
+        self.sharpness_width = sharpness_width
+
+    @staticmethod
+    def to_gray(frame: np.ndarray, is_rgb: bool = False, max_width: Optional[int] = None) -> np.ndarray:
+        """フレームをグレースケールに変換し、max_widthより大きければ縮小する"""
+        if frame.ndim == 3:
+            gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY if is_rgb else cv2.COLOR_BGR2GRAY)
+        else:
+            gray = frame
+        height, width = gray.shape[:2]
+        if max_width and width > max_width:
+            scale = max_width / width
+            gray = cv2.resize(gray, (max_width, max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        return gray
+
+    @staticmethod
+    def _stack_by_shape(images: List[np.ndarray]) -> List[Tuple[List[int], np.ndarray]]:
+        """同じサイズの画像ごとに (元のインデックス, float32のスタック) にまとめる"""
+        groups: Dict[tuple, List[int]] = {}
+        for i, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(i)
+        return [
+            (indices, np.stack([images[i] for i in indices]).astype(np.float32))
+            for indices in groups.values()
+        ]
+
+    def analyze_batch(self, frames: List[np.ndarray], is_rgb: bool = False) -> List[Dict[str, float]]:
+        """
+        複数フレームの品質指標をまとめて計算する
+
+        Args:
+            frames: フレームのリスト（BGR、is_rgb=TrueならRGB、またはグレースケール）
+            is_rgb: フレームがRGB順の場合True（PIL由来の静止画など）
+
+        Returns:
+            各フレームの指標（brightness, contrast, sharpness, faces, score）のリスト
+        """
+        results: List[Dict[str, float]] = [{} for _ in frames]
+        small_grays = []
+        for i, frame in enumerate(frames):
+            # フル解像度のグレースケールは1フレームずつ作り、シャープネスを計算したら破棄する
+            gray = self.to_gray(frame, is_rgb, self.sharpness_width)
+            results[i]['sharpness'] = laplacian_variance(gray)
+            small_grays.append(self.to_gray(gray, max_width=self.analysis_width))
+
+        for indices, stack in self._stack_by_shape(small_grays):
+            brightness = stack.mean(axis=(1, 2))
+            contrast = stack.std(axis=(1, 2))
+            for j, i in enumerate(indices):
+                results[i]['brightness'] = float(brightness[j])
+                results[i]['contrast'] = float(contrast[j])
+
+        cascade = get_face_cascade()
+        for i, gray in enumerate(small_grays):
+            faces = cascade.detectMultiScale(gray, 1.1, 4)
+            results[i]['faces'] = len(faces)
+            results[i]['score'] = self._combine(results[i])
+
+        return results
+
+    def score_batch(self, frames: List[np.ndarray], is_rgb: bool = False) -> List[float]:
+        """複数フレームの品質スコアを返す"""
+        return [metrics['score'] for metrics in self.analyze_batch(frames, is_rgb)]
+
+    def score(self, frame: np.ndarray, is_rgb: bool = False) -> float:
+        """1フレームの品質スコアを返す"""
+        return self.score_batch([frame], is_rgb)[0]
+
+    @staticmethod
+    def _combine(metrics: Dict[str, float]) -> float:
+        # 理想的な明るさは128前後
+        brightness_score = 1.0 - abs(metrics['brightness'] - 128) / 128
+        # コントラストは高い方が良い
+        contrast_score = min(metrics['contrast'] / 80, 1.0)
+        # シャープネススコア（経験的な値）
+        sharpness_score = min(metrics['sharpness'] / 1000, 1.0)
+
+        score = (
+            brightness_score * BRIGHTNESS_WEIGHT
+            + contrast_score * CONTRAST_WEIGHT
+            + sharpness_score * SHARPNESS_WEIGHT
+        )
+        if metrics['faces'] > 0:
+            score += FACE_BONUS
+        return min(score, 1.0)
+
+
+_frame_scorer = None
+
+
+def get_frame_scorer() -> FrameScorer:
+    """プロセス内で共有するFrameScorerを取得"""
+    global _frame_scorer
+    if _frame_scorer is None:
+        _frame_scorer = FrameScorer()
+    return _frame_scorer
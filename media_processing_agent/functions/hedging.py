@@ -0,0 +1,172 @@
+"""
+Hedged requests for Gemini calls
+
+呼び出し箇所ごとに学習したレイテンシのパーセンタイルを超えても応答がない場合、
+同じリクエストをもう1本発行し、先に返ってきた方を採用する（テールレイテンシ対策）
+追加で発行するリクエストはヘッジ予算（通常リクエストに対する割合）で上限を設ける
+予算はトークンバケットで、呼び出しごとに割合分のトークンが貯まり、最初から1本分（HEDGE_BURST）を持つ
+（呼び出し回数が少ないうちにも最初の遅い応答をヘッジできる）
+
+環境変数:
+    GEMINI_HEDGING: "true" で有効化
+    GEMINI_HEDGE_PERCENTILE: ヘッジを発行するレイテンシのパーセンタイル（既定 95）
+    GEMINI_HEDGE_BUDGET: 通常リクエストに対するヘッジの上限割合（既定 0.1）
+    GEMINI_HEDGE_INITIAL_DELAY_SEC: サンプル不足時のヘッジ待ち時間（既定 15）
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# パーセンタイルを学習するまでに必要なサンプル数
+MIN_SAMPLES = 20
+WINDOW_SIZE = 200
+# ヘッジ予算の初期トークン（呼び出し回数に関わらず発行できるヘッジの本数）
+HEDGE_BURST = 1
+
+
+def is_hedging_enabled() -> bool:
+    return os.getenv("GEMINI_HEDGING", "false").lower() in ("1", "true", "yes")
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies for one call site"""
+
+    def __init__(self, initial_delay_sec: float):
+        self.initial_delay_sec = initial_delay_sec
+        self._samples = deque(maxlen=WINDOW_SIZE)
+        self._lock = threading.Lock()
+
+    def record(self, latency_sec: float) -> None:
+        with self._lock:
+            self._samples.append(latency_sec)
+
+    def percentile(self, p: float) -> float:
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES:
+                return self.initial_delay_sec
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * p / 100))
+        return ordered[index]
+
+
+class HedgedCaller:
+    """Issue a duplicate call when the primary exceeds the learned latency percentile"""
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        budget_ratio: float = 0.1,
+        initial_delay_sec: float = 15.0,
+        max_workers: int = 16,
+    ):
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self.initial_delay_sec = initial_delay_sec
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._trackers: Dict[str, LatencyTracker] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _site(self, call_site: str):
+        with self._lock:
+            if call_site not in self._trackers:
+                self._trackers[call_site] = LatencyTracker(self.initial_delay_sec)
+                self._stats[call_site] = {"calls": 0, "hedges": 0, "hedge_wins": 0, "budget_denied": 0}
+            return self._trackers[call_site], self._stats[call_site]
+
+    def _try_spend_budget(self, stats: Dict[str, int]) -> bool:
+        """ヘッジ予算（floor(calls * budget_ratio) + HEDGE_BURST 本まで）から1本分を使う"""
+        with self._lock:
+            if stats["hedges"] + 1 > int(stats["calls"] * self.budget_ratio) + HEDGE_BURST:
+                stats["budget_denied"] += 1
+                return False
+            stats["hedges"] += 1
+            return True
+
+    def call(self, call_site: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        fnを実行し、必要に応じてヘッジリクエストを発行して最初の応答を返す
+
+        Args:
+            call_site: レイテンシ学習と統計の単位になる呼び出し箇所名
+            fn: 実行する関数（Gemini呼び出し）
+
+        Returns:
+            最初に成功した呼び出しの戻り値（両方失敗した場合は最初の例外を送出）
+        """
+        tracker, stats = self._site(call_site)
+        with self._lock:
+            stats["calls"] += 1
+
+        hedge_delay = tracker.percentile(self.percentile)
+        started = time.monotonic()
+        primary = self._executor.submit(fn, *args, **kwargs)
+
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done or not self._try_spend_budget(stats):
+            result = primary.result()
+            tracker.record(time.monotonic() - started)
+            return result
+
+        logger.info(f"Hedging {call_site}: no response after {hedge_delay:.1f}s")
+        hedge = self._executor.submit(fn, *args, **kwargs)
+        pending = {primary, hedge}
+        first_error = None
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    first_error = first_error or future.exception()
+                    continue
+
+                if future is hedge:
+                    with self._lock:
+                        stats["hedge_wins"] += 1
+                tracker.record(time.monotonic() - started)
+                # 負けた方はキャンセルを試みる（実行中のHTTP呼び出しは完了まで走るが結果は破棄）
+                for loser in pending:
+                    loser.cancel()
+                return future.result()
+
+        raise first_error
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """呼び出し箇所ごとのヘッジ率・勝率・現在のヘッジ閾値"""
+        with self._lock:
+            snapshot = {site: dict(stats) for site, stats in self._stats.items()}
+        for site, stats in snapshot.items():
+            stats["hedge_rate"] = stats["hedges"] / stats["calls"] if stats["calls"] else 0.0
+            stats["win_rate"] = stats["hedge_wins"] / stats["hedges"] if stats["hedges"] else 0.0
+            stats["hedge_delay_sec"] = self._trackers[site].percentile(self.percentile)
+        return snapshot
+
+
+_hedged_caller = None
+
+
+def get_hedged_caller() -> HedgedCaller:
+    """プロセス内で共有するHedgedCallerを取得（遅延初期化）"""
+    global _hedged_caller
+    if _hedged_caller is None:
+        _hedged_caller = HedgedCaller(
+            percentile=float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95")),
+            budget_ratio=float(os.getenv("GEMINI_HEDGE_BUDGET", "0.1")),
+            initial_delay_sec=float(os.getenv("GEMINI_HEDGE_INITIAL_DELAY_SEC", "15")),
+        )
+    return _hedged_caller
+
+
+def generate_content(call_site: str, model, contents) -> Any:
+    """
+    model.generate_contentを実行する（GEMINI_HEDGINGが有効な場合はヘッジ付き）
+    """
+    if not is_hedging_enabled():
+        return model.generate_content(contents)
+    return get_hedged_caller().call(call_site, model.generate_content, contents)
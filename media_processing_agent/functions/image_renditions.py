@@ -0,0 +1,230 @@
+"""
+Image renditions and placeholders for photo uploads
+
+写真のアップロード時に、EXIFの向きを適用してメタデータを除いた縮小版（JPEG / WebP）と
+読み込み中に表示する極小のプレースホルダー（data URI）を生成する
+結果は media_renditions コレクションに保存し、同じメディアの analysis_results にも反映する
+（動画のプレビューも同じコレクションに保存する）
+"""
+import base64
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.cloud import storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# iPhoneの写真（HEIC / HEIF）はPillow単体では開けないため、pillow-heifのオープナーを登録する
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    logger.warning("pillow-heif is not installed; HEIC/HEIF uploads will not get renditions")
+
+# 長辺の最大サイズ（px）
+IMAGE_RENDITION_SIZES = (320, 800, 1600)
+# フォーマット -> (拡張子, Content-Type, PILの保存オプション)
+IMAGE_RENDITION_FORMATS = {
+    'jpeg': ('jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('webp', 'image/webp', {'quality': 80, 'method': 4}),
+}
+# プレースホルダーの長辺（px）と画質
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+RENDITION_CACHE_CONTROL = 'public, max-age=86400'
+RENDITIONS_COLLECTION = 'media_renditions'
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.heic', '.heif']
+# 生成物の保存先（トリガーの再帰を避けるため処理対象から除外する）
+GENERATED_PREFIXES = ('thumbnails/', 'renditions/', 'previews/')
+
+
+def is_image_file(file_path: str) -> bool:
+    """ファイルパス（またはURL）から画像ファイルかどうかを判定"""
+    _, ext = os.path.splitext(file_path.split('?', 1)[0].lower())
+    return ext in IMAGE_EXTENSIONS
+
+
+def is_generated_path(file_path: str) -> bool:
+    """サムネイルやレンディションなど、このモジュールや動画処理が生成したパスか"""
+    return file_path.startswith(GENERATED_PREFIXES)
+
+
+def get_image_rendition_path(image_path: str, size: int, fmt: str) -> str:
+    """
+    画像パスからレンディションのパスを生成
+
+    例: user/child/2025-01/photo.jpg, 800, webp -> renditions/user/child/2025-01/photo_800.webp
+    """
+    base, _ = os.path.splitext(image_path)
+    extension = IMAGE_RENDITION_FORMATS[fmt][0]
+    return f"renditions/{base}_{size}.{extension}"
+
+
+def get_image_rendition_paths(image_path: str) -> List[str]:
+    """画像のすべてのサイズ・フォーマットのレンディションのパス"""
+    return [
+        get_image_rendition_path(image_path, size, fmt)
+        for size in IMAGE_RENDITION_SIZES
+        for fmt in IMAGE_RENDITION_FORMATS
+    ]
+
+
+def get_media_renditions_doc_id(media_uri: str) -> str:
+    """media_renditionsのドキュメントID（media_uriのハッシュ）"""
+    return hashlib.sha1(media_uri.encode('utf-8')).hexdigest()
+
+
+def render_image_renditions(
+    data: bytes,
+) -> Tuple[Dict[Tuple[int, str], Tuple[bytes, Tuple[int, int]]], str, Tuple[int, int]]:
+    """
+    画像から全サイズ・全フォーマットのレンディションとプレースホルダーを生成
+
+    EXIFの向きを適用したうえでRGBに変換し、EXIF・GPSなどのメタデータは書き出さない
+    大きいサイズから順に縮小し、小さいサイズは直前のサイズから縮小する
+
+    Args:
+        data: 元画像のバイト列
+
+    Returns:
+        ({(長辺, フォーマット): (エンコード済みバイト列, (幅, 高さ))}, プレースホルダーのdata URI, 元画像の(幅, 高さ))
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source).convert('RGB')
+    original_size = image.size
+
+    encoded = {}
+    for size in sorted(IMAGE_RENDITION_SIZES, reverse=True):
+        # 元画像より大きくは拡大しない
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for fmt, (_, _, save_options) in IMAGE_RENDITION_FORMATS.items():
+            buffer = io.BytesIO()
+            image.save(buffer, fmt.upper(), **save_options)
+            encoded[(size, fmt)] = (buffer.getvalue(), image.size)
+
+    image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=PLACEHOLDER_QUALITY)
+    placeholder = 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+    return encoded, placeholder, original_size
+
+
+def generate_image_renditions(bucket_name: str, image_path: str) -> Optional[Dict[str, Any]]:
+    """
+    アップロードされた写真のレンディションとプレースホルダーを生成してCloud Storageに保存
+
+    Args:
+        bucket_name: バケット名
+        image_path: 画像のオブジェクトパス
+
+    Returns:
+        {"media_uri", "renditions", "placeholder", "width", "height"}、失敗時はNone
+    """
+    try:
+        client = storage.Client()
+        bucket = client.bucket(bucket_name)
+        data = bucket.blob(image_path).download_as_bytes()
+
+        encoded, placeholder, (width, height) = render_image_renditions(data)
+
+        def upload(key: Tuple[int, str]) -> Dict[str, Any]:
+            size, fmt = key
+            body, (rendition_width, rendition_height) = encoded[key]
+            path = get_image_rendition_path(image_path, size, fmt)
+            blob = bucket.blob(path)
+            blob.cache_control = RENDITION_CACHE_CONTROL
+            blob.upload_from_string(body, content_type=IMAGE_RENDITION_FORMATS[fmt][1])
+            blob.make_public()  # 公開アクセスを許可
+            return {
+                "width": rendition_width,
+                "height": rendition_height,
+                "format": fmt,
+                "bytes": len(body),
+                "url": f"gs://{bucket_name}/{path}",
+            }
+
+        with ThreadPoolExecutor(max_workers=len(encoded)) as executor:
+            renditions: List[Dict[str, Any]] = list(executor.map(upload, sorted(encoded)))
+
+        logger.info(
+            f"Generated {len(renditions)} renditions for gs://{bucket_name}/{image_path} "
+            f"({len(data)}B original, {min(r['bytes'] for r in renditions)}B smallest)"
+        )
+        return {
+            "media_uri": f"gs://{bucket_name}/{image_path}",
+            "renditions": renditions,
+            "placeholder": placeholder,
+            "width": width,
+            "height": height,
+        }
+
+    except Exception as e:
+        logger.error(f"Error generating image renditions for {image_path}: {str(e)}")
+        return None
+
+
+def save_media_renditions(db, media_uri: str, fields: Dict[str, Any]) -> int:
+    """
+    レンディション情報をmedia_renditionsに保存し、既存のanalysis_resultsにも反映する
+
+    分析（Firestoreトリガー）とレンディション生成（Storageトリガー）はどちらが先に終わるか
+    決まっていないため、分析側は保存時にmedia_renditionsを参照し、こちらは既存の分析結果を更新する
+
+    Args:
+        db: Firestoreクライアント
+        media_uri: 元メディアのgs:// URL
+        fields: analysis_resultsに書き込むフィールド
+
+    Returns:
+        更新したanalysis_resultsの件数
+    """
+    db.collection(RENDITIONS_COLLECTION).document(
+        get_media_renditions_doc_id(media_uri)
+    ).set({"media_uri": media_uri, **fields}, merge=True)
+
+    updated = 0
+    for doc in db.collection("analysis_results").where("media_uri", "==", media_uri).stream():
+        doc.reference.update(fields)
+        updated += 1
+    return updated
+
+
+def save_image_renditions(db, result: Dict[str, Any]) -> int:
+    """
+    写真のレンディション情報を保存する（save_media_renditionsを参照）
+
+    Args:
+        db: Firestoreクライアント
+        result: generate_image_renditionsの戻り値
+
+    Returns:
+        更新したanalysis_resultsの件数
+    """
+    return save_media_renditions(db, result["media_uri"], {
+        "image_renditions": result["renditions"],
+        "image_placeholder": result["placeholder"],
+        "image_width": result["width"],
+        "image_height": result["height"],
+    })
+
+
+def get_saved_media_renditions(db, media_uri: str) -> Dict[str, Any]:
+    """media_renditionsに保存済みのレンディション情報（analysis_resultsに書き込むフィールド）"""
+    doc = db.collection(RENDITIONS_COLLECTION).document(get_media_renditions_doc_id(media_uri)).get()
+    if not doc.exists:
+        return {}
+    data = doc.to_dict()
+    data.pop("media_uri", None)
+    return data
+
+
+def delete_media_renditions(db, media_uri: str) -> None:
+    """元メディアの削除時に media_renditions のドキュメントを削除する"""
+    db.collection(RENDITIONS_COLLECTION).document(get_media_renditions_doc_id(media_uri)).delete()
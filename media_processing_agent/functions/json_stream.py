@@ -0,0 +1,106 @@
+"""
+Incremental JSON parsing for streamed Gemini responses
+"""
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingArrayParser:
+    """
+    ストリーミングで届くJSONテキストから、指定キーの配列要素（オブジェクト）を
+    閉じ括弧が届いた時点で1つずつ取り出すパーサー
+
+    例: '{"perspectives": [{"type": "a"}, {"type": "b"}], ...}' を
+    チャンク単位でfeedすると、各オブジェクトが閉じた時点で返される
+    """
+
+    def __init__(self, array_key: str):
+        self.array_key = array_key
+        self.buffer = ""
+        self.complete = False
+        self.parse_errors = 0
+        self._key_pattern = re.compile(rf'"{re.escape(array_key)}"\s*:\s*\[')
+        self._pos: Optional[int] = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        チャンクを追加し、新たに完成した配列要素を返す
+
+        Args:
+            chunk: ストリームから受け取ったテキスト
+
+        Returns:
+            このチャンクで完成したオブジェクトのリスト
+        """
+        self.buffer += chunk
+        items: List[Dict[str, Any]] = []
+
+        if self._pos is None:
+            match = self._key_pattern.search(self.buffer)
+            if not match:
+                return items
+            self._pos = match.end()
+
+        while self._pos < len(self.buffer) and not self.complete:
+            ch = self.buffer[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0 and ch == "{":
+                    self._item_start = self._pos
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:
+                    # 配列自体の閉じ括弧
+                    self.complete = True
+                else:
+                    self._depth -= 1
+                    if self._depth == 0 and self._item_start is not None:
+                        item_text = self.buffer[self._item_start:self._pos + 1]
+                        self._item_start = None
+                        try:
+                            items.append(json.loads(item_text))
+                        except json.JSONDecodeError as e:
+                            self.parse_errors += 1
+                            logger.warning(f"Failed to parse streamed item: {e}")
+
+            self._pos += 1
+
+        return items
+
+    def parse_document(self) -> Dict[str, Any]:
+        """
+        受信済みテキスト全体をJSONとしてパースする（配列以外のフィールド取得用）
+
+        Returns:
+            パースしたドキュメント、失敗時は空の辞書
+        """
+        text = self.buffer.strip()
+        json_match = re.search(r"```json\s*(.*?)\s*```", text, re.DOTALL)
+        if json_match:
+            text = json_match.group(1)
+        else:
+            json_match = re.search(r"\{.*\}", text, re.DOTALL)
+            if json_match:
+                text = json_match.group(0)
+
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return {}
@@ -2,16 +2,19 @@
 Cloud Function for Media Processing
 HTTPトリガーとFirestoreトリガーの両方に対応
 """
-from firebase_functions import https_fn
+from firebase_functions import https_fn, scheduler_fn
 from firebase_functions.firestore_fn import (
     on_document_created,
+    on_document_deleted,
     Event,
     DocumentSnapshot,
 )
-from firebase_admin import initialize_app, firestore
+from firebase_admin import initialize_app, firestore, auth
 import os
 import sys
 import json
+import time
+import uuid
 from datetime import datetime
 
 # Firebase Admin SDKの初期化
@@ -20,7 +23,10 @@ initialize_app()
 # 現在のディレクトリをパスに追加（agent.pyを使うため）
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from agent import process_media_for_cloud_function
+from agent import process_media_for_cloud_function, process_media_session_for_cloud_function
+from theme_labels import reindex_theme_labels
+from vector_gc import delete_episode_datapoints, reconcile_vector_store
+from vector_store import get_vector_store
 
 # video_upload_handlerの関数もインポート
 try:
@@ -32,6 +38,8 @@ except ImportError:
 
 # 環境変数
 PROJECT_ID = os.environ.get('GOOGLE_CLOUD_PROJECT', 'hackason-464007')
+# 同一ユーザー・子供の写真をまとめて分析する待ち時間（秒）。0で無効
+UPLOAD_SESSION_WINDOW_SEC = float(os.environ.get('UPLOAD_SESSION_WINDOW_SEC', '0'))
 
 
 @https_fn.on_request(timeout_sec=540, memory=2048)
@@ -86,14 +94,18 @@ def process_media_upload(req: https_fn.Request) -> https_fn.Response:
             
             # ドキュメントIDがある場合は処理完了を記録
             if doc_id:
-                db.collection('media_uploads').document(doc_id).update({
+                completed = {
                     'processing_status': 'completed',
                     'processed_at': firestore.SERVER_TIMESTAMP,
                     'media_id': media_id,
                     'emotional_title': emotional_title,
                     'episode_count': episode_count,
                     'updated_at': firestore.SERVER_TIMESTAMP
-                })
+                }
+                # 動画の場合は長さ・サイズ・向きなどのメタデータ
+                if result.get("video_metadata"):
+                    completed['video_metadata'] = result["video_metadata"]
+                db.collection('media_uploads').document(doc_id).update(completed)
             
             # 処理ログを記録
             db.collection('processing_logs').add({
@@ -200,6 +212,11 @@ def process_media_upload_firestore(event: Event[DocumentSnapshot]) -> None:
     # Firestoreクライアント
     db = firestore.client()
     
+    # 写真はアップロードセッション単位でまとめて分析
+    if UPLOAD_SESSION_WINDOW_SEC > 0 and doc_data.get("media_type", "image") == "image":
+        _process_upload_session(db, doc_id, doc_data)
+        return
+    
     try:
         # 処理ステータスを更新
         db.collection('media_uploads').document(doc_id).update({
@@ -213,72 +230,10 @@ def process_media_upload_firestore(event: Event[DocumentSnapshot]) -> None:
             user_id=user_id,
             child_id=child_id,
             child_age_months=child_age_months,
-            captured_at=datetime.fromtimestamp(captured_at.timestamp()) if captured_at and hasattr(captured_at, 'timestamp') else None  # Convert Firestore Timestamp to datetime
+            captured_at=_to_datetime(captured_at)
         )
         
-        if result.get("status") == "success":
-            media_id = result.get("media_id")
-            emotional_title = result.get("emotional_title", "")
-            episode_count = result.get("episode_count", 0)
-            indexed_count = result.get("indexed_count", 0)
-            perspectives = result.get("perspectives", [])
-            
-            # 処理完了を記録
-            db.collection('media_uploads').document(doc_id).update({
-                'processing_status': 'completed',
-                'processed_at': firestore.SERVER_TIMESTAMP,
-                'media_id': media_id,
-                'emotional_title': emotional_title,
-                'episode_count': episode_count,
-                'updated_at': firestore.SERVER_TIMESTAMP
-            })
-            
-            # 処理ログを記録
-            db.collection('processing_logs').add({
-                'media_upload_id': doc_id,
-                'media_id': media_id,
-                'event_type': 'media_analysis',
-                'status': 'success',
-                'timestamp': firestore.SERVER_TIMESTAMP,
-                'details': {
-                    'user_id': user_id,
-                    'child_id': child_id,
-                    'child_age_months': child_age_months,
-                    'media_uri': media_uri,
-                    'episode_count': episode_count,
-                    'indexed_count': indexed_count,
-                    'perspectives': perspectives
-                }
-            })
-            
-            print(f"Successfully processed. Media ID: {media_id}")
-            
-        else:
-            # エラーの場合
-            error_message = result.get("error_message", "Unknown error")
-            
-            # エラー状態を記録
-            db.collection('media_uploads').document(doc_id).update({
-                'processing_status': 'failed',
-                'processing_error': error_message,
-                'updated_at': firestore.SERVER_TIMESTAMP
-            })
-            
-            # エラーログを記録
-            db.collection('processing_logs').add({
-                'media_upload_id': doc_id,
-                'event_type': 'media_analysis',
-                'status': 'error',
-                'error': error_message,
-                'timestamp': firestore.SERVER_TIMESTAMP,
-                'details': {
-                    'user_id': user_id,
-                    'child_id': child_id,
-                    'media_uri': media_uri
-                }
-            })
-            
-            print(f"Processing failed: {error_message}")
+        _record_processing_result(db, doc_id, doc_data, result)
             
     except Exception as e:
         error_message = str(e)
@@ -295,6 +250,194 @@ def process_media_upload_firestore(event: Event[DocumentSnapshot]) -> None:
             pass
 
 
+def _to_datetime(captured_at):
+    """Firestore Timestampをdatetimeに変換"""
+    if captured_at and hasattr(captured_at, 'timestamp'):
+        return datetime.fromtimestamp(captured_at.timestamp())
+    return None
+
+
+def _record_processing_result(db, doc_id: str, doc_data: dict, result: dict) -> None:
+    """分析結果をmedia_uploadsとprocessing_logsに記録"""
+    user_id = doc_data.get("user_id", "")
+    child_id = doc_data.get("child_id", "")
+    media_uri = doc_data.get("media_uri", "")
+    
+    if result.get("status") == "success":
+        media_id = result.get("media_id")
+        emotional_title = result.get("emotional_title", "")
+        episode_count = result.get("episode_count", 0)
+        indexed_count = result.get("indexed_count", 0)
+        perspectives = result.get("perspectives", [])
+        
+        # 処理完了を記録
+        completed = {
+            'processing_status': 'completed',
+            'processed_at': firestore.SERVER_TIMESTAMP,
+            'media_id': media_id,
+            'emotional_title': emotional_title,
+            'episode_count': episode_count,
+            'updated_at': firestore.SERVER_TIMESTAMP
+        }
+        # 動画の場合は長さ・サイズ・向きなどのメタデータ
+        if result.get("video_metadata"):
+            completed['video_metadata'] = result["video_metadata"]
+        db.collection('media_uploads').document(doc_id).update(completed)
+        
+        # 処理ログを記録
+        db.collection('processing_logs').add({
+            'media_upload_id': doc_id,
+            'media_id': media_id,
+            'event_type': 'media_analysis',
+            'status': 'success',
+            'timestamp': firestore.SERVER_TIMESTAMP,
+            'details': {
+                'user_id': user_id,
+                'child_id': child_id,
+                'child_age_months': doc_data.get("child_age_months"),
+                'media_uri': media_uri,
+                'episode_count': episode_count,
+                'indexed_count': indexed_count,
+                'perspectives': perspectives,
+                'hedge_stats': result.get("hedge_stats")
+            }
+        })
+        
+        print(f"Successfully processed. Media ID: {media_id}")
+        
+    else:
+        # エラーの場合
+        error_message = result.get("error_message", "Unknown error")
+        
+        # エラー状態を記録
+        db.collection('media_uploads').document(doc_id).update({
+            'processing_status': 'failed',
+            'processing_error': error_message,
+            'updated_at': firestore.SERVER_TIMESTAMP
+        })
+        
+        # エラーログを記録
+        db.collection('processing_logs').add({
+            'media_upload_id': doc_id,
+            'event_type': 'media_analysis',
+            'status': 'error',
+            'error': error_message,
+            'timestamp': firestore.SERVER_TIMESTAMP,
+            'details': {
+                'user_id': user_id,
+                'child_id': child_id,
+                'media_uri': media_uri
+            }
+        })
+        
+        print(f"Processing failed: {error_message}")
+
+
+def _claim_upload_session(db, doc_id: str, doc_data: dict) -> list:
+    """
+    同一user_id/child_idで待機中の写真をまとめて確保する
+    
+    最初にトリガーされた関数がセッションのリーダーとなり、待ち時間の間に
+    アップロードされた写真をトランザクションで'processing'に更新して確保する。
+    自分のドキュメントが既に他のリーダーに確保されている場合は空リストを返す
+    
+    Returns:
+        確保した (doc_id, doc_data) のリスト
+    """
+    # 同じセッションの他の写真が届くのを待つ
+    time.sleep(UPLOAD_SESSION_WINDOW_SEC)
+    
+    uploads_ref = db.collection('media_uploads')
+    own_created_at = doc_data.get("created_at")
+    
+    candidates = uploads_ref \
+        .where('user_id', '==', doc_data.get("user_id", "")) \
+        .where('child_id', '==', doc_data.get("child_id", "")) \
+        .where('processing_status', '==', 'pending') \
+        .stream()
+    
+    candidate_refs = []
+    for snapshot in candidates:
+        data = snapshot.to_dict()
+        if data.get("media_type", "image") != "image" or not data.get("media_uri"):
+            continue
+        # リーダーのアップロード時刻の前後ウィンドウ内のものだけを対象にする
+        created_at = data.get("created_at")
+        if own_created_at and created_at and hasattr(created_at, 'timestamp'):
+            if abs(created_at.timestamp() - own_created_at.timestamp()) > UPLOAD_SESSION_WINDOW_SEC:
+                continue
+        candidate_refs.append(snapshot.reference)
+    
+    own_ref = uploads_ref.document(doc_id)
+    if own_ref.path not in [ref.path for ref in candidate_refs]:
+        candidate_refs.insert(0, own_ref)
+    
+    session_id = str(uuid.uuid4())
+    transaction = db.transaction()
+    
+    @firestore.transactional
+    def claim(transaction):
+        own_snapshot = own_ref.get(transaction=transaction)
+        if not own_snapshot.exists or own_snapshot.to_dict().get('processing_status') != 'pending':
+            return []
+        
+        snapshots = [ref.get(transaction=transaction) for ref in candidate_refs]
+        claimed = []
+        for snapshot in snapshots:
+            if snapshot.exists and snapshot.to_dict().get('processing_status') == 'pending':
+                transaction.update(snapshot.reference, {
+                    'processing_status': 'processing',
+                    'upload_session_id': session_id,
+                    'updated_at': firestore.SERVER_TIMESTAMP
+                })
+                claimed.append((snapshot.id, snapshot.to_dict()))
+        return claimed
+    
+    return claim(transaction)
+
+
+def _process_upload_session(db, doc_id: str, doc_data: dict) -> None:
+    """アップロードセッション単位で写真をまとめて分析"""
+    claimed = []
+    try:
+        claimed = _claim_upload_session(db, doc_id, doc_data)
+        if not claimed:
+            print(f"Document {doc_id} was claimed by another upload session, skipping")
+            return
+        
+        print(f"Processing upload session with {len(claimed)} photos (leader: {doc_id})")
+        
+        uploads = [
+            {
+                "media_uri": data.get("media_uri", ""),
+                "user_id": data.get("user_id", ""),
+                "child_id": data.get("child_id", ""),
+                "child_age_months": data.get("child_age_months"),
+                "captured_at": _to_datetime(data.get("captured_at")),
+            }
+            for _, data in claimed
+        ]
+        results = process_media_session_for_cloud_function(uploads)
+        
+        for (claimed_id, data), result in zip(claimed, results):
+            _record_processing_result(db, claimed_id, data, result)
+            
+    except Exception as e:
+        error_message = str(e)
+        print(f"Error processing upload session: {error_message}")
+        
+        # 確保したドキュメントをエラー状態にする
+        for claimed_id, _ in claimed or [(doc_id, doc_data)]:
+            try:
+                db.collection('media_uploads').document(claimed_id).update({
+                    'processing_status': 'failed',
+                    'processing_error': error_message,
+                    'updated_at': firestore.SERVER_TIMESTAMP
+                })
+            except:
+                pass
+
+
 @https_fn.on_request(timeout_sec=540, memory=2048)
 def generate_notebook_http(req: https_fn.Request) -> https_fn.Response:
     """HTTPトリガーでノートブック生成を実行"""
@@ -368,4 +511,65 @@ def generate_notebook_http(req: https_fn.Request) -> https_fn.Response:
             'status': 'error',
             'message': 'ノートブック生成中にエラーが発生しました',
             'error': str(e)
-        }, status=500)
\ No newline at end of file
+        }, status=500)
+
+
+def verify_admin_request(req: https_fn.Request):
+    """
+    管理者のFirebase IDトークン（カスタムクレーム admin: true）を持つリクエストか確認する
+
+    Returns:
+        拒否する場合はエラーのResponse、管理者の場合はNone
+    """
+    header = req.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return https_fn.Response({'error': 'Missing ID token'}, status=401)
+    try:
+        token = auth.verify_id_token(header[len('Bearer '):])
+    except Exception as e:
+        print(f"Rejected admin request: {str(e)}")
+        return https_fn.Response({'error': 'Invalid ID token'}, status=401)
+    if token.get('admin') is not True:
+        return https_fn.Response({'error': 'Admin privileges required'}, status=403)
+    return None
+
+
+@https_fn.on_request(timeout_sec=540, memory=512)
+def reindex_theme_labels_http(req: https_fn.Request) -> https_fn.Response:
+    """
+    テーマ定義を変更した後に、analysis_resultsのテーマラベルを付け直す
+    （全件を書き換えられるため、管理者のIDトークンを持つリクエストのみ受け付ける）
+    """
+    denied = verify_admin_request(req)
+    if denied is not None:
+        return denied
+    request_json = req.get_json(silent=True) or {}
+    result = reindex_theme_labels(
+        firestore.client(),
+        child_id=request_json.get('child_id'),
+        force=bool(request_json.get('force', False)),
+    )
+    status = 200 if result.get('status') == 'success' else 500
+    return https_fn.Response(result, status=status)
+
+
+@on_document_deleted(document="analysis_results/{docId}", timeout_sec=120)
+def delete_vector_datapoints_on_analysis_delete(event: Event[DocumentSnapshot]) -> None:
+    """分析結果が削除された時に、そのエピソードのデータポイントをベクトルストアから削除"""
+    doc_id = event.params["docId"]
+    try:
+        delete_episode_datapoints(
+            firestore.client(),
+            get_vector_store(),
+            doc_id,
+            event.data.to_dict() if event.data else None,
+        )
+    except Exception as e:
+        print(f"Error deleting vector datapoints for {doc_id}: {str(e)}")
+
+
+@scheduler_fn.on_schedule(schedule="every day 03:00", timezone=scheduler_fn.Timezone("Asia/Tokyo"), timeout_sec=540, memory=1024)
+def reconcile_vector_store_scheduled(event: scheduler_fn.ScheduledEvent) -> None:
+    """定期実行: 分析結果がなくなった孤立データポイントをベクトルストアから削除"""
+    result = reconcile_vector_store(firestore.client(), get_vector_store())
+    print(f"Vector store reconciliation: {result}")
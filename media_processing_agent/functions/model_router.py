@@ -0,0 +1,79 @@
+"""
+呼び出し箇所ごとのGeminiモデル振り分け（モデルティアリング）
+
+短いタイトルやキャプションなどの軽いタスクは軽量モデルに、
+エピソード選定や本文生成は標準モデルに振り分ける
+
+環境変数での上書き:
+    MODEL_TIER_STANDARD / MODEL_TIER_LITE: 各ティアのモデル名
+    MODEL_ROUTING_OVERRIDES: 呼び出し箇所ごとの上書き（JSON）
+        例: '{"generate_emotional_title": "standard", "dynamic_multi_analyzer": "lite"}'
+        値にはティア名またはモデル名を指定できる
+"""
+
+import json
+import logging
+import os
+from typing import Dict
+
+from vertexai.generative_models import GenerativeModel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_TIERS = {
+    "standard": "gemini-2.5-flash",
+    "lite": "gemini-2.5-flash-lite",
+}
+
+# 呼び出し箇所 -> ティア
+CALL_SITE_TIERS = {
+    "objective_analyzer": "standard",
+    "batch_objective_analyzer": "standard",
+    "perspective_determiner": "standard",
+    "dynamic_multi_analyzer": "standard",
+    "generate_emotional_title": "lite",
+}
+
+
+def get_model_tiers() -> Dict[str, str]:
+    """ティア名 -> モデル名（環境変数の上書きを反映）"""
+    return {
+        tier: os.getenv(f"MODEL_TIER_{tier.upper()}", model_name)
+        for tier, model_name in DEFAULT_MODEL_TIERS.items()
+    }
+
+
+def get_routing_overrides() -> Dict[str, str]:
+    """MODEL_ROUTING_OVERRIDESを読み込む"""
+    raw = os.getenv("MODEL_ROUTING_OVERRIDES", "")
+    if not raw:
+        return {}
+    try:
+        overrides = json.loads(raw)
+        return overrides if isinstance(overrides, dict) else {}
+    except json.JSONDecodeError as e:
+        logger.warning(f"Invalid MODEL_ROUTING_OVERRIDES, ignoring: {e}")
+        return {}
+
+
+def get_model_name(call_site: str) -> str:
+    """
+    呼び出し箇所に割り当てられたモデル名を取得する
+
+    Args:
+        call_site: 呼び出し箇所の名前（CALL_SITE_TIERSのキー）
+
+    Returns:
+        モデル名
+    """
+    tiers = get_model_tiers()
+    route = get_routing_overrides().get(call_site) or CALL_SITE_TIERS.get(call_site, "standard")
+    # ティア名でなければモデル名の直接指定として扱う
+    return tiers.get(route, route)
+
+
+def get_model(call_site: str) -> GenerativeModel:
+    """呼び出し箇所に割り当てられたGeminiモデルを取得する"""
+    model_name = get_model_name(call_site)
+    logger.info(f"Routing {call_site} to {model_name}")
+    return GenerativeModel(model_name)
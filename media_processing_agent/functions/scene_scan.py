@@ -0,0 +1,220 @@
+"""
+Scene-change aware thumbnail candidate selection
+
+動画全体を低解像度で1回走査し、フレーム間のヒストグラム差分からシーンの切り替わりを検出する
+切り替わりで区切った区間のうち、動きが少なく（ブレにくく）顔が写っている区間から
+候補フレームを選び、フル解像度での品質評価に回す
+走査と候補の取得を合わせたデコードコストはフレーム予算以内に収める
+
+環境変数:
+    THUMBNAIL_SCENE_SCAN: "false" で無効化（固定割合の候補位置を使う）
+    THUMBNAIL_SCAN_FRAME_BUDGET: 走査と候補取得のデコード予算（フレーム数、既定 600）
+"""
+import logging
+import math
+import os
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+
+from frame_scorer import get_face_cascade
+
+logger = logging.getLogger(__name__)
+
+# 走査時の縮小サイズ（ヒストグラムと動き量の計算用）
+SCAN_WIDTH = 64
+HIST_BINS = 32
+# 顔検出に使う縮小幅（区間の代表フレームのみ）
+FACE_SCAN_WIDTH = 320
+# 走査する最大点数
+MAX_SCAN_POINTS = 240
+# 先頭・末尾のフェードや手ブレを避けるため走査範囲から除く割合
+EDGE_MARGIN = 0.05
+# ヒストグラム差分（0〜1）がこの値と中央値+MADの大きい方を超えたらシーンの切り替わり
+MIN_CUT_THRESHOLD = 0.3
+CUT_MAD_FACTOR = 6.0
+
+# 区間のスコアの重み
+STABILITY_WEIGHT = 0.5
+LENGTH_WEIGHT = 0.2
+FACE_WEIGHT = 0.3
+# 顔検出を行う区間数（候補数に対する倍率）
+FACE_CHECK_FACTOR = 3
+
+
+def is_scene_scan_enabled() -> bool:
+    return os.getenv("THUMBNAIL_SCENE_SCAN", "true").lower() not in ("0", "false", "no")
+
+
+def get_frame_budget() -> int:
+    return int(os.getenv("THUMBNAIL_SCAN_FRAME_BUDGET", "600"))
+
+
+def plan_scan_timestamps(
+    duration: float,
+    fps: float,
+    frame_budget: int,
+    max_candidates: int,
+    seek_cost_frames: int,
+) -> List[float]:
+    """
+    予算内で走査するタイムスタンプを決める（動画の長さだけで決まるため、取得前に範囲を計算できる）
+
+    Args:
+        duration: 動画の長さ（秒）
+        fps: フレームレート
+        frame_budget: 走査と候補取得を合わせたデコード予算（フレーム数）
+        max_candidates: 候補フレーム数（取得にシーク1回ずつを見込んで予算から差し引く）
+        seek_cost_frames: シーク1回あたりのデコードコストの見積もり
+
+    Returns:
+        走査するタイムスタンプ（秒、昇順）
+    """
+    if duration <= 0 or fps <= 0:
+        return []
+
+    start = duration * EDGE_MARGIN
+    span_frames = max(1, int((duration - 2 * start) * fps))
+    scan_budget = max(0, frame_budget - max_candidates * (seek_cost_frames + 1))
+
+    if span_frames <= scan_budget:
+        # 区間全体を読み進められる場合は間引いて走査（間のフレームもgrab()で読む）
+        points = min(span_frames, MAX_SCAN_POINTS)
+    else:
+        # 1点ごとにシークする（1点あたり seek_cost_frames + 1 フレーム）
+        points = min(scan_budget // (seek_cost_frames + 1), MAX_SCAN_POINTS)
+
+    if points < 2:
+        return []
+    step = (duration - 2 * start) / points
+    return [start + step * (i + 0.5) for i in range(points)]
+
+
+def _small_gray(frame: np.ndarray, width: int) -> np.ndarray:
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    height = max(1, int(gray.shape[0] * width / gray.shape[1]))
+    return cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def find_segments(hist_diffs: np.ndarray) -> List[range]:
+    """
+    ヒストグラム差分からシーンの切り替わりを検出し、走査点の区間に分ける
+
+    Args:
+        hist_diffs: 隣接する走査点間のヒストグラム差分（長さ n-1）
+
+    Returns:
+        走査点インデックスの区間のリスト
+    """
+    n = len(hist_diffs) + 1
+    if n < 2:
+        return [range(n)]
+    median = float(np.median(hist_diffs))
+    mad = float(np.median(np.abs(hist_diffs - median)))
+    threshold = max(MIN_CUT_THRESHOLD, median + CUT_MAD_FACTOR * mad)
+    cuts = np.flatnonzero(hist_diffs > threshold) + 1
+
+    segments = []
+    start = 0
+    for cut in cuts:
+        segments.append(range(start, int(cut)))
+        start = int(cut)
+    segments.append(range(start, n))
+    return [segment for segment in segments if len(segment) > 0]
+
+
+def select_scene_candidates(sampler, max_candidates: int = 5, frame_budget: int = None) -> Dict[str, Any]:
+    """
+    動画を走査してシーン区間を求め、候補タイムスタンプを選ぶ
+
+    Args:
+        sampler: 開いているFrameSampler
+        max_candidates: 選ぶ候補の最大数
+        frame_budget: デコード予算（フレーム数）、Noneの場合はTHUMBNAIL_SCAN_FRAME_BUDGET
+
+    Returns:
+        {"timestamps": 候補タイムスタンプ, "segments": 区間数, "cuts": 切り替わり数,
+         "face_segments": 顔が写っていた区間数, "scan_points": 走査点数, "decode_cost": 走査のデコードコスト}
+        走査できなかった場合はtimestampsが空
+    """
+    if frame_budget is None:
+        frame_budget = get_frame_budget()
+    info = sampler.info
+    scan_timestamps = plan_scan_timestamps(
+        info.get('duration', 0), info.get('fps', 0), frame_budget, max_candidates, sampler.SEEK_COST_FRAMES
+    )
+    report = {"timestamps": [], "segments": 0, "cuts": 0, "face_segments": 0, "scan_points": 0, "decode_cost": 0}
+    if not scan_timestamps:
+        return report
+
+    cost_before = sampler.decode_cost
+    timestamps = []
+    smalls = []
+    face_grays = []
+    for ts in scan_timestamps:
+        frame = sampler.read_frame(sampler.frame_number_at(ts), max_grab_distance=sampler.SEEK_COST_FRAMES)
+        if frame is None:
+            continue
+        timestamps.append(ts)
+        smalls.append(_small_gray(frame, SCAN_WIDTH))
+        face_grays.append(_small_gray(frame, FACE_SCAN_WIDTH))
+    report["decode_cost"] = sampler.decode_cost - cost_before
+    report["scan_points"] = len(timestamps)
+    if len(timestamps) < 2:
+        return report
+
+    stack = np.stack(smalls).astype(np.float32)
+    # 正規化したヒストグラムのL1距離の半分（0〜1）
+    hists = np.stack([np.bincount(small.ravel() >> 3, minlength=HIST_BINS) for small in smalls]).astype(np.float32)
+    hists /= hists.sum(axis=1, keepdims=True)
+    hist_diffs = 0.5 * np.abs(np.diff(hists, axis=0)).sum(axis=1)
+    # 縮小画像の平均絶対差を動き量とする（各点は前後との差の大きい方）
+    motion = np.abs(np.diff(stack, axis=0)).mean(axis=(1, 2)) / 255.0
+    activity = np.maximum(np.concatenate([[motion[0]], motion]), np.concatenate([motion, [motion[-1]]]))
+
+    segments = find_segments(hist_diffs)
+    report["segments"] = len(segments)
+    report["cuts"] = len(segments) - 1
+
+    max_activity = float(activity.max()) or 1.0
+    scored = []
+    for segment in segments:
+        indices = list(segment)
+        # 切り替わり直後・直前の点は遷移中の可能性があるため、区間が長ければ除く
+        if len(indices) > 2:
+            indices = indices[1:-1]
+        best = min(indices, key=lambda i: activity[i])
+        score = (
+            STABILITY_WEIGHT * (1.0 - float(activity[best]) / max_activity)
+            + LENGTH_WEIGHT * min(len(segment) / len(timestamps) * len(segments), 1.0)
+        )
+        scored.append([score, best, indices])
+
+    # 顔検出は安定度・長さの上位区間の代表フレームのみ
+    scored.sort(key=lambda item: item[0], reverse=True)
+    cascade = get_face_cascade()
+    for item in scored[:max_candidates * FACE_CHECK_FACTOR]:
+        if len(cascade.detectMultiScale(face_grays[item[1]], 1.1, 4)) > 0:
+            item[0] += FACE_WEIGHT
+            report["face_segments"] += 1
+
+    scored.sort(key=lambda item: item[0], reverse=True)
+    chosen = [best for _, best, _ in scored[:max_candidates]]
+
+    # 区間が候補数より少ない場合は、長い区間から代表点と離れた安定な点を追加
+    if len(chosen) < max_candidates:
+        for _, best, indices in sorted(scored, key=lambda item: len(item[2]), reverse=True):
+            spacing = max(1, math.ceil(len(indices) / 3))
+            extras = sorted(
+                (i for i in indices if abs(i - best) >= spacing and i not in chosen),
+                key=lambda i: activity[i],
+            )
+            for i in extras:
+                if len(chosen) >= max_candidates:
+                    break
+                if all(abs(i - c) >= spacing for c in chosen):
+                    chosen.append(i)
+
+    report["timestamps"] = sorted(timestamps[i] for i in chosen)
+    return report
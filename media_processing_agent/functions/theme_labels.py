@@ -0,0 +1,157 @@
+"""
+Ingestion-time notebook theme labels
+
+エピソードの保存時に、ノートブックのテーマ（interest / place / first_time / best_shot / achievement）の
+ラベルとスコアを付与する。ノートブック生成（content_generator）はラベルを参照するだけで済み、
+ノートブックごとに本文の部分文字列検索をやり直さない
+
+分類はLLMを呼ばないローカルの分類器で行う（本文・タグに含まれる検索クエリの数をスコアにする）
+テーマ定義は content_generator/functions/agent.py の analyze_period_and_themes と同じものを持ち、
+定義から計算した theme_set_version を analysis_results に記録する。定義を変更した場合は
+reindex_theme_labels で既存のドキュメントを付け直す（バージョンが異なるドキュメントは
+content_generator 側で従来どおりクエリで照合される）
+"""
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# content_generator の analyze_period_and_themes と同じテーマ・検索クエリ
+THEMES: List[Dict[str, Any]] = [
+    {
+        "id": "interest",
+        "search_queries": ["興味", "夢中", "好き", "楽しい", "お気に入り", "遊び", "おもちゃ"],
+    },
+    {
+        "id": "place",
+        "search_queries": ["行った", "お出かけ", "公園", "散歩", "訪問", "外出", "おでかけ"],
+    },
+    {
+        "id": "first_time",
+        "search_queries": ["初めて", "デビュー", "挑戦", "新しい", "はじめて"],
+    },
+    {
+        "id": "best_shot",
+        "search_queries": ["笑顔", "かわいい", "素敵", "最高", "楽しそう", "嬉しそう"],
+    },
+    {
+        "id": "achievement",
+        "search_queries": [
+            "できた", "成長", "上手", "覚えた", "言えた", "できるように", "楽しい", "嬉しい", "笑顔",
+        ],
+    },
+]
+
+# この数以上のクエリに一致したらスコア1.0とする
+THEME_SCORE_SATURATION = 3
+
+# Firestoreの1バッチあたりの書き込み上限
+REINDEX_BATCH_SIZE = 500
+
+
+def get_theme_set_version(themes: Optional[List[Dict[str, Any]]] = None) -> str:
+    """
+    テーマ定義（IDと検索クエリ）のバージョン（content_generator の theme_matcher と同じ計算）
+    """
+    themes = THEMES if themes is None else themes
+    definition = [[theme["id"], list(theme.get("search_queries", []))] for theme in themes]
+    encoded = json.dumps(definition, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()[:12]
+
+
+def classify_episode(
+    episode: Dict[str, Any],
+    themes: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, float]:
+    """
+    エピソードのテーマごとのスコアを計算する
+
+    Args:
+        episode: content と tags を持つエピソード
+        themes: テーマ定義（Noneの場合はTHEMES）
+
+    Returns:
+        {theme_id: スコア（0〜1）}（一致したテーマのみ）
+    """
+    themes = THEMES if themes is None else themes
+    content = episode.get("content", "").lower()
+    tags = [tag.lower() for tag in episode.get("tags", [])]
+
+    scores = {}
+    for theme in themes:
+        hits = sum(
+            1 for query in theme.get("search_queries", [])
+            if query.lower() in content or any(query.lower() in tag for tag in tags)
+        )
+        if hits:
+            scores[theme["id"]] = round(min(1.0, hits / THEME_SCORE_SATURATION), 3)
+    return scores
+
+
+def label_episodes(
+    episodes: List[Dict[str, Any]],
+    themes: Optional[List[Dict[str, Any]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    エピソードに theme_labels（スコアの高い順）と theme_scores を付与する（引数のdictを更新して返す）
+    """
+    for episode in episodes:
+        scores = classify_episode(episode, themes)
+        episode["theme_scores"] = scores
+        episode["theme_labels"] = sorted(scores, key=lambda theme_id: -scores[theme_id])
+    return episodes
+
+
+def reindex_theme_labels(db, child_id: Optional[str] = None, force: bool = False) -> dict:
+    """
+    テーマ定義を変更した後に、既存のanalysis_resultsのラベルを付け直す
+
+    Args:
+        db: Firestoreクライアント
+        child_id: 対象の子供のID（Noneの場合は全件）
+        force: バージョンが同じドキュメントも付け直す
+
+    Returns:
+        {"status": "success", "report": {"theme_set_version", "scanned", "updated"}}
+    """
+    version = get_theme_set_version()
+    try:
+        query = db.collection("analysis_results")
+        if child_id:
+            query = query.where("child_id", "==", child_id)
+        query = query.select(["episodes", "theme_set_version"])
+
+        scanned = 0
+        updated = 0
+        batch = db.batch()
+        pending = 0
+        for doc in query.stream():
+            scanned += 1
+            data = doc.to_dict() or {}
+            if not force and data.get("theme_set_version") == version:
+                continue
+
+            batch.update(doc.reference, {
+                "episodes": label_episodes(data.get("episodes", [])),
+                "theme_set_version": version,
+            })
+            pending += 1
+            if pending >= REINDEX_BATCH_SIZE:
+                batch.commit()
+                updated += pending
+                batch = db.batch()
+                pending = 0
+        if pending:
+            batch.commit()
+            updated += pending
+
+        logger.info(f"Reindexed theme labels (version {version}): {updated}/{scanned} documents updated")
+        return {
+            "status": "success",
+            "report": {"theme_set_version": version, "scanned": scanned, "updated": updated},
+        }
+    except Exception as e:
+        logger.error(f"Failed to reindex theme labels: {e}")
+        return {"status": "error", "error_message": str(e)}
@@ -0,0 +1,207 @@
+"""
+Cross-trigger dedup of video thumbnail generation
+
+動画のサムネイル生成は、Storageトリガー（generate_thumbnail_on_upload）と
+分析処理（generate_video_thumbnail_if_needed）の両方から同時に呼ばれることがある
+サムネイルの横に置くクレーム用のオブジェクトを if_generation_match=0 で作成し、
+作成できた1つのワーカーだけが生成を行い、他のワーカーは結果を待って再利用する
+
+環境変数:
+    THUMBNAIL_CLAIM_WAIT_SEC: 他のワーカーの生成完了を待つ最大時間（秒、既定 120）
+    THUMBNAIL_CLAIM_TTL_SEC: クレームが放置されたとみなして引き継ぐまでの時間（秒、既定 600）
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from google.cloud import storage
+
+from video_thumbnail import (
+    generate_video_thumbnail_renditions,
+    get_rendition_path,
+    get_saved_video_metadata,
+    get_thumbnail_renditions,
+)
+
+logger = logging.getLogger(__name__)
+
+# 生成完了を確認する間隔（秒、待つごとに伸ばす）
+POLL_INITIAL_SEC = 1.0
+POLL_MAX_SEC = 8.0
+
+_stats = {
+    "generated": 0,          # クレームを取得して生成した
+    "reused_existing": 0,    # 既に生成済みだった
+    "waited_for_other": 0,   # 他のワーカーの生成完了を待って再利用した
+    "wait_timeouts": 0,      # 待機中に生成が完了しなかった
+    "stale_claims_taken_over": 0,
+    "generation_failed": 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str) -> None:
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def get_dedup_stats() -> Dict[str, int]:
+    """このプロセスでのサムネイル生成の重複排除の集計"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def get_claim_path(thumbnail_path: str) -> str:
+    """
+    サムネイルパスからクレーム用オブジェクトのパスを生成
+
+    例: thumbnails/2025/01/video_thumb.jpg -> thumbnails/2025/01/video_thumb.claim
+    """
+    base, _ = os.path.splitext(thumbnail_path)
+    return f"{base}.claim"
+
+
+def thumbnail_set_exists(bucket, thumbnail_path: str) -> bool:
+    """従来パスのサムネイルとレンディションが揃っているか（従来パスは最後にアップロードされる）"""
+    return (
+        bucket.blob(thumbnail_path).exists()
+        and bucket.blob(get_rendition_path(thumbnail_path, 160, "webp")).exists()
+    )
+
+
+def try_claim(bucket, thumbnail_path: str, owner: str, ttl_sec: float) -> bool:
+    """
+    クレーム用オブジェクトを作成してサムネイル生成の担当を取得する
+
+    既存のクレームがttl_secより古い場合は、世代番号を指定して削除したうえで1度だけ取り直す
+
+    Returns:
+        担当を取得できた場合True
+    """
+    claim_blob = bucket.blob(get_claim_path(thumbnail_path))
+    body = json.dumps({"owner": owner, "claimed_at": datetime.now(timezone.utc).isoformat()})
+
+    for attempt in range(2):
+        try:
+            # オブジェクトが存在しない場合のみ作成される
+            claim_blob.upload_from_string(body, content_type="application/json", if_generation_match=0)
+            return True
+        except PreconditionFailed:
+            if attempt > 0:
+                return False
+
+        existing = bucket.get_blob(claim_blob.name)
+        if existing is None:
+            # 直前に解放された
+            continue
+        age = (datetime.now(timezone.utc) - existing.time_created).total_seconds()
+        if age <= ttl_sec:
+            return False
+
+        logger.warning(f"Taking over stale thumbnail claim ({age:.0f}s old): gs://{bucket.name}/{claim_blob.name}")
+        try:
+            existing.delete(if_generation_match=existing.generation)
+            _count("stale_claims_taken_over")
+        except (PreconditionFailed, NotFound):
+            # 他のワーカーが先に引き継いだ
+            return False
+
+    return False
+
+
+def release_claim(bucket, thumbnail_path: str) -> None:
+    try:
+        bucket.blob(get_claim_path(thumbnail_path)).delete()
+    except NotFound:
+        pass
+    except Exception as e:
+        logger.warning(f"Failed to release thumbnail claim for {thumbnail_path}: {e}")
+
+
+def wait_for_thumbnail(bucket, thumbnail_path: str, timeout_sec: float) -> bool:
+    """
+    他のワーカーがサムネイルを生成し終えるまで待つ
+
+    Returns:
+        サムネイルが揃った場合True（タイムアウト、または担当が失敗してクレームを解放した場合False）
+    """
+    deadline = time.monotonic() + timeout_sec
+    interval = POLL_INITIAL_SEC
+    while time.monotonic() < deadline:
+        time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+        if thumbnail_set_exists(bucket, thumbnail_path):
+            return True
+        if not bucket.blob(get_claim_path(thumbnail_path)).exists():
+            # 担当が生成に失敗してクレームを解放した
+            return thumbnail_set_exists(bucket, thumbnail_path)
+        interval = min(interval * 2, POLL_MAX_SEC)
+    return False
+
+
+def ensure_video_thumbnail(
+    video_url: str,
+    bucket_name: str,
+    thumbnail_path: str,
+    caller: str,
+) -> Optional[Dict[str, Any]]:
+    """
+    動画のサムネイルを1つのワーカーだけが生成するようにして取得する
+
+    Args:
+        video_url: 動画ファイルのURL（gs://またはhttps://）
+        bucket_name: サムネイルの保存先バケット
+        thumbnail_path: 従来のサムネイルパス（get_thumbnail_pathの結果）
+        caller: 呼び出し元の名前（ログ用）
+
+    Returns:
+        {"thumbnail_url", "renditions", "video_metadata"}（生成済み・他のワーカーの結果を含む）、失敗時はNone
+    """
+    bucket = storage.Client().bucket(bucket_name)
+    existing = {
+        "thumbnail_url": f"gs://{bucket_name}/{thumbnail_path}",
+        "renditions": get_thumbnail_renditions(bucket_name, thumbnail_path),
+    }
+
+    try:
+        if thumbnail_set_exists(bucket, thumbnail_path):
+            _count("reused_existing")
+            logger.info(f"[{caller}] Thumbnail already exists: {existing['thumbnail_url']}")
+            existing["video_metadata"] = get_saved_video_metadata(bucket, thumbnail_path)
+            return existing
+
+        owner = f"{caller}:{uuid.uuid4().hex[:8]}"
+        ttl_sec = float(os.getenv("THUMBNAIL_CLAIM_TTL_SEC", "600"))
+        if try_claim(bucket, thumbnail_path, owner, ttl_sec):
+            try:
+                logger.info(f"[{caller}] Claimed thumbnail generation for: {video_url}")
+                result = generate_video_thumbnail_renditions(
+                    video_url=video_url,
+                    bucket_name=bucket_name,
+                    output_path=thumbnail_path,
+                    time_offset=None  # 自動選択モード
+                )
+                _count("generated" if result else "generation_failed")
+                return result
+            finally:
+                release_claim(bucket, thumbnail_path)
+
+        # 他のワーカーが生成中なので、ダウンロードやデコードはせずに結果を待つ
+        wait_sec = float(os.getenv("THUMBNAIL_CLAIM_WAIT_SEC", "120"))
+        logger.info(f"[{caller}] Thumbnail generation already claimed, waiting up to {wait_sec:.0f}s: {thumbnail_path}")
+        if wait_for_thumbnail(bucket, thumbnail_path, wait_sec):
+            _count("waited_for_other")
+            existing["video_metadata"] = get_saved_video_metadata(bucket, thumbnail_path)
+            return existing
+
+        _count("wait_timeouts")
+        logger.warning(f"[{caller}] Timed out waiting for thumbnail: {thumbnail_path}")
+        return None
+
+    finally:
+        logger.info(f"Thumbnail dedup stats: {get_dedup_stats()}")
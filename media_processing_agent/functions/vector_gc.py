@@ -0,0 +1,192 @@
+"""
+Garbage collection of episode datapoints in the vector store
+
+メディアの削除に合わせて、analysis_results とベクトルストアのデータポイント（{media_id}_{episode_id}）を削除する
+- Storageの削除トリガー: 元メディアの analysis_results を削除する（delete_media_analysis）
+- analysis_results の削除トリガー: そのドキュメントのエピソードのデータポイントをまとめて削除する
+  （delete_episode_datapoints。アプリから直接削除された場合も対象）
+- 定期実行: 登録済みのデータポイントと analysis_results を突き合わせ、残っている孤立データポイントを削除する
+  （reconcile_vector_store）
+
+Vertex AI Vector Searchは登録済みのIDを一覧できないため、index_episodes が登録したIDを
+vector_datapoints コレクション（ドキュメントID: media_id）に記録し、これを登録内容として突き合わせる
+（ローカルのベクトルストアは登録済みのIDも直接参照する）
+"""
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from google.cloud import firestore
+
+from vector_store import LocalVectorStore, VectorStore
+
+logger = logging.getLogger(__name__)
+
+DATAPOINT_LEDGER_COLLECTION = "vector_datapoints"
+# 1回の削除リクエストで送るデータポイント数
+DELETE_BATCH_SIZE = 1000
+# Firestoreの1バッチあたりの書き込み上限
+FIRESTORE_BATCH_SIZE = 500
+# 突き合わせで1回に取得するanalysis_resultsの件数
+RECONCILE_READ_BATCH_SIZE = 300
+
+
+def get_datapoint_id(media_id: str, episode_id: str) -> str:
+    """エピソードのデータポイントID（index_episodesと同じ形式）"""
+    return f"{media_id}_{episode_id}"
+
+
+def get_episode_datapoint_ids(media_id: str, analysis_data: Dict[str, Any]) -> List[str]:
+    """analysis_resultsのエピソードに対応するデータポイントID"""
+    return [
+        get_datapoint_id(media_id, episode["id"])
+        for episode in analysis_data.get("episodes", [])
+        if episode.get("id")
+    ]
+
+
+def record_indexed_datapoints(db, media_id: str, child_id: str, datapoint_ids: List[str]) -> None:
+    """index_episodesで登録したデータポイントIDを記録する（突き合わせ用）"""
+    db.collection(DATAPOINT_LEDGER_COLLECTION).document(media_id).set({
+        "media_id": media_id,
+        "child_id": child_id,
+        "datapoint_ids": firestore.ArrayUnion(datapoint_ids),
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+
+
+def remove_datapoints(vector_store: Optional[VectorStore], datapoint_ids: Iterable[str]) -> int:
+    """
+    データポイントをDELETE_BATCH_SIZEずつまとめて削除する
+
+    Returns:
+        削除を要求したデータポイント数
+    """
+    datapoint_ids = list(dict.fromkeys(datapoint_ids))
+    if vector_store is None or not datapoint_ids:
+        return 0
+    removed = 0
+    for start in range(0, len(datapoint_ids), DELETE_BATCH_SIZE):
+        removed += vector_store.delete(datapoint_ids[start:start + DELETE_BATCH_SIZE])
+    return removed
+
+
+def delete_episode_datapoints(
+    db,
+    vector_store: Optional[VectorStore],
+    media_id: str,
+    analysis_data: Optional[Dict[str, Any]] = None,
+) -> int:
+    """
+    削除されたanalysis_resultsのデータポイントを削除し、記録も消す
+
+    Args:
+        db: Firestoreクライアント
+        vector_store: ベクトルストア
+        media_id: analysis_resultsのドキュメントID
+        analysis_data: 削除前のドキュメントのデータ（エピソードのIDを使う）
+
+    Returns:
+        削除を要求したデータポイント数
+    """
+    ledger_ref = db.collection(DATAPOINT_LEDGER_COLLECTION).document(media_id)
+    ledger = ledger_ref.get()
+    datapoint_ids = get_episode_datapoint_ids(media_id, analysis_data or {})
+    if ledger.exists:
+        datapoint_ids += (ledger.to_dict() or {}).get("datapoint_ids", [])
+
+    removed = remove_datapoints(vector_store, datapoint_ids)
+    if ledger.exists:
+        ledger_ref.delete()
+    logger.info(f"Removed {removed} vector datapoints for deleted analysis result {media_id}")
+    return removed
+
+
+def delete_media_analysis(db, media_uri: str) -> int:
+    """
+    元メディアが削除された場合に、そのメディアのanalysis_resultsを削除する
+    （データポイントはanalysis_resultsの削除トリガーで削除される）
+
+    Returns:
+        削除したanalysis_resultsの件数
+    """
+    docs = list(
+        db.collection("analysis_results").where("media_uri", "==", media_uri).select([]).stream()
+    )
+    for start in range(0, len(docs), FIRESTORE_BATCH_SIZE):
+        batch = db.batch()
+        for doc in docs[start:start + FIRESTORE_BATCH_SIZE]:
+            batch.delete(doc.reference)
+        batch.commit()
+    if docs:
+        logger.info(f"Deleted {len(docs)} analysis results for deleted media {media_uri}")
+    return len(docs)
+
+
+def reconcile_vector_store(db, vector_store: Optional[VectorStore], dry_run: bool = False) -> dict:
+    """
+    登録済みのデータポイントとanalysis_resultsを突き合わせ、孤立したデータポイントを削除する
+
+    登録済みのデータポイントは vector_datapoints の記録（ローカルのベクトルストアの場合は
+    ストア内のIDも）を使い、analysis_resultsのエピソードから作ったIDにないものを孤立とみなす
+
+    Args:
+        db: Firestoreクライアント
+        vector_store: ベクトルストア
+        dry_run: Trueの場合は件数を数えるだけで削除しない
+
+    Returns:
+        {"status": "success", "report": {"checked_media", "checked_datapoints", "orphaned_datapoints", "removed"}}
+    """
+    try:
+        # media_id -> 登録済みのデータポイントID
+        indexed: Dict[str, set] = {}
+        ledger_refs = {}
+        for doc in db.collection(DATAPOINT_LEDGER_COLLECTION).stream():
+            indexed.setdefault(doc.id, set()).update((doc.to_dict() or {}).get("datapoint_ids", []))
+            ledger_refs[doc.id] = doc.reference
+        if isinstance(vector_store, LocalVectorStore):
+            for datapoint_id in vector_store.list_ids():
+                media_id, _, _ = datapoint_id.rpartition("_")
+                indexed.setdefault(media_id, set()).add(datapoint_id)
+
+        analysis_ref = db.collection("analysis_results")
+        media_ids = list(indexed)
+        orphaned: List[str] = []
+        # (記録の参照, 残すデータポイントID（Noneの場合は記録を削除）)
+        ledger_updates = []
+        for start in range(0, len(media_ids), RECONCILE_READ_BATCH_SIZE):
+            chunk = media_ids[start:start + RECONCILE_READ_BATCH_SIZE]
+            docs = db.get_all([analysis_ref.document(media_id) for media_id in chunk], field_paths=["episodes"])
+            existing = {doc.id: doc.to_dict() or {} for doc in docs if doc.exists}
+            for media_id in chunk:
+                live = set(get_episode_datapoint_ids(media_id, existing.get(media_id, {})))
+                stale = indexed[media_id] - live
+                orphaned.extend(sorted(stale))
+                if media_id in ledger_refs and (stale or media_id not in existing):
+                    # 再分析でエピソードが置き換わった場合は、残っているものだけを記録し直す
+                    remaining = sorted(indexed[media_id] & live) if media_id in existing else None
+                    ledger_updates.append((ledger_refs[media_id], remaining))
+
+        removed = 0
+        if not dry_run:
+            removed = remove_datapoints(vector_store, orphaned)
+            for start in range(0, len(ledger_updates), FIRESTORE_BATCH_SIZE):
+                batch = db.batch()
+                for ref, remaining in ledger_updates[start:start + FIRESTORE_BATCH_SIZE]:
+                    if remaining is None:
+                        batch.delete(ref)
+                    else:
+                        batch.update(ref, {"datapoint_ids": remaining})
+                batch.commit()
+
+        report = {
+            "checked_media": len(media_ids),
+            "checked_datapoints": sum(len(ids) for ids in indexed.values()),
+            "orphaned_datapoints": len(orphaned),
+            "removed": removed,
+        }
+        logger.info(f"Vector store reconciliation{' (dry run)' if dry_run else ''}: {report}")
+        return {"status": "success", "report": report}
+    except Exception as e:
+        logger.error(f"Failed to reconcile vector store: {e}")
+        return {"status": "error", "error_message": str(e)}
@@ -0,0 +1,498 @@
+"""
+Vector store abstraction for episode embeddings
+
+エピソードの埋め込みの登録（upsert）・削除・絞り込み付きk近傍検索を VectorStore にまとめ、
+Vertex AI Vector Search と、ディスクに保存するローカルのNumPy実装（総当たり / IVF）を切り替えられるようにする
+（media_processing_agent と content_generator に同じファイルを置く。片方だけを変更すると
+content_generator/tests/test_shared_modules.py が失敗する）
+
+データポイントはVertex AIの IndexDatapoint と同じ形式のdict:
+    {"datapoint_id": str, "feature_vector": [float, ...],
+     "restricts": [{"namespace": str, "allow_list": [str, ...]}],
+     "numeric_restricts": [{"namespace": str, "value_int": int}]}
+検索の絞り込みも同じ形式（numeric_restricts には "op": LESS / LESS_EQUAL / EQUAL / GREATER_EQUAL / GREATER / NOT_EQUAL）
+類似度は内積（Vertexのインデックスは DOT_PRODUCT_DISTANCE を想定）で、大きいほど近い
+
+環境変数:
+    VECTOR_STORE_BACKEND: vertex / local（未指定の場合はVERTEX_AI_INDEX_ID または VERTEX_AI_INDEX_ENDPOINT_ID があればvertex）
+    VERTEX_AI_INDEX_ID: 登録・削除に使うインデックスのID
+    VERTEX_AI_INDEX_ENDPOINT_ID: 検索に使うIndex EndpointのID
+    VERTEX_AI_INDEX_ENDPOINT_DOMAIN: パブリックエンドポイントのドメイン（未指定の場合はIndex Endpointから取得）
+    VERTEX_AI_DEPLOYED_INDEX_ID: デプロイ済みインデックスのID（既定は deployed_index）
+    VECTOR_STORE_PATH: ローカル実装の保存先ディレクトリ（既定は /tmp/vector_store）
+    VECTOR_STORE_IVF_LISTS: ローカル実装のIVFのリスト数（既定は0で、件数がIVF_MIN_POINTS以上なら√件数、負の値で総当たり）
+    VECTOR_STORE_IVF_PROBES: ローカル実装のIVFで検索するリスト数（既定は8）
+"""
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 件数がこれ未満の場合はIVFを使わず総当たりで検索する
+IVF_MIN_POINTS = 4096
+IVF_TRAIN_ITERATIONS = 10
+IVF_TRAIN_SAMPLE = 20000
+
+NUMERIC_OPS = {
+    "LESS": np.less,
+    "LESS_EQUAL": np.less_equal,
+    "EQUAL": np.equal,
+    "GREATER_EQUAL": np.greater_equal,
+    "GREATER": np.greater,
+    "NOT_EQUAL": np.not_equal,
+}
+
+# (datapoint_id, 類似度)
+Neighbor = Tuple[str, float]
+
+
+class VectorStore(ABC):
+    """埋め込みの登録・削除・絞り込み付きk近傍検索のインターフェース"""
+
+    @abstractmethod
+    def upsert(self, datapoints: List[Dict[str, Any]]) -> int:
+        """データポイントをまとめて登録（同じIDは上書き）し、登録した件数を返す"""
+
+    @abstractmethod
+    def delete(self, datapoint_ids: List[str]) -> int:
+        """データポイントをまとめて削除し、削除を要求した件数を返す"""
+
+    @abstractmethod
+    def search(
+        self,
+        queries: List[List[float]],
+        top_k: int = 10,
+        restricts: Optional[List[Dict[str, Any]]] = None,
+        numeric_restricts: Optional[List[Dict[str, Any]]] = None,
+    ) -> List[List[Neighbor]]:
+        """
+        クエリごとに類似度の高い順の近傍を返す
+
+        Args:
+            queries: クエリの埋め込みのリスト（全クエリを1回で検索する）
+            top_k: クエリごとの近傍数
+            restricts: namespaceごとの許可リスト（全namespaceのいずれかのトークンを持つデータポイントだけを対象）
+            numeric_restricts: 数値の範囲条件（すべてを満たすデータポイントだけを対象）
+        """
+
+
+class VertexVectorStore(VectorStore):
+    """Vertex AI Vector Search（登録・削除はIndex、検索はIndex EndpointのMatchService）"""
+
+    def __init__(
+        self,
+        project_id: str,
+        location: str,
+        index_id: Optional[str] = None,
+        index_endpoint_id: Optional[str] = None,
+        deployed_index_id: str = "deployed_index",
+        endpoint_domain: Optional[str] = None,
+    ):
+        self.project_id = project_id
+        self.location = location
+        self.index_id = index_id
+        self.index_endpoint_id = index_endpoint_id
+        self.deployed_index_id = deployed_index_id
+        self.endpoint_domain = endpoint_domain
+        self._index = None
+        self._match_client = None
+
+    def _get_index(self):
+        if not self.index_id:
+            raise RuntimeError("VERTEX_AI_INDEX_ID is not configured")
+        if self._index is None:
+            from google.cloud.aiplatform import MatchingEngineIndex
+
+            self._index = MatchingEngineIndex(
+                index_name=f"projects/{self.project_id}/locations/{self.location}/indexes/{self.index_id}"
+            )
+        return self._index
+
+    def _get_index_endpoint_name(self) -> str:
+        if not self.index_endpoint_id:
+            raise RuntimeError("VERTEX_AI_INDEX_ENDPOINT_ID is not configured")
+        return f"projects/{self.project_id}/locations/{self.location}/indexEndpoints/{self.index_endpoint_id}"
+
+    def _get_match_client(self):
+        """
+        検索（find_neighbors）用の MatchServiceClient を取得する
+
+        find_neighbors は MatchServiceClient にしかなく、パブリックエンドポイントの専用ドメインに接続する
+        （ドメインが未指定の場合はIndex Endpointの public_endpoint_domain_name を使う）
+        """
+        if self._match_client is None:
+            from google.cloud import aiplatform_v1
+
+            api_endpoint = self.endpoint_domain
+            if not api_endpoint:
+                endpoint_service = aiplatform_v1.IndexEndpointServiceClient(
+                    client_options={"api_endpoint": f"{self.location}-aiplatform.googleapis.com"}
+                )
+                api_endpoint = endpoint_service.get_index_endpoint(
+                    name=self._get_index_endpoint_name()
+                ).public_endpoint_domain_name
+                if not api_endpoint:
+                    raise RuntimeError(
+                        f"Index endpoint {self.index_endpoint_id} has no public endpoint domain; "
+                        "set VERTEX_AI_INDEX_ENDPOINT_DOMAIN"
+                    )
+            self._match_client = aiplatform_v1.MatchServiceClient(client_options={"api_endpoint": api_endpoint})
+        return self._match_client
+
+    def upsert(self, datapoints: List[Dict[str, Any]]) -> int:
+        if not datapoints:
+            return 0
+        self._get_index().upsert_datapoints(datapoints=datapoints)
+        return len(datapoints)
+
+    def delete(self, datapoint_ids: List[str]) -> int:
+        if not datapoint_ids:
+            return 0
+        self._get_index().remove_datapoints(datapoint_ids=list(datapoint_ids))
+        return len(datapoint_ids)
+
+    def search(
+        self,
+        queries: List[List[float]],
+        top_k: int = 10,
+        restricts: Optional[List[Dict[str, Any]]] = None,
+        numeric_restricts: Optional[List[Dict[str, Any]]] = None,
+    ) -> List[List[Neighbor]]:
+        if not queries:
+            return []
+        response = self._get_match_client().find_neighbors(
+            request={
+                "index_endpoint": self._get_index_endpoint_name(),
+                "deployed_index_id": self.deployed_index_id,
+                "queries": [
+                    {
+                        "datapoint": {
+                            "feature_vector": [float(value) for value in query],
+                            "restricts": restricts or [],
+                            "numeric_restricts": numeric_restricts or [],
+                        },
+                        "neighbor_count": top_k,
+                    }
+                    for query in queries
+                ],
+            }
+        )
+        return [
+            [(neighbor.datapoint.datapoint_id, float(neighbor.distance)) for neighbor in nearest.neighbors]
+            for nearest in response.nearest_neighbors
+        ]
+
+
+class LocalVectorStore(VectorStore):
+    """
+    ディスクに保存するNumPyのベクトルストア（オフラインでのテスト・ベンチマーク用）
+
+    件数が少ない場合は総当たり、多い場合はIVF（k-meansで分割したリストのうち、クエリに近い
+    ivf_probes個だけを検索）で内積の上位を求める。変更のたびに path 以下へ保存する
+    （1プロセスからの書き込みを想定）
+    """
+
+    def __init__(self, path: str, ivf_lists: int = 0, ivf_probes: int = 8):
+        """
+        Args:
+            path: 保存先ディレクトリ（存在する場合は読み込む）
+            ivf_lists: IVFのリスト数（0は件数に応じて自動、負の値は常に総当たり）
+            ivf_probes: 検索するリスト数
+        """
+        self.path = path
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._restricts: List[Dict[str, List[str]]] = []
+        self._numeric: List[Dict[str, int]] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments: Optional[np.ndarray] = None
+        self._token_rows: Dict[str, Dict[str, np.ndarray]] = {}
+        self._numeric_values: Dict[str, np.ndarray] = {}
+        self._dirty = True
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def list_ids(self) -> List[str]:
+        """登録済みのデータポイントID"""
+        with self._lock:
+            return list(self._ids)
+
+    # ---- 保存・読み込み ----
+
+    def _files(self) -> Tuple[str, str]:
+        return os.path.join(self.path, "vectors.npz"), os.path.join(self.path, "metadata.json")
+
+    def _load(self) -> None:
+        vectors_file, metadata_file = self._files()
+        if not (os.path.exists(vectors_file) and os.path.exists(metadata_file)):
+            return
+        with open(metadata_file, encoding="utf-8") as f:
+            metadata = json.load(f)
+        with np.load(vectors_file) as arrays:
+            self._vectors = arrays["vectors"].astype(np.float32)
+            if "centroids" in arrays and "assignments" in arrays:
+                self._centroids = arrays["centroids"]
+                self._assignments = arrays["assignments"]
+                self._dirty = False
+        self._ids = metadata["ids"]
+        self._restricts = metadata["restricts"]
+        self._numeric = metadata["numeric"]
+        self._build_filters()
+        logger.info(f"Loaded local vector store from {self.path}: {len(self._ids)} datapoints")
+
+    def _save(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        vectors_file, metadata_file = self._files()
+        arrays = {"vectors": self._vectors}
+        if self._centroids is not None and not self._dirty:
+            arrays["centroids"] = self._centroids
+            arrays["assignments"] = self._assignments
+        # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+        with open(vectors_file + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        with open(metadata_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {"ids": self._ids, "restricts": self._restricts, "numeric": self._numeric},
+                f, ensure_ascii=False,
+            )
+        os.replace(vectors_file + ".tmp", vectors_file)
+        os.replace(metadata_file + ".tmp", metadata_file)
+
+    # ---- 登録・削除 ----
+
+    def upsert(self, datapoints: List[Dict[str, Any]]) -> int:
+        if not datapoints:
+            return 0
+        with self._lock:
+            positions = {datapoint_id: row for row, datapoint_id in enumerate(self._ids)}
+            new_rows = []
+            for datapoint in datapoints:
+                vector = np.asarray(datapoint["feature_vector"], dtype=np.float32)
+                if self._vectors.shape[1] == 0 and not new_rows:
+                    self._vectors = np.zeros((len(self._ids), vector.shape[0]), dtype=np.float32)
+                restricts = {
+                    item["namespace"]: list(item.get("allow_list", []))
+                    for item in datapoint.get("restricts", [])
+                }
+                numeric = {
+                    item["namespace"]: int(item["value_int"])
+                    for item in datapoint.get("numeric_restricts", [])
+                    if "value_int" in item
+                }
+                row = positions.get(datapoint["datapoint_id"])
+                if row is None:
+                    positions[datapoint["datapoint_id"]] = len(self._ids)
+                    self._ids.append(datapoint["datapoint_id"])
+                    self._restricts.append(restricts)
+                    self._numeric.append(numeric)
+                    new_rows.append(vector)
+                elif row < len(self._vectors):
+                    self._vectors[row] = vector
+                    self._restricts[row] = restricts
+                    self._numeric[row] = numeric
+                else:
+                    # 同じバッチ内で追加したIDの上書き
+                    new_rows[row - len(self._vectors)] = vector
+                    self._restricts[row] = restricts
+                    self._numeric[row] = numeric
+            if new_rows:
+                self._vectors = np.vstack([self._vectors, np.stack(new_rows)])
+            self._dirty = True
+            self._build_filters()
+            self._save()
+        return len(datapoints)
+
+    def delete(self, datapoint_ids: List[str]) -> int:
+        if not datapoint_ids:
+            return 0
+        with self._lock:
+            removed = set(datapoint_ids)
+            keep = [row for row, datapoint_id in enumerate(self._ids) if datapoint_id not in removed]
+            if len(keep) != len(self._ids):
+                self._ids = [self._ids[row] for row in keep]
+                self._restricts = [self._restricts[row] for row in keep]
+                self._numeric = [self._numeric[row] for row in keep]
+                self._vectors = self._vectors[keep]
+                self._dirty = True
+                self._build_filters()
+                self._save()
+        return len(datapoint_ids)
+
+    # ---- 検索 ----
+
+    def _build_filters(self) -> None:
+        # namespace -> トークン -> 行番号の配列、namespace -> 値の配列（値がない行はNaN）
+        tokens: Dict[str, Dict[str, List[int]]] = {}
+        for row, restricts in enumerate(self._restricts):
+            for namespace, allow_list in restricts.items():
+                for token in allow_list:
+                    tokens.setdefault(namespace, {}).setdefault(token, []).append(row)
+        self._token_rows = {
+            namespace: {token: np.asarray(rows, dtype=np.int64) for token, rows in by_token.items()}
+            for namespace, by_token in tokens.items()
+        }
+        namespaces = {namespace for numeric in self._numeric for namespace in numeric}
+        self._numeric_values = {
+            namespace: np.array([numeric.get(namespace, np.nan) for numeric in self._numeric], dtype=np.float64)
+            for namespace in namespaces
+        }
+
+    def _filter_mask(
+        self,
+        restricts: Optional[List[Dict[str, Any]]],
+        numeric_restricts: Optional[List[Dict[str, Any]]],
+    ) -> np.ndarray:
+        mask = np.ones(len(self._ids), dtype=bool)
+        for restrict in restricts or []:
+            allowed = np.zeros(len(self._ids), dtype=bool)
+            by_token = self._token_rows.get(restrict["namespace"], {})
+            for token in restrict.get("allow_list", []):
+                if token in by_token:
+                    allowed[by_token[token]] = True
+            mask &= allowed
+        for restrict in numeric_restricts or []:
+            values = self._numeric_values.get(restrict["namespace"])
+            if values is None:
+                return np.zeros(len(self._ids), dtype=bool)
+            op = NUMERIC_OPS[restrict.get("op", "EQUAL")]
+            # 値がない（NaN）データポイントは比較がFalseになり除外される
+            with np.errstate(invalid="ignore"):
+                mask &= op(values, float(restrict["value_int"]))
+        return mask
+
+    def _get_ivf_lists(self) -> int:
+        if self.ivf_lists < 0:
+            return 0
+        if self.ivf_lists > 0:
+            return min(self.ivf_lists, len(self._ids))
+        return int(np.sqrt(len(self._ids))) if len(self._ids) >= IVF_MIN_POINTS else 0
+
+    def _train_ivf(self) -> None:
+        lists = self._get_ivf_lists()
+        if not lists:
+            self._centroids = None
+            self._assignments = None
+            self._dirty = False
+            return
+        rng = np.random.default_rng(0)
+        sample = self._vectors
+        if len(sample) > IVF_TRAIN_SAMPLE:
+            sample = sample[rng.choice(len(sample), IVF_TRAIN_SAMPLE, replace=False)]
+        centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            nearest = np.argmax(sample @ centroids.T, axis=1)
+            for index in range(lists):
+                members = sample[nearest == index]
+                if len(members):
+                    centroids[index] = members.mean(axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.where(norms > 0, norms, 1)
+        self._centroids = centroids
+        self._assignments = np.argmax(self._vectors @ centroids.T, axis=1)
+        self._dirty = False
+        logger.info(f"Trained IVF with {lists} lists over {len(self._ids)} datapoints")
+
+    def search(
+        self,
+        queries: List[List[float]],
+        top_k: int = 10,
+        restricts: Optional[List[Dict[str, Any]]] = None,
+        numeric_restricts: Optional[List[Dict[str, Any]]] = None,
+    ) -> List[List[Neighbor]]:
+        if not queries:
+            return []
+        with self._lock:
+            if not self._ids:
+                return [[] for _ in queries]
+            if self._dirty:
+                self._train_ivf()
+                self._save()
+            query_matrix = np.asarray(queries, dtype=np.float32)
+            mask = self._filter_mask(restricts, numeric_restricts)
+
+            probes = min(self.ivf_probes, len(self._centroids)) if self._centroids is not None else 0
+            rows = np.flatnonzero(mask)
+            # 絞り込み後の件数が検索するリストの合計（の目安）以下なら、IVFを使わずにそのまま評価する
+            if self._centroids is None or len(rows) <= len(self._ids) * probes / len(self._centroids):
+                # 総当たり: 対象の行だけを1回の行列積で評価する
+                scores = query_matrix @ self._vectors[rows].T
+                return [self._top_k(rows, query_scores, top_k) for query_scores in scores]
+
+            nearest_lists = np.argsort(-(query_matrix @ self._centroids.T), axis=1)[:, :probes]
+            results = []
+            for query, lists in zip(query_matrix, nearest_lists):
+                rows = np.flatnonzero(mask & np.isin(self._assignments, lists))
+                if len(rows) < top_k:
+                    # 絞り込みで候補が足りない場合は対象の行をすべて評価する
+                    rows = np.flatnonzero(mask)
+                results.append(self._top_k(rows, self._vectors[rows] @ query, top_k))
+            return results
+
+    def _top_k(self, rows: np.ndarray, scores: np.ndarray, top_k: int) -> List[Neighbor]:
+        if len(rows) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            best = np.arange(len(rows))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(self._ids[rows[index]], float(scores[index])) for index in best.tolist()]
+
+
+_vector_store: Optional[VectorStore] = None
+_vector_store_resolved = False
+_vector_store_lock = threading.Lock()
+
+
+def get_vector_store() -> Optional[VectorStore]:
+    """
+    環境変数に応じたベクトルストアを取得（遅延初期化）
+
+    Returns:
+        VectorStore（vertexでインデックスもエンドポイントも未設定の場合はNone）
+    """
+    global _vector_store, _vector_store_resolved
+    with _vector_store_lock:
+        if not _vector_store_resolved:
+            _vector_store_resolved = True
+            index_id = os.getenv("VERTEX_AI_INDEX_ID")
+            index_endpoint_id = os.getenv("VERTEX_AI_INDEX_ENDPOINT_ID")
+            backend = os.getenv("VECTOR_STORE_BACKEND") or ("vertex" if index_id or index_endpoint_id else "")
+            if backend == "local":
+                _vector_store = LocalVectorStore(
+                    os.getenv("VECTOR_STORE_PATH", "/tmp/vector_store"),
+                    ivf_lists=int(os.getenv("VECTOR_STORE_IVF_LISTS", "0")),
+                    ivf_probes=int(os.getenv("VECTOR_STORE_IVF_PROBES", "8")),
+                )
+            elif backend == "vertex" and (index_id or index_endpoint_id):
+                _vector_store = VertexVectorStore(
+                    project_id=os.getenv("GOOGLE_CLOUD_PROJECT", "hackason-464007"),
+                    location=os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1"),
+                    index_id=index_id,
+                    index_endpoint_id=index_endpoint_id,
+                    deployed_index_id=os.getenv("VERTEX_AI_DEPLOYED_INDEX_ID", "deployed_index"),
+                    endpoint_domain=os.getenv("VERTEX_AI_INDEX_ENDPOINT_DOMAIN"),
+                )
+            else:
+                logger.warning(
+                    "No vector store configured (set VERTEX_AI_INDEX_ID / VERTEX_AI_INDEX_ENDPOINT_ID "
+                    "or VECTOR_STORE_BACKEND=local)"
+                )
+        return _vector_store
+
+
+def reset_vector_store() -> None:
+    """ベクトルストアを破棄する（環境変数を変更した後に作り直す場合）"""
+    global _vector_store, _vector_store_resolved
+    with _vector_store_lock:
+        _vector_store = None
+        _vector_store_resolved = False
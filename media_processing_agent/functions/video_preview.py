@@ -0,0 +1,347 @@
+"""
+Low-bitrate preview transcodes for web and mobile playback
+
+スマートフォンで撮影した元の動画（高ビットレートのHEVC .movなど）は再生開始が遅く通信量も多いため、
+先頭から最大 PREVIEW_MAX_DURATION_SEC 秒を、短辺 PREVIEW_MAX_SHORT_EDGE px 以下の
+低ビットレートなH.264/AAC MP4（faststart）に変換して previews/ 以下に保存する
+オプションで先頭数秒のアニメーションWebP（ループ再生用）も生成する
+
+変換にはimageio-ffmpegに同梱のffmpeg（なければPATH上のffmpeg）を使う
+元の動画はダウンロードせず、ffmpegがCloud StorageのJSON APIからHTTPの範囲取得で直接読む
+（インデックスと先頭の必要な部分だけを読み、アニメーションWebPは変換後のプレビューから作る）
+変換のタイムアウトは呼び出し元の残り時間（deadline）を超えないようにする
+結果は media_renditions コレクションに保存し、同じメディアの analysis_results にも反映する
+
+環境変数:
+    PREVIEW_ENABLED: "false" でプレビュー生成を無効化（既定 true）
+    PREVIEW_MAX_DURATION_SEC: プレビューの最大長（秒、既定 30）
+    PREVIEW_MAX_SHORT_EDGE: プレビューの短辺の最大サイズ（px、既定 480）
+    PREVIEW_VIDEO_KBPS: プレビューの映像ビットレート（kbps、既定 800）
+    PREVIEW_ANIMATED_WEBP: "true" で先頭数秒のアニメーションWebPも生成（既定 false）
+    PREVIEW_TIMEOUT_SEC: 変換のタイムアウトの上限（秒、既定 180。deadlineまでの残り時間の方が短ければそちら）
+"""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import urllib.parse
+from typing import Any, Dict, List, Optional
+
+import cv2
+import google.auth
+import google.auth.transport.requests
+from google.cloud import storage
+from PIL import Image
+
+from image_renditions import save_media_renditions
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_AUDIO_KBPS = 64
+PREVIEW_MAX_FPS = 30
+# アニメーションWebP: 先頭の秒数・幅・フレームレート・画質
+WEBP_LOOP_SEC = 3
+WEBP_LOOP_WIDTH = 320
+WEBP_LOOP_FPS = 10
+WEBP_LOOP_QUALITY = 60
+PREVIEW_CACHE_CONTROL = 'public, max-age=86400'
+# 変換後のアップロード・Firestoreへの保存のためにdeadlineの手前で残しておく時間（秒）
+PREVIEW_FINALIZE_SEC = 20
+# 残り時間がこれより短い場合は変換を始めない（秒）
+PREVIEW_MIN_TRANSCODE_SEC = 15
+STORAGE_READ_SCOPE = "https://www.googleapis.com/auth/devstorage.read_only"
+
+
+def is_preview_enabled() -> bool:
+    return os.getenv("PREVIEW_ENABLED", "true").lower() not in ("0", "false", "no")
+
+
+def is_animated_webp_enabled() -> bool:
+    return os.getenv("PREVIEW_ANIMATED_WEBP", "false").lower() in ("1", "true", "yes")
+
+
+def get_ffmpeg_exe() -> Optional[str]:
+    """ffmpegの実行ファイル（imageio-ffmpeg同梱のものを優先）、見つからない場合はNone"""
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return shutil.which("ffmpeg")
+
+
+def get_preview_path(video_path: str, suffix: str = "preview", extension: str = "mp4") -> str:
+    """
+    動画ファイルパスからプレビューのパスを生成（サムネイルと同じ階層を previews/ 以下に作る）
+
+    例: videos/2025/01/video.mov -> previews/2025/01/video_preview.mp4
+        user/child/2025-01/video.mov, loop, webp -> previews/user/child/2025-01/video_loop.webp
+    """
+    dir_path = os.path.dirname(video_path)
+    name, _ = os.path.splitext(os.path.basename(video_path))
+
+    if dir_path.startswith('videos/'):
+        preview_dir = dir_path.replace('videos/', 'previews/', 1)
+    else:
+        preview_dir = f"previews/{dir_path}" if dir_path else "previews"
+
+    return os.path.join(preview_dir, f"{name}_{suffix}.{extension}").replace('\\', '/')
+
+
+def get_storage_media_url(bucket_name: str, object_path: str) -> str:
+    """ffmpegが範囲取得で読むオブジェクトのURL（JSON APIのメディアダウンロード）"""
+    return (
+        f"https://storage.googleapis.com/storage/v1/b/{bucket_name}/o/"
+        f"{urllib.parse.quote(object_path, safe='')}?alt=media"
+    )
+
+
+def get_storage_auth_header() -> str:
+    """ffmpegのHTTP入力に渡すCloud Storage読み取り用の認証ヘッダ"""
+    credentials, _ = google.auth.default(scopes=[STORAGE_READ_SCOPE])
+    credentials.refresh(google.auth.transport.requests.Request())
+    return f"Authorization: Bearer {credentials.token}\r\n"
+
+
+def build_transcode_command(
+    ffmpeg: str,
+    source: str,
+    output: str,
+    headers: Optional[str] = None,
+) -> List[str]:
+    """
+    プレビューMP4に変換するffmpegのコマンドライン
+
+    sourceはローカルパスまたはURL（headersはHTTP入力に付けるヘッダ）
+    """
+    max_duration = float(os.getenv("PREVIEW_MAX_DURATION_SEC", "30"))
+    short_edge = int(os.getenv("PREVIEW_MAX_SHORT_EDGE", "480"))
+    video_kbps = int(os.getenv("PREVIEW_VIDEO_KBPS", "800"))
+
+    # 回転はffmpegが自動で適用するため、縦長・横長どちらも短辺で制限する（元より大きくはしない）
+    # yuv420pのlibx264は奇数の幅・高さを扱えないため、短辺も偶数に切り捨てる
+    scale = (
+        f"scale='if(gt(iw,ih),-2,trunc(min({short_edge},iw)/2)*2)'"
+        f":'if(gt(iw,ih),trunc(min({short_edge},ih)/2)*2,-2)'"
+    )
+    input_options = ["-headers", headers] if headers else []
+    return [
+        ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+        *input_options,
+        "-i", source,
+        "-t", f"{max_duration:g}",
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", scale,
+        "-fpsmax", str(PREVIEW_MAX_FPS),
+        "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "main", "-pix_fmt", "yuv420p",
+        "-b:v", f"{video_kbps}k", "-maxrate", f"{int(video_kbps * 1.25)}k", "-bufsize", f"{video_kbps * 2}k",
+        "-c:a", "aac", "-b:a", f"{PREVIEW_AUDIO_KBPS}k", "-ac", "1",
+        # 先頭にmoovを置き、ダウンロード完了前に再生を開始できるようにする
+        "-movflags", "+faststart",
+        output,
+    ]
+
+
+def get_transcode_timeout(deadline: Optional[float] = None) -> float:
+    """
+    変換のタイムアウト（秒）
+
+    PREVIEW_TIMEOUT_SEC と、deadline（time.monotonic()の値）までの残り時間から
+    PREVIEW_FINALIZE_SEC を引いたもののうち短い方
+    """
+    timeout = float(os.getenv("PREVIEW_TIMEOUT_SEC", "180"))
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic() - PREVIEW_FINALIZE_SEC)
+    return timeout
+
+
+def transcode_preview(
+    source: str,
+    output: str,
+    headers: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    動画をプレビューMP4に変換
+
+    Args:
+        source: 元動画のローカルパスまたはURL
+        output: 出力先のローカルパス
+        headers: HTTP入力に付けるヘッダ（Cloud Storageの認証など）
+        timeout: 変換のタイムアウト（秒、Noneの場合はPREVIEW_TIMEOUT_SEC）
+
+    Returns:
+        {"width", "height", "duration", "bytes", "transcode_sec"}
+
+    Raises:
+        RuntimeError: ffmpegが見つからない、または変換に失敗した場合
+    """
+    ffmpeg = get_ffmpeg_exe()
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg is not available (install imageio-ffmpeg)")
+
+    timeout = get_transcode_timeout() if timeout is None else timeout
+    start = time.perf_counter()
+    completed = subprocess.run(
+        build_transcode_command(ffmpeg, source, output, headers),
+        capture_output=True,
+        timeout=timeout,
+    )
+    transcode_sec = time.perf_counter() - start
+    if completed.returncode != 0 or not os.path.exists(output):
+        raise RuntimeError(f"ffmpeg failed ({completed.returncode}): {completed.stderr.decode(errors='replace')[-500:]}")
+
+    cap = cv2.VideoCapture(output)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        return {
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "duration": round(frame_count / fps, 3) if fps > 0 else 0,
+            "bytes": os.path.getsize(output),
+            "transcode_sec": round(transcode_sec, 3),
+        }
+    finally:
+        cap.release()
+
+
+def render_webp_loop(source: str, output: str) -> Dict[str, Any]:
+    """
+    動画の先頭 WEBP_LOOP_SEC 秒から、ループ再生するアニメーションWebPを生成
+
+    Returns:
+        {"width", "height", "frames", "bytes", "transcode_sec"}（フレームを読めない場合はframes=0）
+    """
+    start = time.perf_counter()
+    cap = cv2.VideoCapture(source)
+    frames = []
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        step = max(1, round(fps / WEBP_LOOP_FPS))
+        frame_count = int(min(cap.get(cv2.CAP_PROP_FRAME_COUNT), fps * WEBP_LOOP_SEC))
+        for index in range(frame_count):
+            if not cap.grab():
+                break
+            if index % step:
+                continue
+            ok, frame = cap.retrieve()
+            if not ok:
+                break
+            height = max(1, round(frame.shape[0] * WEBP_LOOP_WIDTH / frame.shape[1]))
+            frame = cv2.resize(frame, (WEBP_LOOP_WIDTH, height), interpolation=cv2.INTER_AREA)
+            frames.append(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+    finally:
+        cap.release()
+
+    if not frames:
+        return {"frames": 0}
+
+    frames[0].save(
+        output,
+        'WEBP',
+        save_all=True,
+        append_images=frames[1:],
+        duration=round(1000 * step / fps),
+        loop=0,
+        quality=WEBP_LOOP_QUALITY,
+        method=4,
+    )
+    return {
+        "width": frames[0].width,
+        "height": frames[0].height,
+        "frames": len(frames),
+        "bytes": os.path.getsize(output),
+        "transcode_sec": round(time.perf_counter() - start, 3),
+    }
+
+
+def generate_video_preview(
+    bucket_name: str,
+    video_path: str,
+    deadline: Optional[float] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    アップロードされた動画のプレビューを生成してCloud Storageに保存
+
+    元の動画はダウンロードせず、ffmpegがCloud Storageから必要な範囲だけを読む
+
+    Args:
+        bucket_name: バケット名
+        video_path: 動画のオブジェクトパス
+        deadline: 処理を終える期限（time.monotonic()の値）。変換のタイムアウトをこれに合わせ、
+            残り時間が足りない場合は生成しない
+
+    Returns:
+        {"media_uri", "preview": {"url", "width", "height", "duration", "bytes", "bitrate_kbps",
+         "compression_ratio", "transcode_sec", "webp_url"（生成した場合）}}、失敗時はNone
+    """
+    video_url = f"gs://{bucket_name}/{video_path}"
+    try:
+        timeout = get_transcode_timeout(deadline)
+        if timeout < PREVIEW_MIN_TRANSCODE_SEC:
+            logger.warning(f"Skipping video preview, only {timeout:.0f}s left for transcoding: {video_url}")
+            return None
+
+        bucket = storage.Client().bucket(bucket_name)
+        source = bucket.get_blob(video_path)
+        if source is None:
+            logger.warning(f"Video no longer exists, skipping preview: {video_url}")
+            return None
+        source_bytes = source.size or 0
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, "preview.mp4")
+            preview = transcode_preview(
+                get_storage_media_url(bucket_name, video_path),
+                output,
+                headers=get_storage_auth_header(),
+                timeout=timeout,
+            )
+
+            preview_path = get_preview_path(video_path)
+            blob = bucket.blob(preview_path)
+            blob.cache_control = PREVIEW_CACHE_CONTROL
+            blob.upload_from_filename(output, content_type="video/mp4")
+            blob.make_public()  # 公開アクセスを許可
+
+            preview["url"] = f"gs://{bucket_name}/{preview_path}"
+            preview["bitrate_kbps"] = round(preview["bytes"] * 8 / 1000 / preview["duration"]) if preview["duration"] else 0
+            # 元の動画全体に対するサイズ比（プレビューは先頭のみの場合がある）
+            preview["compression_ratio"] = round(source_bytes / preview["bytes"], 1) if preview["bytes"] else 0
+
+            if is_animated_webp_enabled() and (deadline is None or time.monotonic() < deadline - PREVIEW_FINALIZE_SEC):
+                # 先頭数秒だけを使うため、元の動画ではなく変換後のプレビューから作る
+                webp_output = os.path.join(tmp_dir, "loop.webp")
+                loop = render_webp_loop(output, webp_output)
+                if loop["frames"]:
+                    webp_path = get_preview_path(video_path, "loop", "webp")
+                    webp_blob = bucket.blob(webp_path)
+                    webp_blob.cache_control = PREVIEW_CACHE_CONTROL
+                    webp_blob.upload_from_filename(webp_output, content_type="image/webp")
+                    webp_blob.make_public()
+                    preview["webp_url"] = f"gs://{bucket_name}/{webp_path}"
+                    preview["webp_bytes"] = loop["bytes"]
+                    logger.info(f"Animated WebP loop: {loop['frames']} frames, {loop['bytes']}B in {loop['transcode_sec']}s")
+
+        logger.info(
+            f"Preview transcoded in {preview['transcode_sec']}s: {preview['width']}x{preview['height']} "
+            f"{preview['duration']}s {preview['bitrate_kbps']}kbps, {source_bytes}B -> {preview['bytes']}B "
+            f"({preview['compression_ratio']}x): {video_url}"
+        )
+        return {"media_uri": video_url, "preview": preview}
+
+    except Exception as e:
+        logger.error(f"Error generating video preview for {video_path}: {str(e)}")
+        return None
+
+
+def save_video_preview(db, result: Dict[str, Any]) -> int:
+    """
+    プレビュー情報をmedia_renditionsに保存し、既存のanalysis_resultsにも反映する
+
+    Returns:
+        更新したanalysis_resultsの件数
+    """
+    return save_media_renditions(db, result["media_uri"], {"video_preview": result["preview"]})
@@ -0,0 +1,423 @@
+"""
+Video download for thumbnailing
+
+動画をCloud Storageクライアントでチャンク単位にストリーミング取得し、一時ファイルに書き出す
+MP4/MOVでオブジェクトが大きい場合は、インデックス（moov）と候補フレーム付近のバイト範囲だけを
+取得したスパースファイルを作る。一時ファイルはコンテキストを抜けると必ず削除される
+
+環境変数:
+    THUMBNAIL_DOWNLOAD_CHUNK_MB: ストリーミング取得のチャンクサイズ（MB、既定 8）
+    THUMBNAIL_MAX_DISK_MB: 一時ファイルに書き込む上限（MB、既定 512）
+    THUMBNAIL_RANGED_MIN_MB: 範囲取得を試みるオブジェクトサイズの下限（MB、既定 32）
+"""
+import bisect
+import logging
+import os
+import resource
+import struct
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+from google.cloud import storage
+
+logger = logging.getLogger(__name__)
+
+# 近いバイト範囲はまとめて1回のリクエストで取得する
+RANGE_MERGE_GAP = 1024 * 1024
+# 範囲取得の合計がオブジェクトのこの割合を超える場合は全体を取得する
+RANGED_MAX_RATIO = 0.6
+# シーク時にデコーダが戻る可能性のあるフレーム数（余裕を持たせる）
+SEEK_MARGIN_FRAMES = 32
+# Bフレームの並べ替えに備えて目的フレームの後ろに含めるサンプル数
+REORDER_MARGIN_SAMPLES = 8
+# ストリーム情報の解析用に先頭から含めるサンプル数
+PROBE_SAMPLES = 16
+
+
+class VideoDownloadError(Exception):
+    """動画の取得に失敗した、または上限を超えた"""
+
+
+def parse_storage_url(url: str) -> Optional[Tuple[str, str]]:
+    """
+    gs:// / storage.googleapis.com / Firebase StorageのURLから (bucket, object_path) を取得
+
+    Returns:
+        (bucket, object_path)、Cloud StorageのURLでない場合はNone
+    """
+    if url.startswith('gs://'):
+        parts = url[5:].split('/', 1)
+        return (parts[0], parts[1]) if len(parts) == 2 else None
+
+    parsed = urllib.parse.urlparse(url)
+    if parsed.hostname == 'storage.googleapis.com':
+        parts = parsed.path.lstrip('/').split('/', 1)
+        return (parts[0], urllib.parse.unquote(parts[1])) if len(parts) == 2 else None
+
+    if parsed.hostname and 'firebasestorage' in parsed.hostname and '/o/' in parsed.path:
+        if parsed.hostname == 'firebasestorage.googleapis.com':
+            # /v0/b/<bucket>/o/<object>
+            bucket_name = parsed.path.split('/')[3]
+        else:
+            bucket_name = parsed.hostname
+        object_path = urllib.parse.unquote(parsed.path.split('/o/', 1)[1])
+        return bucket_name, object_path
+
+    return None
+
+
+def _peak_rss_mb() -> float:
+    # LinuxではKB単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _read_atom_header(data: bytes, offset: int, end: int) -> Optional[Tuple[int, bytes, int]]:
+    """data[offset:end] の先頭にあるatomの (size, type, header size) を返す"""
+    if offset + 8 > end:
+        return None
+    size, atom_type = struct.unpack('>I4s', data[offset:offset + 8])
+    header_size = 8
+    if size == 1:
+        if offset + 16 > end:
+            return None
+        size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+        header_size = 16
+    elif size == 0:
+        size = end - offset
+    return size, atom_type, header_size
+
+
+class Mp4VideoIndex:
+    """moovから映像トラックのサンプル位置・時刻・キーフレームを読み出す"""
+
+    def __init__(self, moov: bytes):
+        self.timescale = 0
+        self.sample_times: List[int] = []
+        self.sample_offsets: List[int] = []
+        self.sample_sizes: List[int] = []
+        self.sync_samples: Optional[List[int]] = None  # 0始まり、Noneなら全サンプルがキーフレーム
+        self._parse_moov(moov)
+        if not self.sample_offsets or self.timescale <= 0:
+            raise ValueError("No video track found in moov")
+
+    def _children(self, data: bytes, start: int, end: int):
+        offset = start
+        while offset < end:
+            header = _read_atom_header(data, offset, end)
+            if header is None:
+                break
+            size, atom_type, header_size = header
+            if size < header_size:
+                break
+            yield atom_type, offset + header_size, offset + size
+            offset += size
+
+    def _find(self, data: bytes, start: int, end: int, path: List[bytes]) -> Optional[Tuple[int, int]]:
+        for atom_type, body_start, body_end in self._children(data, start, end):
+            if atom_type == path[0]:
+                if len(path) == 1:
+                    return body_start, body_end
+                return self._find(data, body_start, body_end, path[1:])
+        return None
+
+    def _parse_moov(self, moov: bytes) -> None:
+        moov_body = self._find(moov, 0, len(moov), [b'moov'])
+        if moov_body is None:
+            return
+        for atom_type, trak_start, trak_end in self._children(moov, *moov_body):
+            if atom_type != b'trak':
+                continue
+            hdlr = self._find(moov, trak_start, trak_end, [b'mdia', b'hdlr'])
+            if hdlr is None or moov[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+                continue
+            self._parse_video_trak(moov, trak_start, trak_end)
+            return
+
+    def _parse_video_trak(self, data: bytes, start: int, end: int) -> None:
+        mdhd = self._find(data, start, end, [b'mdia', b'mdhd'])
+        stbl = self._find(data, start, end, [b'mdia', b'minf', b'stbl'])
+        if mdhd is None or stbl is None:
+            return
+        version = data[mdhd[0]]
+        timescale_offset = mdhd[0] + (20 if version == 1 else 12)
+        self.timescale = struct.unpack('>I', data[timescale_offset:timescale_offset + 4])[0]
+
+        tables = {atom_type: (body_start, body_end) for atom_type, body_start, body_end in self._children(data, *stbl)}
+
+        def entries(atom_type: bytes, fmt: str, header: int = 8):
+            body = tables.get(atom_type)
+            if body is None:
+                return None
+            count = struct.unpack('>I', data[body[0] + 4:body[0] + 8])[0]
+            item_size = struct.calcsize('>' + fmt)
+            payload = data[body[0] + header:body[0] + header + count * item_size]
+            return list(struct.iter_unpack('>' + fmt, payload))
+
+        # デコード時刻
+        last_delta = 0
+        for count, delta in entries(b'stts', 'II') or []:
+            base = self.sample_times[-1] + last_delta if self.sample_times else 0
+            self.sample_times.extend(base + delta * i for i in range(count))
+            last_delta = delta
+
+        # サンプルサイズ
+        stsz = tables.get(b'stsz')
+        if stsz is None:
+            return
+        uniform_size, sample_count = struct.unpack('>II', data[stsz[0] + 4:stsz[0] + 12])
+        if uniform_size:
+            self.sample_sizes = [uniform_size] * sample_count
+        else:
+            payload = data[stsz[0] + 12:stsz[0] + 12 + sample_count * 4]
+            self.sample_sizes = [size for (size,) in struct.iter_unpack('>I', payload)]
+
+        # チャンクのオフセットとチャンク内のサンプル数からサンプル位置を計算
+        chunk_offsets = [o for (o,) in (entries(b'stco', 'I') or entries(b'co64', 'Q') or [])]
+        stsc = entries(b'stsc', 'III') or []
+        sample_index = 0
+        for i, (first_chunk, samples_per_chunk, _) in enumerate(stsc):
+            last_chunk = stsc[i + 1][0] - 1 if i + 1 < len(stsc) else len(chunk_offsets)
+            for chunk in range(first_chunk - 1, last_chunk):
+                offset = chunk_offsets[chunk]
+                for _ in range(samples_per_chunk):
+                    if sample_index >= sample_count:
+                        break
+                    self.sample_offsets.append(offset)
+                    offset += self.sample_sizes[sample_index]
+                    sample_index += 1
+
+        stss = entries(b'stss', 'I')
+        if stss is not None:
+            self.sync_samples = [number - 1 for (number,) in stss]
+
+        sample_count = min(len(self.sample_offsets), len(self.sample_times), len(self.sample_sizes))
+        self.sample_offsets = self.sample_offsets[:sample_count]
+        self.sample_times = self.sample_times[:sample_count]
+        self.sample_sizes = self.sample_sizes[:sample_count]
+
+    @property
+    def duration(self) -> float:
+        return self.sample_times[-1] / self.timescale if self.sample_times else 0.0
+
+    @property
+    def fps(self) -> float:
+        return len(self.sample_times) / self.duration if self.duration > 0 else 0.0
+
+    def sample_at(self, timestamp: float) -> int:
+        index = bisect.bisect_right(self.sample_times, timestamp * self.timescale) - 1
+        return max(0, min(index, len(self.sample_times) - 1))
+
+    def keyframe_before(self, index: int) -> int:
+        if self.sync_samples is None:
+            return index
+        position = bisect.bisect_right(self.sync_samples, index) - 1
+        return self.sync_samples[position] if position >= 0 else 0
+
+    def byte_range(self, first: int, last: int) -> Tuple[int, int]:
+        """サンプル first〜last を含むバイト範囲 [start, end)"""
+        first = max(0, first)
+        last = min(last, len(self.sample_offsets) - 1)
+        start = min(self.sample_offsets[first:last + 1])
+        end = max(o + s for o, s in zip(self.sample_offsets[first:last + 1], self.sample_sizes[first:last + 1]))
+        return start, end
+
+    def ranges_for_timestamps(self, timestamps: List[float], max_grab_distance: int) -> List[Tuple[int, int]]:
+        """
+        候補タイムスタンプのデコードに必要なバイト範囲
+
+        FrameSamplerと同じく、近い位置は前の候補から読み進め、遠い位置はキーフレームからデコードする
+        """
+        ranges = [self.byte_range(0, PROBE_SAMPLES)]
+        # FrameSamplerはfps×秒でフレーム番号を決めるため同じ計算で対象を求める
+        fps = self.fps
+        position = 0
+        duration = self.duration
+        # FrameSamplerと同様、動画の長さを超える位置は中央に置き換える
+        timestamps = [ts if ts <= duration else duration * 0.5 for ts in timestamps]
+        for frame_number in sorted(int(fps * ts) for ts in timestamps):
+            frame_number = min(frame_number, len(self.sample_offsets) - 1)
+            distance = frame_number - position
+            if 0 <= distance <= max_grab_distance:
+                first = position
+            else:
+                first = self.keyframe_before(max(0, frame_number - SEEK_MARGIN_FRAMES))
+            ranges.append(self.byte_range(first, frame_number + REORDER_MARGIN_SAMPLES))
+            position = frame_number + 1
+        return ranges
+
+
+def merge_ranges(ranges: List[Tuple[int, int]], gap: int = RANGE_MERGE_GAP) -> List[Tuple[int, int]]:
+    """重なる・近接するバイト範囲 [start, end) をまとめる"""
+    merged: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+class VideoDownload:
+    """
+    動画を一時ファイルに取得するコンテキストマネージャ
+
+    使い方:
+        with VideoDownload(video_url, timestamps_fn) as download:
+            with FrameSampler(download.path) as sampler:
+                ...
+            logger.info(download.stats)
+
+    timestamps_fn(duration, fps) を渡すと、MP4/MOVの大きなオブジェクトでは
+    返された読み取り位置に必要な範囲だけを取得する
+    """
+
+    def __init__(self, video_url: str, timestamps_fn=None, max_grab_distance: int = 90):
+        self.video_url = video_url
+        self.timestamps_fn = timestamps_fn
+        self.max_grab_distance = max_grab_distance
+        self.chunk_size = max(1, int(os.getenv("THUMBNAIL_DOWNLOAD_CHUNK_MB", "8"))) * 1024 * 1024
+        self.max_disk_bytes = int(float(os.getenv("THUMBNAIL_MAX_DISK_MB", "512")) * 1024 * 1024)
+        self.ranged_min_bytes = int(float(os.getenv("THUMBNAIL_RANGED_MIN_MB", "32")) * 1024 * 1024)
+        self.path: Optional[str] = None
+        self.stats: Dict[str, object] = {}
+        self._tmp_dir: Optional[tempfile.TemporaryDirectory] = None
+        self._blob = None
+
+    def __enter__(self):
+        self._tmp_dir = tempfile.TemporaryDirectory(prefix='thumb_')
+        try:
+            _, ext = os.path.splitext(urllib.parse.urlparse(self.video_url).path)
+            self.path = os.path.join(self._tmp_dir.name, f"video{ext.lower() or '.mov'}")
+            started = time.monotonic()
+            self._download()
+            self.stats['elapsed_sec'] = round(time.monotonic() - started, 3)
+            self.stats['temp_disk_bytes'] = os.stat(self.path).st_blocks * 512
+            self.stats['peak_rss_mb'] = round(_peak_rss_mb(), 1)
+            logger.info(f"Video download stats: {self.stats}")
+            return self
+        except BaseException:
+            self._cleanup()
+            raise
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cleanup()
+        return False
+
+    def _cleanup(self) -> None:
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+            self._tmp_dir = None
+
+    def fetch_full(self) -> None:
+        """範囲取得したファイルで候補が読めなかった場合などに全体を取得し直す"""
+        if self._blob is not None:
+            self._download_blob_full()
+        else:
+            self._download_http()
+
+    # ---------- 取得方法 ----------
+
+    def _download(self) -> None:
+        location = parse_storage_url(self.video_url)
+        if location is None:
+            self._download_http()
+            return
+
+        bucket_name, object_path = location
+        client = storage.Client()
+        self._blob = client.bucket(bucket_name).blob(object_path, chunk_size=self.chunk_size)
+        self._blob.reload()
+        size = self._blob.size or 0
+        self.stats.update({'object_bytes': size, 'chunk_bytes': self.chunk_size})
+
+        if self.timestamps_fn is not None and size >= self.ranged_min_bytes:
+            try:
+                if self._download_ranged(size):
+                    return
+            except Exception as e:
+                logger.warning(f"Ranged download failed, falling back to full download: {e}")
+
+        self._download_blob_full()
+
+    def _check_disk_budget(self, size: int) -> None:
+        if size > self.max_disk_bytes:
+            raise VideoDownloadError(
+                f"Video needs {size} bytes on disk, over THUMBNAIL_MAX_DISK_MB ({self.max_disk_bytes} bytes)"
+            )
+
+    def _download_blob_full(self) -> None:
+        self._check_disk_budget(self.stats.get('object_bytes', 0))
+        with open(self.path, 'wb') as f:
+            self._blob.download_to_file(f)
+        self.stats.update({'mode': 'full', 'downloaded_bytes': os.path.getsize(self.path), 'ranges': 1})
+
+    def _download_http(self) -> None:
+        downloaded = 0
+        with urllib.request.urlopen(self.video_url) as response, open(self.path, 'wb') as f:
+            while True:
+                chunk = response.read(self.chunk_size)
+                if not chunk:
+                    break
+                downloaded += len(chunk)
+                self._check_disk_budget(downloaded)
+                f.write(chunk)
+        self.stats.update({'mode': 'http', 'downloaded_bytes': downloaded, 'chunk_bytes': self.chunk_size})
+
+    def _read_range(self, start: int, end: int) -> bytes:
+        """[start, end) をメモリに読み込む（atomヘッダやmoovなど小さい範囲用）"""
+        return self._blob.download_as_bytes(start=start, end=end - 1)
+
+    def _download_ranged(self, size: int) -> bool:
+        # トップレベルのatomを走査し、moovとmdatの位置を求める
+        atoms = []
+        offset = 0
+        while offset < size:
+            header = self._read_range(offset, min(offset + 16, size))
+            if len(header) < 8:
+                return False
+            atom_size, atom_type = struct.unpack('>I4s', header[:8])
+            header_size = 8
+            if atom_size == 1 and len(header) == 16:
+                atom_size = struct.unpack('>Q', header[8:16])[0]
+                header_size = 16
+            elif atom_size == 0:
+                # サイズ0はファイル末尾まで
+                atom_size = size - offset
+            if atom_size < header_size:
+                return False
+            atoms.append((atom_type, offset, offset + atom_size, header_size))
+            offset += atom_size
+
+        moov = next(((start, end) for atom_type, start, end, _ in atoms if atom_type == b'moov'), None)
+        if moov is None:
+            return False
+
+        index = Mp4VideoIndex(self._read_range(*moov))
+        timestamps = self.timestamps_fn(index.duration, index.fps)
+
+        # mdat以外のatomは全体、mdatはヘッダと必要なサンプル範囲のみ
+        ranges = []
+        for atom_type, start, end, header_size in atoms:
+            ranges.append((start, start + header_size) if atom_type == b'mdat' else (start, end))
+        ranges.extend(index.ranges_for_timestamps(timestamps, self.max_grab_distance))
+        ranges = merge_ranges(ranges)
+
+        planned = sum(end - start for start, end in ranges)
+        if planned > size * RANGED_MAX_RATIO:
+            logger.info(f"Ranged download would fetch {planned}/{size} bytes, using full download")
+            return False
+        self._check_disk_budget(planned)
+
+        # オブジェクトと同じサイズのスパースファイルに必要な範囲だけを書き込む
+        with open(self.path, 'wb') as f:
+            f.truncate(size)
+            for start, end in ranges:
+                f.seek(start)
+                self._blob.download_to_file(f, start=start, end=end - 1)
+
+        self.stats.update({'mode': 'ranged', 'downloaded_bytes': planned, 'ranges': len(ranges)})
+        return True
+
@@ -1,10 +1,12 @@
 """
 Video thumbnail generation module for Cloud Functions
 """
+import io
+import json
 import os
-import tempfile
 import logging
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 from google.cloud import storage
 from PIL import Image
 import cv2
@@ -12,8 +14,35 @@ import numpy as np
 from datetime import datetime
 import uuid
 
+from frame_pool import select_best_frame
+from frame_scorer import get_frame_scorer
+from scene_scan import get_frame_budget, is_scene_scan_enabled, plan_scan_timestamps, select_scene_candidates
+from video_source import VideoDownload
+
 logger = logging.getLogger(__name__)
 
+# サムネイルのレンディション: 幅 -> 収める最大サイズ（幅, 高さ）
+THUMBNAIL_RENDITION_SIZES = {
+    160: (160, 120),
+    400: (400, 300),
+    800: (800, 600),
+}
+# フォーマット -> (拡張子, Content-Type, PILの保存オプション)
+THUMBNAIL_RENDITION_FORMATS = {
+    'jpeg': ('jpg', 'image/jpeg', {'quality': 85, 'optimize': True}),
+    'webp': ('webp', 'image/webp', {'quality': 80, 'method': 4}),
+}
+# クライアント・CDNでのサムネイルのキャッシュ期間
+THUMBNAIL_CACHE_CONTROL = 'public, max-age=86400'
+# コーデックタグ -> コーデック名
+VIDEO_CODEC_NAMES = {
+    'avc1': 'h264', 'avc3': 'h264', 'h264': 'h264',
+    'hvc1': 'hevc', 'hev1': 'hevc', 'hevc': 'hevc',
+    'mp4v': 'mpeg4', 'fmp4': 'mpeg4', 'vp09': 'vp9', 'av01': 'av1',
+}
+# シーン走査で品質評価に回す候補フレーム数
+SCENE_CANDIDATES = 5
+
 
 def is_video_file(file_path: str) -> bool:
     """
@@ -42,35 +71,7 @@ def calculate_frame_quality(frame: np.ndarray) -> float:
     Returns:
         品質スコア（0.0〜1.0）
     """
-    score = 0.0
-    
-    # 1. 明るさチェック（暗すぎず明るすぎない）
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    brightness = np.mean(gray)
-    # 理想的な明るさは128前後
-    brightness_score = 1.0 - abs(brightness - 128) / 128
-    score += brightness_score * 0.3
-    
-    # 2. コントラストチェック
-    contrast = np.std(gray)
-    # コントラストは高い方が良い（最大255）
-    contrast_score = min(contrast / 80, 1.0)
-    score += contrast_score * 0.3
-    
-    # 3. シャープネス（ブレの検出）
-    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-    sharpness = np.var(laplacian)
-    # シャープネススコア（経験的な値）
-    sharpness_score = min(sharpness / 1000, 1.0)
-    score += sharpness_score * 0.2
-    
-    # 4. 顔検出ボーナス
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-    if len(faces) > 0:
-        score += 0.2
-    
-    return min(score, 1.0)
+    return get_frame_scorer().score(frame)
 
 
 def extract_frame_at_timestamp(video_path: str, timestamp: float) -> Tuple[Optional[np.ndarray], dict]:
@@ -112,6 +113,399 @@ def extract_frame_at_timestamp(video_path: str, timestamp: float) -> Tuple[Optio
         return None, {}
 
 
+class FrameSampler:
+    """
+    動画を1度だけ開き、複数の候補位置のフレームを先頭から順に取得する
+
+    近い位置へはgrab()で読み進め、目的のフレームだけretrieve()でデコードする。
+    離れた位置へはシークする。
+
+    使い方:
+        with FrameSampler(video_path) as sampler:
+            info = sampler.info
+            candidates = sampler.sample([1.0, 2.5, 4.0])
+    """
+
+    # このフレーム数以内の前方移動はシークせずgrab()で読み進める
+    MAX_GRAB_DISTANCE = 90
+    # シーク1回あたりのデコードコストの見積もり（キーフレームから目的位置までの平均フレーム数）
+    SEEK_COST_FRAMES = 15
+
+    def __init__(self, video_path: str):
+        self.video_path = video_path
+        self.cap = None
+        self.info = {}
+        self.metadata = {}
+        self.position = 0  # 次にgrab()で読まれるフレーム番号
+        self.grabbed_frames = 0
+        self.decoded_frames = 0
+        self.seeks = 0
+
+    def __enter__(self):
+        self.cap = cv2.VideoCapture(self.video_path)
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.info = {
+            'fps': fps,
+            'total_frames': total_frames,
+            'duration': total_frames / fps if fps > 0 else 0,
+        }
+        # 保存用のメタデータ（開いたキャプチャから1度だけ取得する）
+        self.metadata = extract_video_metadata(self.cap)
+        self.info['width'] = self.metadata.get('width', 0)
+        self.info['height'] = self.metadata.get('height', 0)
+        self.position = 0
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+        return False
+
+    @property
+    def decode_cost(self) -> int:
+        """これまでのデコードコスト（フレーム数換算、シークは SEEK_COST_FRAMES として数える）"""
+        return self.grabbed_frames + self.decoded_frames + self.seeks * self.SEEK_COST_FRAMES
+
+    def read_frame(self, frame_number: int, max_grab_distance: Optional[int] = None) -> Optional[np.ndarray]:
+        """
+        指定フレームを取得する（近ければgrab()で読み進め、遠ければシーク）
+
+        Args:
+            frame_number: フレーム番号
+            max_grab_distance: シークせずに読み進める最大フレーム数（既定は MAX_GRAB_DISTANCE）
+
+        Returns:
+            フレーム（BGR形式）、取得できなかった場合はNone
+        """
+        if max_grab_distance is None:
+            max_grab_distance = self.MAX_GRAB_DISTANCE
+
+        distance = frame_number - self.position
+        if distance < 0 or distance > max_grab_distance:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+            self.seeks += 1
+            self.position = frame_number
+        while self.position < frame_number:
+            if not self.cap.grab():
+                return None
+            self.grabbed_frames += 1
+            self.position += 1
+
+        if not self.cap.grab():
+            return None
+        self.position += 1
+        ret, frame = self.cap.retrieve()
+        if not ret:
+            return None
+        self.decoded_frames += 1
+        return frame
+
+    def frame_number_at(self, timestamp: float) -> int:
+        """タイムスタンプ（秒）に対応するフレーム番号"""
+        fps = self.info.get('fps', 0)
+        total_frames = self.info.get('total_frames', 0)
+        return min(int(fps * timestamp), max(total_frames - 1, 0))
+
+    def sample(
+        self, timestamps: List[float], max_grab_distance: Optional[int] = None
+    ) -> List[Tuple[np.ndarray, dict]]:
+        """
+        指定タイムスタンプのフレームを取得する
+
+        Args:
+            timestamps: 候補タイムスタンプ（秒）。順不同で可
+            max_grab_distance: シークせずに読み進める最大フレーム数（既定は MAX_GRAB_DISTANCE）
+
+        Returns:
+            (frame, metadata) のリスト（時刻順、取得できなかった位置は含まない）
+        """
+        fps = self.info.get('fps', 0)
+        duration = self.info.get('duration', 0)
+        total_frames = self.info.get('total_frames', 0)
+        if not self.cap or fps <= 0:
+            return []
+
+        targets = []
+        for ts in timestamps:
+            # タイムスタンプが動画の長さを超えている場合は調整
+            if ts > duration:
+                ts = duration * 0.5
+            targets.append((self.frame_number_at(ts), ts))
+        targets.sort()
+
+        results = []
+        last_frame_number = None
+        last_frame = None
+        for frame_number, ts in targets:
+            if frame_number == last_frame_number and last_frame is not None:
+                frame = last_frame
+            else:
+                frame = self.read_frame(frame_number, max_grab_distance)
+                if frame is None:
+                    continue
+                last_frame_number, last_frame = frame_number, frame
+
+            results.append((frame, {
+                'timestamp': ts,
+                'frame_number': frame_number,
+                'total_frames': total_frames,
+                'duration': duration
+            }))
+
+        return results
+
+
+def get_candidate_timestamps(duration: float, time_offset: Optional[float] = None) -> List[float]:
+    """
+    サムネイル候補のタイムスタンプを動画の長さに応じて生成
+
+    Args:
+        duration: 動画の長さ（秒）
+        time_offset: 指定されている場合はその位置のみ
+
+    Returns:
+        候補タイムスタンプ（秒）のリスト
+    """
+    if time_offset is not None:
+        # time_offsetが指定されている場合は単一フレーム抽出
+        return [time_offset]
+    if duration <= 2:
+        # 短い動画の場合
+        return [0.5, 1.0]
+    if duration <= 5:
+        # 5秒以下の動画
+        return [0.5, 1.0, 2.0, duration * 0.7]
+    # 長い動画の場合は20%, 30%, 40%, 50%, 60%の位置をサンプリング
+    return [
+        duration * 0.2,
+        duration * 0.3,
+        duration * 0.4,
+        duration * 0.5,
+        duration * 0.6
+    ]
+
+
+def select_thumbnail_frame(video_url: str, time_offset: float = None) -> Optional[np.ndarray]:
+    """
+    動画からサムネイルに使うフレームを選択する
+    複数のタイムスタンプから品質スコアが最も高いフレームを選ぶ
+
+    Args:
+        video_url: 動画ファイルのURL（gs://またはhttps://）
+        time_offset: フレームを取得する時間位置（秒）、Noneの場合は自動選択
+
+    Returns:
+        選択したフレーム（BGR形式）、失敗時はNone
+    """
+    return select_thumbnail_frame_with_metadata(video_url, time_offset)[0]
+
+
+def select_thumbnail_frame_with_metadata(
+    video_url: str,
+    time_offset: float = None,
+) -> Tuple[Optional[np.ndarray], Dict[str, Any]]:
+    """
+    サムネイルに使うフレームを選択し、同じキャプチャから動画のメタデータも取得する
+
+    Args:
+        video_url: 動画ファイルのURL（gs://またはhttps://）
+        time_offset: フレームを取得する時間位置（秒）、Noneの場合は自動選択
+
+    Returns:
+        (選択したフレーム（BGR形式）、失敗時はNone, extract_video_metadataと同じ形式のメタデータ)
+    """
+    video_metadata: Dict[str, Any] = {}
+    # 自動選択モードでは全体を低解像度で走査し、シーン区間から候補を選ぶ
+    scene_scan = time_offset is None and is_scene_scan_enabled()
+    frame_budget = get_frame_budget()
+
+    def plan_timestamps(duration: float, fps: float) -> List[float]:
+        if scene_scan:
+            scan_timestamps = plan_scan_timestamps(
+                duration, fps, frame_budget, SCENE_CANDIDATES, FrameSampler.SEEK_COST_FRAMES
+            )
+            if scan_timestamps:
+                return scan_timestamps
+        return get_candidate_timestamps(duration, time_offset)
+
+    def sample_candidates(download: VideoDownload) -> Tuple[float, List[float], Optional[np.ndarray], List[Tuple[dict, float]]]:
+        # 動画を1度だけ開き、長さの取得・走査を行う
+        # 候補フレームのデコードと品質評価は、複数のvCPUがあればプロセスプールで並列に行う
+        with FrameSampler(download.path) as sampler:
+            video_metadata.update(sampler.metadata)
+            duration = sampler.info['duration']
+            if duration <= 0:
+                return duration, [], None, []
+            if scene_scan:
+                report = select_scene_candidates(sampler, SCENE_CANDIDATES, frame_budget)
+                if report['timestamps']:
+                    best_frame, scored = select_best_frame(
+                        sampler, report['timestamps'], max_grab_distance=FrameSampler.SEEK_COST_FRAMES
+                    )
+                    logger.info(
+                        f"Scene scan: {report['scan_points']} points, {report['cuts']} cuts, "
+                        f"{report['face_segments']} segments with faces, decode cost "
+                        f"{report['decode_cost']}/{frame_budget} frames: {video_url}"
+                    )
+                    return duration, report['timestamps'], best_frame, scored
+                logger.info(f"Scene scan found no candidates, using fixed positions: {video_url}")
+            timestamps = get_candidate_timestamps(duration, time_offset)
+            return (duration, timestamps) + select_best_frame(sampler, timestamps)
+
+    # 動画をストリーミング取得（大きなMP4/MOVは走査・候補位置に必要な範囲のみ）
+    # 一時ファイルはwithを抜けると成功・失敗に関わらず削除される
+    with VideoDownload(
+        video_url,
+        timestamps_fn=plan_timestamps,
+        max_grab_distance=FrameSampler.SEEK_COST_FRAMES if scene_scan else FrameSampler.MAX_GRAB_DISTANCE,
+    ) as download:
+        duration, timestamps, best_frame, scored = sample_candidates(download)
+
+        if download.stats.get('mode') == 'ranged' and len(scored) < len(set(timestamps)):
+            # 範囲取得で読めない候補があった場合は全体を取得してやり直す
+            logger.warning(f"Ranged download missed candidate frames, fetching full video: {video_url}")
+            download.fetch_full()
+            duration, timestamps, best_frame, scored = sample_candidates(download)
+
+    if duration == 0:
+        logger.error(f"Failed to get video duration: {video_url}")
+        return None, video_metadata
+
+    if best_frame is None:
+        if time_offset is not None:
+            logger.error(f"Failed to extract frame at {time_offset}s from video: {video_url}")
+        else:
+            logger.error(f"Failed to extract any frame from video: {video_url}")
+        return None, video_metadata
+
+    # 各候補フレームの品質スコア
+    for metadata, score in scored:
+        logger.info(f"Frame at {metadata['timestamp']:.1f}s: quality score = {score:.3f}")
+    best_timestamp, best_score = max(((m['timestamp'], score) for m, score in scored), key=lambda item: item[1])
+    logger.info(f"Selected best frame at {best_timestamp:.1f}s with score {best_score:.3f}")
+    return best_frame, video_metadata
+
+
+def render_thumbnail_renditions(frame: np.ndarray) -> Dict[Tuple[int, str], bytes]:
+    """
+    選択したフレームから全サイズ・全フォーマットのサムネイルを1回の処理でエンコード
+    大きいサイズから順に縮小し、小さいサイズは直前のサイズから縮小する
+
+    Args:
+        frame: OpenCVのフレーム（BGR形式）
+
+    Returns:
+        (幅, フォーマット) -> エンコード済みバイト列
+    """
+    # BGRからRGBに変換してPILイメージに変換
+    image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+    encoded = {}
+    for width in sorted(THUMBNAIL_RENDITION_SIZES, reverse=True):
+        # サムネイルサイズにリサイズ（アスペクト比を維持）
+        image.thumbnail(THUMBNAIL_RENDITION_SIZES[width], Image.Resampling.LANCZOS)
+        for fmt, (_, _, save_options) in THUMBNAIL_RENDITION_FORMATS.items():
+            buffer = io.BytesIO()
+            image.save(buffer, fmt.upper(), **save_options)
+            encoded[(width, fmt)] = buffer.getvalue()
+    return encoded
+
+
+def upload_thumbnail_renditions(
+    bucket_name: str,
+    output_path: str,
+    encoded: Dict[Tuple[int, str], bytes],
+    video_metadata: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    サムネイルのレンディションをCloud Storageにアップロード
+
+    最大サイズのJPEGは従来のサムネイルパス（output_path）にも保存する。
+    従来パスは最後にアップロードするため、存在すれば全レンディションが揃っている
+    video_metadataは従来パスのカスタムメタデータに保存し、生成済みのサムネイルを再利用する際に読み出す
+
+    Returns:
+        get_thumbnail_renditionsと同じ形式のレンディション一覧
+    """
+    client = storage.Client()
+    bucket = client.bucket(bucket_name)
+
+    def upload(path: str, data: bytes, content_type: str, metadata: Optional[Dict[str, str]] = None) -> None:
+        blob = bucket.blob(path)
+        blob.cache_control = THUMBNAIL_CACHE_CONTROL
+        if metadata:
+            blob.metadata = metadata
+        blob.upload_from_string(data, content_type=content_type)
+        blob.make_public()  # 公開アクセスを許可
+
+    with ThreadPoolExecutor(max_workers=len(encoded)) as executor:
+        futures = [
+            executor.submit(
+                upload,
+                get_rendition_path(output_path, width, fmt),
+                data,
+                THUMBNAIL_RENDITION_FORMATS[fmt][1],
+            )
+            for (width, fmt), data in encoded.items()
+        ]
+        for future in futures:
+            future.result()
+
+    largest = max(THUMBNAIL_RENDITION_SIZES)
+    upload(
+        output_path,
+        encoded[(largest, 'jpeg')],
+        'image/jpeg',
+        {'video_metadata': json.dumps(video_metadata)} if video_metadata else None,
+    )
+
+    return get_thumbnail_renditions(bucket_name, output_path)
+
+
+def generate_video_thumbnail_renditions(
+    video_url: str,
+    bucket_name: str,
+    output_path: str,
+    time_offset: float = None
+) -> Optional[Dict[str, Any]]:
+    """
+    動画ファイルからサイズ・フォーマット別のサムネイルを生成してCloud Storageに保存
+
+    Args:
+        video_url: 動画ファイルのURL（gs://またはhttps://）
+        bucket_name: 保存先のバケット名
+        output_path: 従来のサムネイルの保存先パス（例: thumbnails/xxx_thumb.jpg）
+        time_offset: サムネイルを生成する時間位置（秒）、Noneの場合は自動選択
+
+    Returns:
+        {"thumbnail_url": 従来パスのgs:// URL, "renditions": レンディション一覧,
+         "video_metadata": 動画のメタデータ}、失敗時はNone
+    """
+    try:
+        frame, video_metadata = select_thumbnail_frame_with_metadata(video_url, time_offset)
+        if frame is None:
+            return None
+
+        encoded = render_thumbnail_renditions(frame)
+        logger.info(
+            "Encoded thumbnail renditions: "
+            + ", ".join(f"{width}px {fmt} {len(data)}B" for (width, fmt), data in sorted(encoded.items()))
+        )
+        renditions = upload_thumbnail_renditions(bucket_name, output_path, encoded, video_metadata)
+
+        return {
+            "thumbnail_url": f"gs://{bucket_name}/{output_path}",
+            "renditions": renditions,
+            "video_metadata": video_metadata,
+        }
+
+    except Exception as e:
+        logger.error(f"Error generating video thumbnail: {str(e)}")
+        return None
+
+
 def generate_video_thumbnail(
     video_url: str,
     bucket_name: str,
@@ -131,113 +525,8 @@ def generate_video_thumbnail(
     Returns:
         生成されたサムネイルのgs:// URL、失敗時はNone
     """
-    try:
-        # 一時ファイルとして動画をダウンロード
-        with tempfile.NamedTemporaryFile(suffix='.mov', delete=False) as tmp_video:
-            # gs:// URLをHTTPS URLに変換
-            if video_url.startswith('gs://'):
-                https_url = convert_gs_to_https(video_url)
-            else:
-                https_url = video_url
-            
-            # 動画をダウンロード
-            import urllib.request
-            urllib.request.urlretrieve(https_url, tmp_video.name)
-            
-            # 動画の長さを取得
-            cap = cv2.VideoCapture(tmp_video.name)
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            duration = total_frames / fps if fps > 0 else 0
-            cap.release()
-            
-            if duration == 0:
-                logger.error(f"Failed to get video duration: {video_url}")
-                return None
-            
-            # time_offsetが指定されていない場合は複数の候補から選択
-            if time_offset is None:
-                # 動画の長さに応じて候補タイムスタンプを生成
-                if duration <= 2:
-                    # 短い動画の場合
-                    timestamps = [0.5, 1.0]
-                elif duration <= 5:
-                    # 5秒以下の動画
-                    timestamps = [0.5, 1.0, 2.0, duration * 0.7]
-                else:
-                    # 長い動画の場合は20%, 30%, 40%, 50%, 60%の位置をサンプリング
-                    timestamps = [
-                        duration * 0.2,
-                        duration * 0.3,
-                        duration * 0.4,
-                        duration * 0.5,
-                        duration * 0.6
-                    ]
-                
-                # 各タイムスタンプでフレームを抽出して品質を評価
-                best_frame = None
-                best_score = -1
-                best_timestamp = timestamps[0]
-                
-                for ts in timestamps:
-                    frame, metadata = extract_frame_at_timestamp(tmp_video.name, ts)
-                    if frame is not None:
-                        score = calculate_frame_quality(frame)
-                        logger.info(f"Frame at {ts:.1f}s: quality score = {score:.3f}")
-                        
-                        if score > best_score:
-                            best_score = score
-                            best_frame = frame
-                            best_timestamp = ts
-                
-                if best_frame is None:
-                    logger.error(f"Failed to extract any frame from video: {video_url}")
-                    return None
-                
-                frame = best_frame
-                logger.info(f"Selected best frame at {best_timestamp:.1f}s with score {best_score:.3f}")
-                
-            else:
-                # time_offsetが指定されている場合は単一フレーム抽出
-                frame, _ = extract_frame_at_timestamp(tmp_video.name, time_offset)
-                if frame is None:
-                    logger.error(f"Failed to extract frame at {time_offset}s from video: {video_url}")
-                    return None
-            
-            # BGRからRGBに変換
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            
-            # PILイメージに変換
-            image = Image.fromarray(frame_rgb)
-            
-            # サムネイルサイズにリサイズ（アスペクト比を維持）
-            max_size = (800, 600)
-            image.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
-            # 一時ファイルとして保存
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp_thumb:
-                image.save(tmp_thumb.name, 'JPEG', quality=85, optimize=True)
-                
-                # Cloud Storageにアップロード
-                client = storage.Client()
-                bucket = client.bucket(bucket_name)
-                blob = bucket.blob(output_path)
-                
-                blob.upload_from_filename(tmp_thumb.name)
-                blob.make_public()  # 公開アクセスを許可
-                
-                # 一時ファイルを削除
-                os.unlink(tmp_thumb.name)
-            
-            # 一時動画ファイルを削除
-            os.unlink(tmp_video.name)
-            
-            # gs:// URLを返す
-            return f"gs://{bucket_name}/{output_path}"
-            
-    except Exception as e:
-        logger.error(f"Error generating video thumbnail: {str(e)}")
-        return None
+    result = generate_video_thumbnail_renditions(video_url, bucket_name, output_path, time_offset)
+    return result["thumbnail_url"] if result else None
 
 
 def convert_gs_to_https(gs_url: str) -> str:
@@ -277,22 +566,83 @@ def get_thumbnail_path(video_path: str) -> str:
     return os.path.join(thumb_dir, thumb_filename).replace('\\', '/')
 
 
-def extract_video_metadata(video_path: str) -> dict:
-    """動画のメタデータを抽出"""
+def get_rendition_path(thumbnail_path: str, width: int, fmt: str) -> str:
+    """
+    サムネイルパスからレンディションのパスを生成
+
+    例: thumbnails/2025/01/video_thumb.jpg, 400, webp -> thumbnails/2025/01/video_thumb_400.webp
+    """
+    base, _ = os.path.splitext(thumbnail_path)
+    extension = THUMBNAIL_RENDITION_FORMATS[fmt][0]
+    return f"{base}_{width}.{extension}"
+
+
+def get_thumbnail_renditions(bucket_name: str, thumbnail_path: str) -> List[Dict[str, Any]]:
+    """
+    サムネイルパスに対応する全レンディションの一覧（幅の小さい順）
+
+    Returns:
+        [{"width": 160, "height": 120, "format": "webp", "url": "gs://..."}, ...]
+        width/heightはアスペクト比を維持して収める最大サイズ
+    """
+    return [
+        {
+            "width": width,
+            "height": THUMBNAIL_RENDITION_SIZES[width][1],
+            "format": fmt,
+            "url": f"gs://{bucket_name}/{get_rendition_path(thumbnail_path, width, fmt)}",
+        }
+        for width in sorted(THUMBNAIL_RENDITION_SIZES)
+        for fmt in THUMBNAIL_RENDITION_FORMATS
+    ]
+
+
+def extract_video_metadata(video) -> Dict[str, Any]:
+    """
+    動画のメタデータを抽出
+
+    Args:
+        video: 開いているcv2.VideoCapture、または動画ファイルのパス
+
+    Returns:
+        {"width", "height", "fps", "duration", "frame_count", "rotation", "codec"}、失敗時は空のdict
+        width/heightは回転を適用した表示上のサイズ、rotationはコンテナに記録された回転角（度）
+    """
+    cap = video if isinstance(video, cv2.VideoCapture) else cv2.VideoCapture(video)
     try:
-        cap = cv2.VideoCapture(video_path)
-        
-        metadata = {
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        tag = ''.join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip('\x00 ').lower()
+
+        return {
+            # 自動回転が有効な場合、OpenCVは回転後のサイズを返す
             'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
             'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
-            'fps': cap.get(cv2.CAP_PROP_FPS),
-            'frame_count': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
-            'duration': cap.get(cv2.CAP_PROP_FRAME_COUNT) / cap.get(cv2.CAP_PROP_FPS)
+            'fps': round(fps, 3),
+            'duration': round(frame_count / fps, 3) if fps > 0 else 0,
+            'frame_count': frame_count,
+            'rotation': int(cap.get(cv2.CAP_PROP_ORIENTATION_META)) % 360,
+            'codec': VIDEO_CODEC_NAMES.get(tag, tag),
         }
-        
-        cap.release()
-        return metadata
-        
+
     except Exception as e:
         logger.error(f"Error extracting video metadata: {str(e)}")
-        return {}
\ No newline at end of file
+        return {}
+
+    finally:
+        if cap is not video:
+            cap.release()
+
+
+def get_saved_video_metadata(bucket, thumbnail_path: str) -> Dict[str, Any]:
+    """
+    サムネイル生成時に従来パスのサムネイルに保存した動画のメタデータを取得
+
+    Returns:
+        extract_video_metadataと同じ形式、保存されていない場合は空のdict
+    """
+    blob = bucket.get_blob(thumbnail_path)
+    if blob is None or not blob.metadata or 'video_metadata' not in blob.metadata:
+        return {}
+    return json.loads(blob.metadata['video_metadata'])
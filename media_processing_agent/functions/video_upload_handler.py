@@ -1,29 +1,56 @@
 """
-Cloud Function to handle video uploads and generate thumbnails
+Cloud Function to handle media uploads and generate thumbnails / image renditions
 """
 from firebase_functions import storage_fn, options
-from firebase_admin import initialize_app
+from firebase_admin import initialize_app, firestore
 from google.cloud import storage as gcs
 import logging
 import os
+import time
 
 # ローカルの関数をインポート
-from video_thumbnail import generate_video_thumbnail, get_thumbnail_path, is_video_file
+from image_renditions import (
+    delete_media_renditions,
+    generate_image_renditions,
+    get_image_rendition_paths,
+    is_generated_path,
+    is_image_file,
+    save_image_renditions,
+)
+from thumbnail_claim import ensure_video_thumbnail, get_claim_path
+from video_preview import (
+    generate_video_preview,
+    get_preview_path,
+    is_preview_enabled,
+    save_video_preview,
+)
+from vector_gc import delete_media_analysis
+from video_thumbnail import (
+    get_thumbnail_path,
+    get_thumbnail_renditions,
+    is_video_file,
+)
 
 # Firebase Admin SDKの初期化
 initialize_app()
 
 logger = logging.getLogger(__name__)
 
+# サムネイル（他のワーカーの生成待ち THUMBNAIL_CLAIM_WAIT_SEC を含む）とプレビュー変換を合わせた上限
+# プレビューの変換は残り時間に収まるようにタイムアウトを短くする
+UPLOAD_TRIGGER_TIMEOUT_SEC = 540
+
 @storage_fn.on_object_finalized(
     bucket="hackason-464007.firebasestorage.app",
-    timeout_sec=300,  # 5分のタイムアウト
-    memory=options.MemoryOption.GB_1
+    timeout_sec=UPLOAD_TRIGGER_TIMEOUT_SEC,  # イベントトリガーの上限（9分）
+    memory=options.MemoryOption.GB_2  # プレビュー変換のため1 vCPUを割り当てる
 )
 def generate_thumbnail_on_upload(event: storage_fn.CloudEvent[storage_fn.StorageObjectData]) -> None:
     """
-    動画ファイルがアップロードされた時に自動的にサムネイルを生成
+    動画ファイルがアップロードされた時に自動的にサムネイルと低ビットレートのプレビューを生成
+    写真の場合は縮小版のレンディションとプレースホルダーを生成
     """
+    deadline = time.monotonic() + UPLOAD_TRIGGER_TIMEOUT_SEC
     try:
         # イベントデータを取得
         file_path = event.data.name
@@ -31,39 +58,51 @@ def generate_thumbnail_on_upload(event: storage_fn.CloudEvent[storage_fn.Storage
         
         logger.info(f"File uploaded: gs://{bucket_name}/{file_path}")
         
+        # 自分が生成したサムネイル・レンディションは処理しない
+        if is_generated_path(file_path):
+            return
+        
+        if is_image_file(file_path):
+            result = generate_image_renditions(bucket_name, file_path)
+            if result:
+                updated = save_image_renditions(firestore.client(), result)
+                logger.info(f"Saved image renditions for gs://{bucket_name}/{file_path} ({updated} analysis results updated)")
+            return
+        
         # 動画ファイルかチェック
         if not is_video_file(file_path):
-            logger.info(f"Not a video file, skipping: {file_path}")
+            logger.info(f"Not a video or image file, skipping: {file_path}")
             return
         
         # サムネイルのパスを生成
         thumbnail_path = get_thumbnail_path(file_path)
         
-        # サムネイルが既に存在するかチェック
-        storage_client = gcs.Client()
-        bucket = storage_client.bucket(bucket_name)
-        thumbnail_blob = bucket.blob(thumbnail_path)
-        
-        if thumbnail_blob.exists():
-            logger.info(f"Thumbnail already exists: gs://{bucket_name}/{thumbnail_path}")
-            return
-        
         # 動画のgs:// URLを構築
         video_url = f"gs://{bucket_name}/{file_path}"
         
-        # サムネイルを生成（自動的に最適なフレームを選択）
+        # サムネイルを生成（分析処理と同時に実行された場合はどちらか一方だけが生成する）
         logger.info(f"Generating thumbnail for video: {video_url}")
-        thumbnail_url = generate_video_thumbnail(
+        thumbnail = ensure_video_thumbnail(
             video_url=video_url,
             bucket_name=bucket_name,
-            output_path=thumbnail_path,
-            time_offset=None  # 自動選択モード
+            thumbnail_path=thumbnail_path,
+            caller="storage_trigger",
         )
         
-        if thumbnail_url:
-            logger.info(f"Successfully generated thumbnail: {thumbnail_url}")
+        if thumbnail:
+            logger.info(
+                f"Thumbnail ready: {thumbnail['thumbnail_url']} "
+                f"({len(thumbnail['renditions'])} renditions)"
+            )
         else:
             logger.error(f"Failed to generate thumbnail for: {video_url}")
+        
+        # Web・モバイルで再生するプレビューを生成（サムネイルとは独立して実行）
+        if is_preview_enabled():
+            preview = generate_video_preview(bucket_name, file_path, deadline=deadline)
+            if preview:
+                updated = save_video_preview(firestore.client(), preview)
+                logger.info(f"Saved video preview for {video_url} ({updated} analysis results updated)")
             
     except Exception as e:
         logger.error(f"Error in generate_thumbnail_on_upload: {str(e)}")
@@ -76,13 +115,40 @@ def generate_thumbnail_on_upload(event: storage_fn.CloudEvent[storage_fn.Storage
 )
 def delete_thumbnail_on_video_delete(event: storage_fn.CloudEvent[storage_fn.StorageObjectData]) -> None:
     """
-    動画ファイルが削除された時に対応するサムネイルも削除
+    メディアファイルが削除された時に分析結果とレンディション情報（media_renditions）を削除し、
+    写真の場合は縮小版のレンディション、動画の場合はサムネイルとプレビューも削除
+    （ベクトルストアのデータポイントは分析結果の削除トリガーで削除される）
     """
     try:
         # イベントデータを取得
         file_path = event.data.name
         bucket_name = event.data.bucket
-        
+
+        # 生成したファイル自体の削除は対象外
+        if is_generated_path(file_path):
+            return
+
+        media_uri = f"gs://{bucket_name}/{file_path}"
+        db = firestore.client()
+        try:
+            delete_media_analysis(db, media_uri)
+        except Exception as e:
+            logger.error(f"Failed to delete analysis results for {media_uri}: {e}")
+
+        if is_image_file(file_path) or is_video_file(file_path):
+            try:
+                delete_media_renditions(db, media_uri)
+            except Exception as e:
+                logger.error(f"Failed to delete media renditions for {media_uri}: {e}")
+
+        if is_image_file(file_path):
+            # サイズ・フォーマット別の縮小版を削除（存在しないものは無視）
+            bucket = gcs.Client().bucket(bucket_name)
+            rendition_blobs = [bucket.blob(path) for path in get_image_rendition_paths(file_path)]
+            bucket.delete_blobs(rendition_blobs, on_error=lambda blob: None)
+            logger.info(f"Deleted {len(rendition_blobs)} image renditions for: {file_path}")
+            return
+
         # 動画ファイルかチェック
         if not is_video_file(file_path):
             return
@@ -99,5 +165,19 @@ def delete_thumbnail_on_video_delete(event: storage_fn.CloudEvent[storage_fn.Sto
             thumbnail_blob.delete()
             logger.info(f"Deleted thumbnail: gs://{bucket_name}/{thumbnail_path}")
         
+        # サイズ・フォーマット別のレンディションも削除（存在しないものは無視）
+        prefix = f"gs://{bucket_name}/"
+        rendition_blobs = [
+            bucket.blob(rendition["url"][len(prefix):])
+            for rendition in get_thumbnail_renditions(bucket_name, thumbnail_path)
+        ]
+        # 生成途中で削除された場合に残るクレーム用オブジェクトも削除
+        rendition_blobs.append(bucket.blob(get_claim_path(thumbnail_path)))
+        # プレビュー（MP4・アニメーションWebP）も削除
+        rendition_blobs.append(bucket.blob(get_preview_path(file_path)))
+        rendition_blobs.append(bucket.blob(get_preview_path(file_path, "loop", "webp")))
+        bucket.delete_blobs(rendition_blobs, on_error=lambda blob: None)
+        logger.info(f"Deleted {len(rendition_blobs)} thumbnail renditions for: {thumbnail_path}")
+        
     except Exception as e:
         logger.error(f"Error in delete_thumbnail_on_video_delete: {str(e)}")
\ No newline at end of file
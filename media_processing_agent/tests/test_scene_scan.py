@@ -0,0 +1,50 @@
+"""
+scene_scan のシーン区間の検出（find_segments）と、予算内の走査位置の計画（plan_scan_timestamps）の確認
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+from scene_scan import EDGE_MARGIN, MAX_SCAN_POINTS, find_segments, plan_scan_timestamps  # noqa: E402
+
+
+def test_cuts_split_the_scan_into_segments():
+    hist_diffs = np.array([0.01, 0.02, 0.9, 0.01, 0.03, 0.8, 0.02])
+
+    assert find_segments(hist_diffs) == [range(0, 3), range(3, 6), range(6, 8)]
+
+
+def test_gradual_changes_below_the_minimum_threshold_are_not_cuts():
+    assert find_segments(np.full(9, 0.25)) == [range(0, 10)]
+    assert find_segments(np.array([])) == [range(0, 1)]
+
+
+def test_noisy_footage_raises_the_cut_threshold():
+    # 差分が全体に大きい（手ブレなど）場合は、中央値+MADを超えた位置だけを切り替わりとする
+    hist_diffs = np.array([0.35, 0.4, 0.38, 0.42, 0.95, 0.37, 0.41])
+
+    assert find_segments(hist_diffs) == [range(0, 5), range(5, 8)]
+
+
+def test_short_video_is_scanned_evenly_inside_the_margins():
+    timestamps = plan_scan_timestamps(duration=10, fps=30, frame_budget=600, max_candidates=5, seek_cost_frames=30)
+
+    assert len(timestamps) == MAX_SCAN_POINTS
+    assert timestamps == sorted(timestamps)
+    assert 10 * EDGE_MARGIN < timestamps[0] and timestamps[-1] < 10 * (1 - EDGE_MARGIN)
+
+
+def test_long_video_seeks_within_the_frame_budget():
+    frame_budget, max_candidates, seek_cost = 600, 5, 30
+    timestamps = plan_scan_timestamps(600, 30, frame_budget, max_candidates, seek_cost)
+
+    assert len(timestamps) == (frame_budget - max_candidates * (seek_cost + 1)) // (seek_cost + 1)
+    assert (len(timestamps) + max_candidates) * (seek_cost + 1) <= frame_budget
+
+
+def test_nothing_is_scanned_without_a_budget_or_duration():
+    assert plan_scan_timestamps(600, 30, frame_budget=100, max_candidates=5, seek_cost_frames=30) == []
+    assert plan_scan_timestamps(0, 30, frame_budget=600, max_candidates=5, seek_cost_frames=30) == []